@@ -1,9 +1,21 @@
-from flask import Flask, render_template, jsonify, request, flash, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, flash, redirect, url_for, session
+from werkzeug.local import LocalProxy
 from datetime import datetime
 import json
+import threading
+import time
+import zlib
 from esp_sender import esp_sender
 from esp_connector import esp_connector
-from config import ESP_DEVICES
+from config import ESP_DEVICES, GATEWAYS
+import event_bus
+import fragment_cache
+import gateway_registry
+import price_import
+import price_schedule
+import tag_codec
+import tag_render
+import tag_store
 
 #
 # Основной код для веб интерфейса
@@ -12,8 +24,8 @@ from config import ESP_DEVICES
 app = Flask(__name__)
 app.secret_key = 'dev-secret-key-123'
 
-# Заранее заданные данные ценников 
-PRICE_TAGS = [
+# Заранее заданные данные ценников (в базу при первом запуске)
+DEFAULT_TAGS = [
     {
         "id": 11,
         "name": "Shluz",
@@ -21,7 +33,8 @@ PRICE_TAGS = [
         "weight": 0.5,
         "battery_level": 85,
         "last_seen": datetime.now().isoformat(),
-        "esp_ip": "10.133.210.157"  # IP ESP32
+        "esp_ip": "10.133.210.157",  # IP ESP32
+        "render": "tag"  # "tag" - ценник рисует сам, "server" - готовое изображение отсюда
     }
 ]
 
@@ -30,8 +43,20 @@ USERS = {
     "admin": {"password": "admin123", "role": "admin"}
 }
 
-current_user = None
-user_role = None
+# Ценники - в общей базе (tag_store.py), сервер можно запускать
+# в несколько процессов: gunicorn -w 4 --threads 8 app:app.
+# Открытая страница держит поток процесса (/api/events), таких потоков
+# у процесса не больше event_bus.MAX_CLIENTS, см. event_bus.py.
+# При импорте только подключение к базе: ценники по умолчанию и шлюзы
+# настраивает один процесс (setup)
+store = tag_store.TagStore()
+
+# Вход - в подписанной cookie сессии Flask, у каждого браузера свой
+current_user = LocalProxy(lambda: session.get('user'))
+user_role = LocalProxy(lambda: session.get('role'))
+
+# Отрисованные строки таблиц и карточки страниц, см. fragment_cache.py
+fragments = fragment_cache.FragmentCache()
 
 def sort_tags(tags, sort_by='name', sort_order='asc'):
     """Сортировка списка ценников"""
@@ -50,6 +75,273 @@ def sort_tags(tags, sort_by='name', sort_order='asc'):
     else:
         return tags
 
+
+def render_tag(tag):
+    return tag_render.render_image(tag['name'], tag['weight'], tag['current_price'],
+                                   tag.get('layout'))
+
+
+def send_rendered_tag(tag, image=None, ip=None):
+    """
+    Режим render="server": ценник рисуется здесь тем же макетом, на шлюз
+    уходит сжатая разность с последним подтвержденным изображением
+    (ключевой кадр, если подтвержденного нет). image - уже отрисованный кадр,
+    ip - шлюз (по умолчанию tag['esp_ip'])
+    """
+    if image is None:
+        image = render_tag(tag)
+    acked = (store.bitmap(tag['id']) or {}).get('acked')
+    update = tag_render.bitmap_update(image, acked)
+    print(f"Изображение: {update['bytes']} байт "
+          f"({'разность' if acked else 'ключевой кадр'})")
+    
+    result = esp_sender.send_bitmap(ip or tag['esp_ip'], str(tag['id']), update)
+    if result['success']:
+        store.set_bitmap(tag['id'], acked, image)
+    return result
+
+
+def update_bitmap_delivery(tag, state):
+    """Изображение подтверждено - база для следующей разности, не доставлено - ключевой кадр"""
+    if state in ('delivered', 'failed'):
+        store.settle_bitmap(tag['id'], state == 'delivered')
+
+
+# События для открытых страниц (SSE) через журнал в базе, см. event_bus.py
+events = event_bus.EventBus(journal=store)
+
+BACKGROUND_POLL_S = 2
+background = None
+background_lock = threading.Lock()
+
+
+def publish_tag(tag):
+    events.publish('tag', {key: tag.get(key) for key in
+                           ('id', 'name', 'current_price', 'weight', 'battery_level', 'last_seen', 'esp_ip')})
+
+
+def publish_delivery(tag):
+    delivery = tag.get('delivery') or {}
+    events.publish('delivery', {'id': tag['id'], 'seq': delivery.get('seq'),
+                                'state': delivery.get('state', 'unknown')})
+
+
+def apply_delivery(tag, delivery):
+    """Состояние доставки из ответа шлюза (по ACK от ценника), об изменении - событие"""
+    old = tag.get('delivery')
+    new = {
+        'seq': (delivery or {}).get('acked_seq'),
+        'state': delivery['state'] if delivery else 'unknown'
+    }
+    update_bitmap_delivery(tag, new['state'])
+    if new != old:
+        # пока шел запрос, ценник могли отправить заново - тогда ответ шлюза устарел
+        tag = store.update(tag['id'], lambda current: {'delivery': new}
+                           if current.get('delivery') == old else None)
+        if tag is not None and tag.get('delivery') == new:
+            publish_delivery(tag)
+
+
+def refresh_delivery(tag):
+    """Состояние доставки одного ценника у шлюза"""
+    ip = tag['esp_ip']
+    result = gateways.request(ip, lambda: esp_sender.get_delivery_status(ip, str(tag['id'])))
+    if result['success']:
+        apply_delivery(tag, result.get('delivery'))
+    return result
+
+
+def poll_deliveries():
+    """
+    Ожидающие ACK ценники опрашиваются здесь, один запрос к шлюзу на всех
+    открытых клиентов, а не перезагрузкой страниц. /api/status шлюза отдает
+    доставку всех его ценников: запрос - один на шлюз, а не на ценник, и через
+    место на шлюзе (concurrency), как отправка
+    """
+    pending = {}
+    for tag in store.tags():
+        if (tag.get('delivery') or {}).get('state') == 'pending':
+            pending.setdefault(tag['esp_ip'], []).append(tag)
+    for ip, tags in pending.items():
+        try:
+            result = gateways.request(ip, lambda: esp_sender.get_delivery_statuses(ip))
+        except Exception as e:
+            print(f"Ошибка опроса доставки {ip}: {e}")
+            continue
+        if not result['success']:
+            continue
+        for tag in tags:
+            try:
+                apply_delivery(tag, result['delivery'].get(str(tag['id'])))
+            except Exception as e:
+                print(f"Ошибка опроса доставки {tag['id']}: {e}")
+
+
+def sync_schedule(reported):
+    """
+    Пакеты из базы (POST /api/schedule мог принять любой процесс) - в планировщик,
+    отчеты планировщика - в базу. reported - id -> последний записанный отчет
+    """
+    for batch in store.batches():
+        known = scheduler.batches.get(batch['id'])
+        if known is None:
+            # новый пакет или пакет процесса, который перестал быть ведущим
+            # (fired - тот уже начал отправку, хотя отчет еще не записал)
+            if batch['state'] in ('new', 'waiting', 'staged') and batch['fired'] is None:
+                scheduler.schedule(batch['at'], batch['changes'], batch_id=batch['id'])
+        elif batch['state'] == 'cancelled' and known['state'] != 'cancelled':
+            scheduler.cancel(batch['id'])
+    for batch in list(scheduler.batches.values()):
+        report = scheduler.report(batch)
+        if reported.get(batch['id']) != report:
+            store.set_batch_report(batch['id'], report)
+            reported[batch['id']] = report
+
+
+def background_loop():
+    """Фоновые задачи (отложенные изменения, опрос доставки) - в одном процессе из всех"""
+    reported = {}
+    while True:
+        try:
+            if store.lead():
+                setup()
+                sync_schedule(reported)
+                poll_deliveries()
+        except Exception as e:
+            print(f"Ошибка фоновой задачи: {e}")
+        time.sleep(BACKGROUND_POLL_S)
+
+
+@app.before_request
+def start_background():
+    # с первого запроса: процесс-наблюдатель перезагрузчика (debug=True) запросы не обслуживает
+    global background
+    with background_lock:
+        if background is None:
+            background = threading.Thread(target=background_loop, daemon=True)
+            background.start()
+
+
+def send_tag(tag, ip, esp_data=None, image=None):
+    """
+    Текущие данные ценника на шлюз ip: товар или готовое изображение (render="server").
+    esp_data / image - подготовленные заранее (отложенные изменения)
+    """
+    if tag.get('render') == 'server':
+        send_result = send_rendered_tag(tag, image, ip)
+    else:
+        if esp_data is None:
+            esp_data = tag_codec.price_request(tag['id'], tag['name'], tag['current_price'], tag['weight'])
+        # sent_via - шлюз, который отправлял ценнику последним: если с тех пор ценник
+        # обновлял другой шлюз, отметка этого "то же содержимое уже доставлено" устарела
+        send_result = esp_sender.send_to_esp(ip, esp_data, force=ip != tag.get('sent_via'))
+        store.drop_bitmap(tag['id'])
+    
+    if send_result['success']:
+        changes = {
+            # Обновляем время последнего обновления
+            'last_seen': datetime.now().isoformat(),
+            # статус доставки - у шлюза, который отправил (резервный при отказе основного)
+            'esp_ip': ip,
+            'sent_via': ip
+        }
+        
+        if 'response_data' in send_result:
+            resp = send_result['response_data']
+            if 'battery' in resp:
+                changes['battery_level'] = resp['battery']
+            # "pending" до ACK от ценника, опрашивает poll_deliveries
+            changes['delivery'] = {
+                'seq': resp.get('seq'),
+                'state': resp.get('delivery') or 'unknown'
+            }
+        tag = store.update(tag['id'], changes) or tag
+        if 'delivery' in changes:
+            publish_delivery(tag)
+    publish_tag(tag)
+    return send_result
+
+
+def push_tag(tag, esp_data=None, image=None):
+    """Отправка сразу через основной шлюз ценника, при отказе - через резервный"""
+    return gateways.send_now(tag, lambda ip: send_tag(tag, ip, esp_data, image))
+
+
+def enqueue_push(tag):
+    """В очередь шлюза ценника (загрузка прайс-листа), отправка в фоне"""
+    # уходят данные на момент отправки
+    gateways.submit(tag, lambda ip: send_tag(store.tag(tag['id']) or tag, ip))
+
+
+def stage_scheduled(tag_id, changes):
+    """Данные для шлюза заранее: ценник с изменениями отрисован / упакован, но не изменен"""
+    tag = store.tag(tag_id)
+    if tag is None:
+        return None
+    future = dict(tag, **changes)
+    if tag.get('render') == 'server':
+        staged = (tag, changes, None, render_tag(future))
+    else:
+        staged = (tag, changes, tag_codec.price_request(tag_id, future['name'], future['current_price'],
+                                                        future['weight']), None)
+    return gateways.route(tag).id, staged
+
+
+def send_scheduled(staged):
+    tag, changes, esp_data, image = staged
+    tag = store.update(tag['id'], changes)
+    if tag is None:
+        return False
+    return push_tag(tag, esp_data, image)['success']
+
+
+def assign_gateways():
+    """Основные шлюзы ценникам; в базу - только изменившиеся"""
+    tags = [dict(tag) for tag in store.tags()]
+    before = {tag['id']: (tag.get('gateway'), tag['esp_ip']) for tag in tags}
+    unassigned = gateways.assign(tags)
+    store.update_many([(tag['id'], {'gateway': tag['gateway'], 'esp_ip': tag['esp_ip']}) for tag in tags
+                       if before[tag['id']] != (tag['gateway'], tag['esp_ip'])])
+    return unassigned
+
+
+# Шлюзы и распределение ценников по ним, см. gateway_registry.py;
+# места (concurrency) и доступность шлюзов - в базе, общие для всех процессов
+gateways = gateway_registry.GatewayRegistry(GATEWAYS, listener=lambda status: events.publish('gateway', status),
+                                            shared=store)
+
+
+def setup():
+    """
+    Начальная настройка: ценники по умолчанию (первый запуск) и распределение
+    по шлюзам из config.GATEWAYS. Выполняет ведущий процесс (background_loop)
+    или flask --app app init-db до запуска процессов; повторно - только если
+    шлюзы или ценники по умолчанию изменились, поэтому перезапуск не сбрасывает
+    esp_ip ценников, ушедших через резервный шлюз
+    """
+    fingerprint = zlib.crc32(json.dumps([GATEWAYS, [tag['id'] for tag in DEFAULT_TAGS]],
+                                        sort_keys=True).encode())
+    if store.setup_done(fingerprint):
+        return False
+    store.seed(DEFAULT_TAGS)
+    unassigned = assign_gateways()
+    store.mark_setup(fingerprint)
+    print(f"Ценники распределены по шлюзам, без шлюза: {unassigned}")
+    return True
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Ценники по умолчанию и шлюзы - один раз перед gunicorn"""
+    if not setup():
+        print("Настройка уже выполнена")
+
+# Отложенные изменения цен, см. price_schedule.py; пакеты - в базе,
+# отправляет ведущий процесс (background_loop), каждый пакет - один раз
+# (отметка fired в базе), даже если ведущий сменился в момент отправки
+scheduler = price_schedule.Scheduler(stage_scheduled, send_scheduled, claim=store.claim_batch)
+
+
 # Главная страница
 @app.route('/')
 def index():
@@ -57,31 +349,38 @@ def index():
     if not current_user:
         return redirect('/login')
     
+    snapshot = store.snapshot()
+    tags = snapshot.values
+    
     # Статистика
-    total_tags = len(PRICE_TAGS)
+    total_tags = len(tags)
     
     # Информация о последнем обновлении
-    last_update = max(tag['last_seen'] for tag in PRICE_TAGS) if PRICE_TAGS else "Нет данных"
+    last_update = max(tag['last_seen'] for tag in tags) if tags else "Нет данных"
+    
+    # строки и карточки - из кэша, заново рисуются только изменившиеся ценники
+    row = fragments.template(app.jinja_env, 'fragments/index_row.html')
+    stats = fragments.template(app.jinja_env, 'fragments/stats.html')
     
     return render_template('index.html',
                          total_tags=total_tags,
                          last_update=last_update,
-                         PRICE_TAGS=PRICE_TAGS, 
+                         stats=stats('index', snapshot.version, total_tags=total_tags),
+                         rows=[row(tag['id'], snapshot.versions[tag['id']], tag=tag) for tag in tags],
+                         PRICE_TAGS=tags, 
                          current_user=current_user,
                          user_role=user_role)
 
 # Страница входа
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-    global current_user, user_role
-    
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         
         if username in USERS and USERS[username]["password"] == password:
-            current_user = username
-            user_role = USERS[username]["role"]
+            session['user'] = username
+            session['role'] = USERS[username]["role"]
             flash(f'Добро пожаловать, {username}!', 'success')
             return redirect('/')
         else:
@@ -92,9 +391,8 @@ def login():
 # Выход
 @app.route('/logout')
 def logout():
-    global current_user, user_role
-    current_user = None
-    user_role = None
+    session.pop('user', None)
+    session.pop('role', None)
     flash('Вы вышли из системы', 'info')
     return redirect('/login')
 
@@ -104,7 +402,8 @@ def tags_list():
     if not current_user:
         return redirect('/login')
     
-    tags = PRICE_TAGS.copy()
+    snapshot = store.snapshot()
+    tags = snapshot.values
         
     search = request.args.get('search', '')
     
@@ -115,9 +414,11 @@ def tags_list():
         tags = [t for t in tags if search.lower() in t['name'].lower()]
     
     tags = sort_tags(tags, sort_by, sort_order)
+    row = fragments.template(app.jinja_env, 'fragments/tags_row.html')
     
     return render_template('tags.html',
                          tags=tags,
+                         rows=[row(tag['id'], snapshot.versions[tag['id']], tag=tag) for tag in tags],
                          search=search,
                          sort_by=sort_by,
                          sort_order=sort_order,
@@ -130,13 +431,17 @@ def tag_detail(tag_id):
     if not current_user:
         return redirect('/login')
     
-    tag = next((t for t in PRICE_TAGS if t['id'] == tag_id), None)
+    snapshot = store.snapshot()
+    tag = snapshot.tags.get(tag_id)
     if not tag:
         flash('Ценник не найден', 'danger')
         return redirect('/tags')
     
+    detail = fragments.template(app.jinja_env, 'fragments/tag_detail.html')
+    
     return render_template('tag_detail.html',
                          tag=tag,
+                         detail=detail(tag_id, snapshot.versions[tag_id], tag=tag),
                          current_user=current_user,
                          user_role=user_role)
 
@@ -147,13 +452,11 @@ def edit_tag(tag_id):
         return redirect('/login')
     
     # Находим ценник
-    tag_index = next((i for i, t in enumerate(PRICE_TAGS) if t['id'] == tag_id), None)
-    if tag_index is None:
+    tag = store.tag(tag_id)
+    if tag is None:
         flash('Ценник не найден', 'danger')
         return redirect('/tags')
     
-    tag = PRICE_TAGS[tag_index]
-    
     if request.method == 'POST':
         # Получаем данные из формы
         new_name = request.form['name'].strip()
@@ -172,17 +475,22 @@ def edit_tag(tag_id):
             'weight': old_weight != new_weight
         }
         
-        # Обновляем данные в системе
-        tag['name'] = new_name
-        tag['current_price'] = new_current_price
-        tag['weight'] = new_weight
-        
         any_changes = any(fields_changed.values())
         
         if not any_changes:
             flash('Данные не изменились', 'info')
             return redirect(f'/tag/{tag_id}')
         
+        # Обновляем данные в системе
+        tag = store.update(tag_id, {
+            'name': new_name,
+            'current_price': new_current_price,
+            'weight': new_weight
+        })
+        if tag is None:
+            flash('Ценник не найден', 'danger')
+            return redirect('/tags')
+        
         # Формируем сообщение о сохранении
         changed_fields_list = []
         for field, changed in fields_changed.items():
@@ -204,19 +512,8 @@ def edit_tag(tag_id):
             print(f"ОТПРАВКА НА ESP32 ({tag['esp_ip']})")
             print(f"{'='*60}")
             
-            # Формируем данные для ESP32
-            esp_data = {
-                "device_id": str(tag_id),
-                "product_name": tag['name'],
-                "current_price": float(tag['current_price']),
-                "weight": float(tag['weight'])
-            }
-            
-            print(f"Данные для ESP32:")
-            print(json.dumps(esp_data, ensure_ascii=False, indent=2))
-            
-            # Отправляем на ESP32
-            send_result = esp_sender.send_to_esp(tag['esp_ip'], esp_data)
+            # Отправляем на ESP32 (данные запроса собирает send_tag)
+            send_result = push_tag(tag)
             
             if send_result['success']:
                 print(f"УСПЕШНО ОТПРАВЛЕНО!")
@@ -224,14 +521,6 @@ def edit_tag(tag_id):
                 print(f"   Статус: HTTP {send_result.get('status_code', 'N/A')}")
                 
                 flash(f'📡 Отправлено на ESP32', 'success')
-                
-                # Обновляем время последнего обновления
-                tag['last_seen'] = datetime.now().isoformat()
-                
-                if 'response_data' in send_result:
-                    resp = send_result['response_data']
-                    if 'battery' in resp:
-                        tag['battery_level'] = resp['battery']
                         
             else:
                 print(f"ОШИБКА ОТПРАВКИ!")
@@ -271,7 +560,7 @@ def test_esp_connection(tag_id):
         return jsonify({'error': 'Требуется авторизация'}), 401
     
     # Находим ценник
-    tag = next((t for t in PRICE_TAGS if t['id'] == tag_id), None)
+    tag = store.tag(tag_id)
     if not tag:
         return jsonify({'error': 'Ценник не найден'}), 404
     
@@ -298,7 +587,7 @@ def test_esp_connection(tag_id):
     
     # Обновляем статус устройства
     if test_result['success']:
-        tag['last_seen'] = datetime.now().isoformat()
+        changes = {'last_seen': datetime.now().isoformat()}
         
         success_message = f"Соединение с ESP32 установлено! IP: {tag['esp_ip']}"
         if test_result.get('status_code'):
@@ -306,15 +595,14 @@ def test_esp_connection(tag_id):
         if test_result.get('response_data'):
             resp = test_result['response_data']
             if 'battery' in resp:
-                tag['battery_level'] = resp['battery']
+                changes['battery_level'] = resp['battery']
                 success_message += f", Батарея: {resp['battery']}%"
         
-        flash(success_message, 'success')
-        print(f"УСПЕШНОЕ СОЕДИНЕНИЕ!")
+        # страница покажет ответ сама, данные ценника обновит событие
+        publish_tag(store.update(tag_id, changes) or tag)
+        print(f"УСПЕШНОЕ СОЕДИНЕНИЕ! {success_message}")
     else:
-        error_message = f"Не удалось подключиться к ESP32 ({tag['esp_ip']})"
-        flash(error_message, 'danger')
-        print(f"ОШИБКА СОЕДИНЕНИЯ!")
+        print(f"ОШИБКА СОЕДИНЕНИЯ! ({tag['esp_ip']})")
     
     print(f"{'='*60}\n")
     
@@ -326,7 +614,7 @@ def send_test_data_to_esp(tag_id):
     if not current_user:
         return jsonify({'error': 'Требуется авторизация'}), 401
     
-    tag = next((t for t in PRICE_TAGS if t['id'] == tag_id), None)
+    tag = store.tag(tag_id)
     if not tag:
         return jsonify({'error': 'Ценник не найден'}), 404
     
@@ -344,21 +632,67 @@ def send_test_data_to_esp(tag_id):
     
     # Обновляем статус устройства
     if result['success']:
-        tag['last_seen'] = datetime.now().isoformat()
-        
-        success_msg = f"Тестовые данные отправлены на ESP32! IP: {tag['esp_ip']}"
-        if result.get('status_code'):
-            success_msg += f", Статус: HTTP {result['status_code']}"
-        flash(success_msg, 'success')
+        changes = {'last_seen': datetime.now().isoformat()}
+        # ценник нарисовал тестовый товар сам, база изображения потеряна
+        store.drop_bitmap(tag_id)
         
         if 'response_data' in result:
             resp = result['response_data']
             if 'battery' in resp:
-                tag['battery_level'] = resp['battery']
-    else:
-        error_msg = f"Ошибка отправки теста на ESP32 ({tag['esp_ip']})"
-        flash(error_msg, 'danger')
+                changes['battery_level'] = resp['battery']
+        publish_tag(store.update(tag_id, changes) or tag)
+    
+    return jsonify(result)
+
+
+@app.route('/api/esp/delivery/<int:tag_id>')
+def esp_delivery(tag_id):
+    """API для получения состояния доставки по LoRa (по ACK от ценника)"""
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    tag = store.tag(tag_id)
+    if not tag:
+        return jsonify({'error': 'Ценник не найден'}), 404
+    
+    return jsonify(refresh_delivery(tag))
+
+
+@app.route('/api/esp/layout/<int:tag_id>', methods=['POST'])
+def send_layout_to_esp(tag_id):
+    """Отправка макета ценника (JSON из tag_layout.py) через шлюз"""
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    tag = store.tag(tag_id)
+    if not tag:
+        return jsonify({'error': 'Ценник не найден'}), 404
+    
+    layout = request.get_json(silent=True)
+    if not isinstance(layout, dict) or 'fields' not in layout.get('layout', layout):
+        return jsonify({'error': 'Ожидается макет {"static": [...], "fields": [...]}'}), 400
+    layout = layout.get('layout', layout)
     
+    # тем же макетом сервер рисует ценник (render="server"): макет, который
+    # здесь не рисуется, не уходит на шлюз и не сохраняется
+    try:
+        render_tag(dict(tag, layout=layout))
+    except Exception as e:
+        return jsonify({'error': f'Макет не рисуется: {e}'}), 400
+    
+    result = esp_sender.send_layout(tag['esp_ip'], str(tag_id), layout)
+    if result['success']:
+        # тем же макетом рисует и сервер (render="server"); ценник
+        # перерисовался сам, поэтому следующее изображение - ключевой кадр
+        store.drop_bitmap(tag_id)
+        tag = store.update(tag_id, {
+            'layout': layout,
+            'delivery': {
+                'seq': result['response_data'].get('seq'),
+                'state': 'pending'
+            }
+        }) or tag
+        publish_delivery(tag)
     return jsonify(result)
 
 
@@ -413,6 +747,7 @@ def batch_update():
     updates = data.get('updates', [])
     
     results = []
+    changes = []
     
     for update in updates:
         tag_id = update.get('tag_id')
@@ -427,45 +762,37 @@ def batch_update():
             })
             continue
         
-        tag_index = next((i for i, t in enumerate(PRICE_TAGS) if t['id'] == tag_id), None)
+        fields = {}
+        if new_price is not None:
+            fields['current_price'] = new_price
         
-        if tag_index is None:
-            results.append({
+        if new_weight is not None:
+            fields['weight'] = new_weight
+        # место в results - после записи в базу
+        results.append(None)
+        changes.append((len(results) - 1, tag_id, fields))
+    
+    # Обновляем данные: весь пакет одной транзакцией, страницы видят его целиком
+    tags = store.update_many([(tag_id, fields) for _, tag_id, fields in changes])
+    
+    for (index, tag_id, _), tag in zip(changes, tags):
+        if tag is None:
+            results[index] = {
                 "tag_id": tag_id,
                 "status": "error",
                 "message": "Ценник не найден"
-            })
+            }
             continue
+        publish_tag(tag)
         
-        tag = PRICE_TAGS[tag_index]
-        
-        # Обновляем данные
-        if new_price is not None:
-            tag['current_price'] = new_price
-        
-        if new_weight is not None:
-            tag['weight'] = new_weight
-        
-        results.append({
+        results[index] = {
             "tag_id": tag_id,
             "status": "success"
-        })
+        }
         
-        # Отправляем на ESP32
-        try:
-            price_data = {
-                'name': tag['name'],
-                'current_price': tag['current_price'],
-                'weight': tag['weight']
-            }
-            
-            esp_result = esp_connector.send_price_update(str(tag_id), price_data)
-            
-            if esp_result['success']:
-                tag['last_seen'] = datetime.now().isoformat()
-                
-        except Exception as e:
-            print(f"Ошибка отправки на ESP32: {e}")
+        # на шлюз - через очередь реестра, как прайс-лист: балансировка,
+        # резервный шлюз, concurrency и render="server" (send_tag)
+        enqueue_push(tag)
     
     return jsonify({
         "status": "success",
@@ -474,19 +801,146 @@ def batch_update():
     })
 
 
+@app.route('/api/import', methods=['POST'])
+def import_prices():
+    """
+    Прайс-лист CSV / NDJSON в теле запроса, читается потоком по строкам.
+    На шлюзы в фоне уходят только ценники, у которых что-то поменялось.
+    ?dry_run=1 - только посчитать
+    """
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    fmt = request.args.get('format') or price_import.detect_format(request.content_type or '')
+    dry_run = request.args.get('dry_run') in ('1', 'true')
+    changed = []
+    try:
+        # import_rows меняет ценники - ему копии из снимка
+        summary = price_import.import_rows(price_import.iter_rows(request.stream, fmt),
+                                           [dict(tag) for tag in store.tags()], changed.append,
+                                           apply=not dry_run)
+    except ValueError as e:
+        return jsonify({'error': f'Ошибка в файле: {e}'}), 400
+    
+    # весь прайс-лист - одной транзакцией, страницы не увидят его наполовину
+    store.update_many([(tag['id'], {key: tag[key] for key in ('name', 'current_price', 'weight')})
+                       for tag in changed])
+    for tag in changed:
+        enqueue_push(tag)
+    
+    print(f"Загрузка прайс-листа: {summary['rows']} строк, изменено {summary['updated']}, "
+          f"{summary['rows_per_s']} строк/с")
+    if not dry_run:
+        events.publish('notice', {'level': 'info',
+                                  'message': f"Прайс-лист загружен: изменено {summary['updated']}, "
+                                             f"отправляется {summary['pushed']} ценников"})
+    return jsonify(summary)
+
+
+@app.route('/api/schedule', methods=['GET', 'POST'])
+def schedule_prices():
+    """
+    POST {"at": "2026-10-20T08:00:00", "changes": [{"tag_id", "current_price", "weight", "name"}]}
+    - изменения вступят в силу в at (местное время сервера).
+    GET - отложенные пакеты и задержка отправки от at
+    """
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    if request.method == 'GET':
+        return jsonify([batch_report(batch) for batch in store.batches()])
+    
+    data = request.json or {}
+    try:
+        at = datetime.fromisoformat(data['at']).timestamp()
+        changes = []
+        for change in data.get('changes', []):
+            fields = {key: change[key] for key in ('name', 'current_price', 'weight') if key in change}
+            for key in ('current_price', 'weight'):
+                if key in fields:
+                    fields[key] = float(fields[key])
+            changes.append((int(change['tag_id']), fields))
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({'error': f'Неверный запрос: {e}'}), 400
+    if not changes:
+        return jsonify({'error': 'Нет изменений'}), 400
+    
+    # в планировщик пакет возьмет ведущий процесс (sync_schedule)
+    batch_id = store.add_batch(at, changes)
+    print(f"Отложенные изменения #{batch_id}: {len(changes)} ценников на {data['at']}")
+    return jsonify(batch_report({'id': batch_id, 'at': at, 'changes': changes,
+                                 'state': 'new', 'report': None}))
+
+
+def batch_report(batch):
+    """Отчет планировщика; пакет, который ведущий процесс еще не взял, - ожидающий"""
+    if batch['report'] is not None:
+        return dict(batch['report'], state=batch['state'])
+    return {'id': batch['id'], 'at': batch['at'],
+            'state': 'waiting' if batch['state'] == 'new' else batch['state'],
+            'tags': len(batch['changes']), 'gateways': 0, 'sent': 0, 'failed': 0, 'missing': 0,
+            'start_lag_s': None, 'lag_p50_s': None, 'lag_max_s': None}
+
+
+@app.route('/api/schedule/<int:batch_id>', methods=['DELETE'])
+def cancel_schedule(batch_id):
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    if not store.cancel_batch(batch_id):
+        return jsonify({'error': 'Пакет не найден или уже отправляется'}), 404
+    return jsonify({'status': 'cancelled'})
+
+
+@app.route('/api/gateways', methods=['GET', 'POST'])
+def gateways_status():
+    """GET - шлюзы, их очереди и доступность; POST - заново распределить ценники"""
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    if request.method == 'POST':
+        unassigned = assign_gateways()
+        return jsonify({'gateways': gateways.status(), 'unassigned': unassigned})
+    # распределял, возможно, другой процесс
+    gateways.count(store.tags())
+    return jsonify(gateways.status())
+
+
+@app.route('/api/events')
+def events_stream():
+    """Поток событий (text/event-stream) для страниц, см. event_bus.py"""
+    if not current_user:
+        return jsonify({'error': 'Требуется авторизация'}), 401
+    
+    last_event_id = request.headers.get('Last-Event-ID')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    client = events.subscribe(last_event_id)
+    if client is None:
+        # каждый поток держит поток сервера: остальные потоки - запросам страниц
+        return jsonify({'error': 'Открыто слишком много страниц, обновления - позже'}), 503, {'Retry-After': '60'}
+    response = Response(events.stream(client), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # ответ закрыли, не начав отдавать (клиент ушел сразу): finally в stream не выполнится
+    response.call_on_close(lambda: events.unsubscribe(client))
+    return response
+
+
 @app.route('/api/tags')
 def api_tags():
     if not current_user:
         return jsonify({'error': 'Требуется авторизация'}), 401
     
-    return jsonify(PRICE_TAGS)
+    return jsonify(store.tags())
 
 @app.route('/api/tag/<int:tag_id>')
 def api_tag(tag_id):
     if not current_user:
         return jsonify({'error': 'Требуется авторизация'}), 401
     
-    tag = next((t for t in PRICE_TAGS if t['id'] == tag_id), None)
+    tag = store.tag(tag_id)
     if not tag:
         return jsonify({'error': 'Ценник не найден'}), 404
     
@@ -497,11 +951,12 @@ def api_stats():
     if not current_user:
         return jsonify({'error': 'Требуется авторизация'}), 401
     
-    total_tags = len(PRICE_TAGS)
+    total_tags = len(store.tags())
     
     return jsonify({
         'total_tags': total_tags,
-        'last_update': datetime.now().isoformat()
+        'last_update': datetime.now().isoformat(),
+        'fragment_cache': fragments.stats()
     })
 
 @app.route('/api/esp/send-direct', methods=['POST'])
@@ -534,11 +989,14 @@ if __name__ == '__main__':
     print("Веб-интерфейс: http://localhost:5000")
     print("Доступ для тестирования: admin / admin123")
     print("=" * 60)
-    print(f"Загружено {len(PRICE_TAGS)} ценников")
+    setup()
+    tags = store.tags()
+    print(f"Загружено {len(tags)} ценников ({store.path})")
     print("=" * 60)
     print(f"IP адрес ESP32:")
-    for tag in PRICE_TAGS:
+    for tag in tags:
         print(f"   {tag['id']}: {tag['esp_ip']}")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # threaded: поток /api/events держит соединение открытым
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
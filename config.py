@@ -25,6 +25,15 @@ ESP_DEVICES = {
     'TAG-101': {'ip': '10.133.210.157', 'name': 'Shluz', 'type': 'eink'},
 }
 
+# Шлюзы магазина (gateway_registry.py)
+# channel - канал LoRa (LORA_CHANNEL в прошивке), zones - зоны зала в радиусе шлюза,
+# capacity - ценников на шлюз, concurrency - одновременных HTTP-запросов к шлюзу
+# У ценника (DEFAULT_TAGS в app.py) - 'channel' и 'zone' (по умолчанию 23 и 'default')
+GATEWAYS = {
+    'TAG-101': {'ip': '10.133.210.157', 'name': 'Shluz', 'channel': 23, 'zones': ['default'],
+                'capacity': 500, 'concurrency': 1},
+}
+
 # Логирование
 LOG_LEVEL = 'INFO'  # DEBUG, INFO, WARNING, ERROR
 LOG_FILE = 'esp_connection.log'
\ No newline at end of file
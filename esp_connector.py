@@ -10,6 +10,7 @@ import json
 from datetime import datetime
 
 from config import ESP_CONFIG, ESP_DEVICES, LOG_LEVEL, LOG_FILE
+import tag_codec
 
 # Настройка логирования
 logging.basicConfig(
@@ -130,14 +131,12 @@ class ESP32Connector:
                 "message": f"Устройство {tag_id} не найдено в конфигурации"
             }
         
-        # Подготавливаем данные для ESP32
-        esp_data = {
-            "price": price_data.get('current_price', 0),
-            "product_name": price_data.get('name', ''),
-            "old_price": price_data.get('old_price', 0),
-            "discount": price_data.get('discount_percent', 0),
-            "unit": price_data.get('unit', 'шт.')
-        }
+        # Подготавливаем данные для ESP32: тот же формат, что у esp_sender
+        # (old_price / discount / unit шлюз не принимал, цену ждет в current_price)
+        esp_data = tag_codec.price_request(tag_id,
+                                           price_data.get('name', ''),
+                                           price_data.get('current_price', 0),
+                                           price_data.get('weight', 0))
         
         print(f"Отправка на ESP32 {tag_id}: {esp_data}")
         
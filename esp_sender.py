@@ -8,6 +8,8 @@ import logging
 from datetime import datetime
 from typing import Dict, Optional
 
+import tag_codec
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -32,29 +34,31 @@ class ESPSender:
         self.timeout = timeout
         self.retry_count = retry_count
     
-    def send_to_esp(self, ip_address: str, data: Dict) -> Dict:
+    def send_to_esp(self, ip_address: str, data: Dict, force: bool = False) -> Dict:
         """
         Отправка данных на ESP32 устройство
         
         Args:
             ip_address: IP адрес ESP32
             data: Данные для отправки
+            force: Отправить по LoRa, даже если шлюз уже доставлял то же
+                   содержимое (ценник с тех пор обновлял другой шлюз)
             
         Returns:
             Результат отправки
         """
         logger.info(f"Отправка данных на ESP32: {ip_address}")
         
-        # Формируем URL для отправки
-        url = f"http://{ip_address}/api/price"
+        # Формируем URL для отправки (compact=1 - шлюз не повторяет данные в ответе)
+        url = f"http://{ip_address}/api/price?compact=1"
+        if force:
+            url += "&force=1"
         
         # Подготавливаем данные - убираем ненужные поля
-        esp_data = {
-            "device_id": data.get("device_id", ""),
-            "product_name": data.get("product_name", ""),
-            "current_price": float(data.get("current_price", 0)),
-            "weight": float(data.get("weight", 0))
-        }
+        esp_data = tag_codec.price_request(data.get("device_id", ""),
+                                           data.get("product_name", ""),
+                                           data.get("current_price", 0),
+                                           data.get("weight", 0))
         
         logger.info(f"Данные для отправки: {esp_data}")
         
@@ -224,6 +228,153 @@ class ESPSender:
                 "timestamp": datetime.now().isoformat()
             }
 
+    def get_delivery_statuses(self, ip_address: str) -> Dict:
+        """
+        Состояние доставки по LoRa всех ценников шлюза одним запросом
+        
+        Шлюз считает кадр доставленным только после ACK от ценника,
+        состояние берется из поля "delivery" ответа /api/status.
+        
+        Args:
+            ip_address: IP адрес шлюза (ESP32)
+            
+        Returns:
+            Состояние доставки, "delivery": ID ценника -> состояние
+        """
+        url = f"http://{ip_address}/api/status"
+        
+        try:
+            response = requests.get(url, timeout=self.timeout)
+            if response.status_code != 200:
+                return {
+                    "success": False,
+                    "message": f"ESP32 вернул ошибку {response.status_code}",
+                    "ip_address": ip_address,
+                    "timestamp": datetime.now().isoformat()
+                }
+            
+            return {
+                "success": True,
+                "delivery": response.json().get("delivery") or {},
+                "ip_address": ip_address,
+                "timestamp": datetime.now().isoformat()
+            }
+            
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Ошибка запроса статуса доставки {ip_address}: {str(e)}")
+            return {
+                "success": False,
+                "message": "Не удалось получить статус доставки",
+                "error": str(e),
+                "ip_address": ip_address,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def get_delivery_status(self, ip_address: str, device_id: str) -> Dict:
+        """
+        Получение состояния доставки по LoRa для ценника
+        (для нескольких ценников шлюза - get_delivery_statuses)
+        
+        Args:
+            ip_address: IP адрес шлюза (ESP32)
+            device_id: ID ценника
+            
+        Returns:
+            Состояние доставки
+        """
+        result = self.get_delivery_statuses(ip_address)
+        if not result["success"]:
+            return result
+        delivery = result["delivery"].get(device_id)
+        return {
+            "success": True,
+            "device_id": device_id,
+            "state": delivery["state"] if delivery else "unknown",
+            "delivery": delivery,
+            "ip_address": ip_address,
+            "timestamp": result["timestamp"]
+        }
+
+    def send_layout(self, ip_address: str, device_id: str, layout: Dict) -> Dict:
+        """
+        Отправка макета ценника через шлюз
+        
+        Шлюз пересылает макет по LoRa как есть (формат - tag_layout.py),
+        ценник проверяет его и подтверждает ACK, доставку видно
+        через get_delivery_status.
+        
+        Args:
+            ip_address: IP адрес шлюза (ESP32)
+            device_id: ID ценника
+            layout: Описание макета {"static": [...], "fields": [...]}
+            
+        Returns:
+            Результат отправки
+        """
+        url = f"http://{ip_address}/api/layout?id={device_id}"
+        
+        try:
+            response = requests.post(url, json={"layout": layout}, timeout=self.timeout)
+            data = response.json()
+            return {
+                "success": response.status_code == 200,
+                "status_code": response.status_code,
+                "response_data": data,
+                "message": data.get("error", f"Макет отправлен на ценник {device_id}"),
+                "ip_address": ip_address,
+                "timestamp": datetime.now().isoformat()
+            }
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Ошибка отправки макета на {ip_address}: {str(e)}")
+            return {
+                "success": False,
+                "message": "Не удалось отправить макет",
+                "error": str(e),
+                "ip_address": ip_address,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def send_bitmap(self, ip_address: str, device_id: str, update: Dict) -> Dict:
+        """
+        Отправка готового изображения ценника через шлюз
+        
+        update - из tag_render.bitmap_update(): base64 сжатой разности
+        с последним подтвержденным кадром, crc32 базы и результата.
+        Шлюз режет его на кадры LoRa, ценник подтверждает последний
+        только после проверки и применения.
+        
+        Args:
+            ip_address: IP адрес шлюза (ESP32)
+            device_id: ID ценника
+            update: {"data", "base", "img"}
+            
+        Returns:
+            Результат отправки
+        """
+        url = f"http://{ip_address}/api/bitmap?id={device_id}"
+        body = {"data": update["data"], "base": update["base"], "img": update["img"]}
+        
+        try:
+            response = requests.post(url, json=body, timeout=self.timeout)
+            data = response.json()
+            return {
+                "success": response.status_code == 200,
+                "status_code": response.status_code,
+                "response_data": data,
+                "message": data.get("error", f"Изображение отправлено на ценник {device_id}"),
+                "ip_address": ip_address,
+                "timestamp": datetime.now().isoformat()
+            }
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Ошибка отправки изображения на {ip_address}: {str(e)}")
+            return {
+                "success": False,
+                "message": "Не удалось отправить изображение",
+                "error": str(e),
+                "ip_address": ip_address,
+                "timestamp": datetime.now().isoformat()
+            }
+
 
 # Создаем глобальный экземпляр для использования во всем приложении
 esp_sender = ESPSender()
\ No newline at end of file
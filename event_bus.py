@@ -0,0 +1,137 @@
+"""
+События для страниц веб-интерфейса (Server-Sent Events, /api/events)
+
+    tag       - данные ценника изменились (цена, вес, батарея, шлюз...)
+    delivery  - состояние доставки по LoRa: {"id", "seq", "state"}
+    gateway   - шлюз стал недоступен / снова отвечает
+    notice    - сообщение для всех открытых страниц: {"level", "message"}
+
+Страница патчит DOM по событию, перезагрузка не нужна. Последние
+HISTORY_SIZE событий хранятся: браузер после обрыва переподключается
+с Last-Event-ID и получает пропущенное. Если пропущено больше - событие
+reload (страница перезагрузится один раз).
+
+С journal (tag_store.TagStore) события идут через общий журнал в базе:
+id одни на все процессы сервера, клиенты процесса получают и события,
+опубликованные другими процессами (поток _follow читает журнал).
+
+Открытый поток занимает поток сервера (gunicorn --threads) все время, пока
+страница открыта, а закрытую страницу видно только на следующем HEARTBEAT_S.
+Поэтому клиентов у процесса не больше max_clients (MAX_CLIENTS): следующий
+получает отказ (subscribe -> None, /api/events - 503), остальные потоки
+остаются запросам страниц. Больше открытых страниц - больше процессов
+или асинхронный worker (gunicorn -k gevent) для /api/events.
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+HISTORY_SIZE = 256
+CLIENT_QUEUE_SIZE = 64      # отстающий клиент отключается, браузер переподключится
+HEARTBEAT_S = 15            # комментарий в поток: обрыв виден и через прокси
+JOURNAL_POLL_S = 0.2
+MAX_CLIENTS = 4             # половина потоков процесса при gunicorn --threads 8
+
+
+class EventBus:
+
+    def __init__(self, journal=None, max_clients=MAX_CLIENTS):
+        self.lock = threading.Lock()
+        self.clients = []
+        self.max_clients = max_clients
+        self.rejected = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.last_id = 0
+        self.dropped = 0
+        self.journal = journal
+        self.follower = None
+
+    def publish(self, event, data):
+        data = json.dumps(data, ensure_ascii=False)
+        if self.journal is not None:
+            # клиентам раздаст _follow, в том числе клиентам других процессов
+            self.journal.append_event(event, data)
+            return
+        with self.lock:
+            self.last_id += 1
+            self._deliver(self.last_id, event, data)
+
+    def _deliver(self, event_id, event, data):
+        message = f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+        self.history.append((event_id, message))
+        for client in self.clients[:]:
+            if client.qsize() < CLIENT_QUEUE_SIZE:
+                client.put_nowait(message)
+            else:
+                # последнее место в очереди - под сигнал отключения
+                self.clients.remove(client)
+                client.put_nowait(None)
+                self.dropped += 1
+
+    def _follow(self):
+        while True:
+            time.sleep(JOURNAL_POLL_S)
+            try:
+                rows = self.journal.events_after(self.last_id)
+            except Exception as e:
+                print(f"Ошибка чтения журнала событий: {e}")
+                continue
+            with self.lock:
+                for event_id, event, data in rows:
+                    self.last_id = event_id
+                    self._deliver(event_id, event, data)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Очередь сообщений клиента; с last_event_id - сначала пропущенные.
+        None - у процесса уже max_clients клиентов
+        """
+        client = queue.Queue(CLIENT_QUEUE_SIZE + 1)
+        with self.lock:
+            if len(self.clients) >= self.max_clients:
+                self.rejected += 1
+                return None
+            if self.journal is not None:
+                # клиент мог уже видеть в другом процессе событие, до которого
+                # _follow еще не дошел; журнал читается с первого клиента
+                start = self.last_id if self.follower else max(self.journal.last_event_id() - HISTORY_SIZE, 0)
+                for event_id, event, data in self.journal.events_after(start):
+                    self.last_id = event_id
+                    self._deliver(event_id, event, data)
+                if self.follower is None:
+                    self.follower = threading.Thread(target=self._follow, daemon=True)
+                    self.follower.start()
+            if last_event_id is not None:
+                missed = [message for event_id, message in self.history if event_id > last_event_id]
+                first = self.history[0][0] if self.history else self.last_id + 1
+                # id после перезапуска сервера начинаются заново
+                if last_event_id + 1 < first or last_event_id > self.last_id or len(missed) > CLIENT_QUEUE_SIZE:
+                    missed = [f"id: {self.last_id}\nevent: reload\ndata: {{}}\n\n"]
+                for message in missed:
+                    client.put_nowait(message)
+            self.clients.append(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def stream(self, client):
+        """Генератор text/event-stream для Response, client - из subscribe"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = client.get(timeout=HEARTBEAT_S)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(client)
@@ -0,0 +1,68 @@
+"""
+Кэш отрисованных кусков страниц: строки таблиц ценников, карточки статистики,
+сведения о ценнике (templates/fragments/)
+
+Кусок хранится вместе с версией, на которой он отрисован:
+    строка / сведения о ценнике - номер изменения этого ценника
+                                  (tag_store.Snapshot.versions)
+    статистика                  - номер снимка (меняется с любым ценником)
+Правка ценника или пакет изменений меняют номера только у затронутых
+ценников - заново рисуются только их куски, остальные берутся из кэша.
+Номера общие для всех процессов (база), кэш у каждого процесса свой.
+
+Кусок рисуется только из своего контекста (без current_user / session):
+он одинаков для всех пользователей. Места - FRAGMENT_CACHE_SIZE кусков,
+вытесняются давно не нужные (LRU).
+"""
+
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+FRAGMENT_CACHE_SIZE = 4096     # ~2 строки + сведения на ценник для 1000+ ценников
+
+
+class FragmentCache:
+
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> (version, html)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, render):
+        """html куска key на версии version; render() - отрисовка, если в кэше нет"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # отрисовка без блокировки; два потока могут нарисовать один кусок - не страшно
+        html = render()
+        with self.lock:
+            # старая версия куска заменяется, а не копится рядом
+            self.entries[key] = (version, html)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return html
+
+    def template(self, env, name):
+        """
+        render(key, version, **context) -> Markup: кусок шаблона name
+        (jinja2 Environment env, в Flask - app.jinja_env) через кэш
+        """
+        template = env.get_template(name)
+
+        def render(key, version, **context):
+            # шаблон - часть версии: после правки шаблона (debug) куски рисуются заново
+            return Markup(self.get((name, key), (version, template), lambda: template.render(**context)))
+        return render
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,362 @@
+"""
+Шлюзы магазина: реестр, распределение ценников и отправка
+
+Ценник слышит шлюзы своего канала LoRa в своей зоне (config.GATEWAYS:
+channel, zones; у ценника - channel и zone). Основной шлюз ценника
+выбирается так, чтобы ценники расходились по шлюзам пропорционально
+capacity, остальные шлюзы в зоне - резервные.
+
+На шлюз одновременно идет не больше concurrency запросов (HTTP-сервер
+шлюза однопоточный). Шлюз, который FAIL_THRESHOLD раз подряд не ответил,
+на COOLDOWN_S считается недоступным: его ценники уходят через резервный
+шлюз с самой короткой очередью.
+
+Все шлюзы шлют с одного адреса LoRa (LORA_SENDER_ADDRESS в прошивке),
+поэтому ACK ценника слышит и шлюз, отправивший кадр.
+
+Несколько процессов (gunicorn -w N): с shared (tag_store.TagStore) места
+на шлюзе - строки в общей базе, concurrency - на все процессы вместе,
+а не на каждый; отказы шлюза тоже считаются вместе, и перед каждой
+отправкой доступность шлюза сверяется с базой (выбор резервного по
+очередям - не чаще HEALTH_SYNC_S). Очереди у каждого процесса свои.
+Без shared все ограничения - на один процесс.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_CHANNEL = 23
+DEFAULT_ZONE = 'default'
+FAIL_THRESHOLD = 3
+COOLDOWN_S = 30
+SLOT_POLL_S = 0.05      # все места шлюза заняты другими процессами - проверить снова
+HEALTH_SYNC_S = 1       # доступность шлюзов из общей базы - не чаще
+
+
+def gateway_failed(result):
+    """
+    Шлюз не ответил (в отличие от ошибки в самом запросе). Исключение в send()
+    (рисование, база) - ошибка сервера, отказом шлюза не считается
+    """
+    if result['success']:
+        return False
+    status = result.get('status_code')
+    return status is None or status >= 500
+
+
+def next_health(failures, down_until, failed, now):
+    """
+    Отказы подряд и down_until после ответа шлюза (failed - не ответил);
+    changed - шлюз стал недоступен или снова ответил
+    """
+    if failed:
+        failures += 1
+        if failures >= FAIL_THRESHOLD and now >= down_until:
+            return failures, now + COOLDOWN_S, True
+        return failures, down_until, False
+    return 0, 0, bool(down_until)
+
+
+class Gateway:
+
+    def __init__(self, gateway_id, ip, channel=DEFAULT_CHANNEL, zones=(DEFAULT_ZONE,),
+                 capacity=500, concurrency=1, name=''):
+        if capacity < 1 or concurrency < 1:
+            # capacity - делитель загрузки в assign, concurrency - число мест
+            raise ValueError(f"Шлюз {gateway_id}: capacity и concurrency - не меньше 1")
+        self.id = gateway_id
+        self.ip = ip
+        self.channel = channel
+        self.zones = tuple(zones)
+        self.capacity = capacity
+        self.name = name
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.concurrency = concurrency
+        self.queue = OrderedDict()      # tag id -> (tag, send, шлюзы, где уже не вышло)
+        self.workers = 0
+        self.in_flight = 0
+        self.assigned = 0
+        self.failures = 0
+        self.down_until = 0
+        self.sent = 0
+        self.failed = 0
+        self.failovers = 0
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def depth(self):
+        return len(self.queue) + self.in_flight
+
+    def status(self, now):
+        return {
+            'id': self.id, 'ip': self.ip, 'name': self.name, 'channel': self.channel,
+            'zones': list(self.zones), 'capacity': self.capacity, 'concurrency': self.concurrency,
+            'assigned': self.assigned, 'queued': len(self.queue), 'in_flight': self.in_flight,
+            'healthy': self.healthy(now), 'failures': self.failures,
+            'sent': self.sent, 'failed': self.failed, 'failovers': self.failovers,
+        }
+
+
+class GatewayRegistry:
+
+    def __init__(self, gateways, clock=time.time, listener=None, shared=None):
+        """
+        gateways - config.GATEWAYS: id -> {'ip', 'channel', 'zones', 'capacity', 'concurrency', 'name'};
+        listener(status) - шлюз стал недоступен или снова ответил;
+        shared - tag_store.TagStore: места и доступность шлюзов общие для процессов
+        """
+        self.clock = clock
+        self.listener = listener
+        self.shared = shared
+        self.health_synced = None
+        self.lock = threading.Condition()
+        self.gateways = OrderedDict()
+        self.by_ip = {}
+        for gateway_id, info in gateways.items():
+            self._add(Gateway(gateway_id, **info))
+
+    def _add(self, gateway):
+        self.gateways[gateway.id] = gateway
+        self.by_ip[gateway.ip] = gateway
+        return gateway
+
+    def in_range(self, tag):
+        channel = tag.get('channel', DEFAULT_CHANNEL)
+        zone = tag.get('zone', DEFAULT_ZONE)
+        return [gateway for gateway in self.gateways.values()
+                if gateway.channel == channel and zone in gateway.zones]
+
+    def assign(self, tags):
+        """
+        Основной шлюз каждому ценнику (tag['gateway'], tag['esp_ip']).
+        Сначала ценники с наименьшим выбором шлюзов, каждый - на шлюз
+        с наименьшей загрузкой assigned / capacity. Без шлюза в зоне ценник
+        остается на своем esp_ip. Возвращает число таких ценников
+        """
+        with self.lock:
+            for gateway in self.gateways.values():
+                gateway.assigned = 0
+            unassigned = 0
+            options = [(tag, self.in_range(tag)) for tag in tags]
+            options.sort(key=lambda option: len(option[1]))
+            for tag, candidates in options:
+                if not candidates:
+                    tag['gateway'] = None
+                    unassigned += 1
+                    continue
+                gateway = min(candidates, key=lambda g: ((g.assigned >= g.capacity), g.assigned / g.capacity))
+                if gateway.assigned >= gateway.capacity:
+                    print(f"Шлюз {gateway.id}: ценников больше capacity ({gateway.capacity})")
+                gateway.assigned += 1
+                tag['gateway'] = gateway.id
+                tag['esp_ip'] = gateway.ip
+            return unassigned
+
+    def count(self, tags):
+        """assigned по уже распределенным ценникам (распределял другой процесс)"""
+        with self.lock:
+            for gateway in self.gateways.values():
+                gateway.assigned = 0
+            for tag in tags:
+                gateway = self.gateways.get(tag.get('gateway'))
+                if gateway is not None:
+                    gateway.assigned += 1
+
+    def route(self, tag, exclude=()):
+        """
+        Шлюз для отправки: основной, если он доступен, иначе доступный
+        резервный с самой короткой очередью
+        """
+        now = self.clock()
+        self._sync_health(now)
+        # _add меняет словари шлюзов, которые в это время читают потоки очередей
+        with self.lock:
+            primary = self.gateways.get(tag.get('gateway'))
+            if primary is None:
+                # ценник вне реестра - шлюз по старому esp_ip
+                primary = self.by_ip.get(tag['esp_ip']) or self._add(Gateway(tag['esp_ip'], tag['esp_ip']))
+            if primary.healthy(now) and primary.id not in exclude:
+                return primary
+            backups = [g for g in self.in_range(tag) if g.healthy(now) and g.id not in exclude and g is not primary]
+            if not backups:
+                return primary
+            return min(backups, key=lambda g: g.depth() / g.concurrency)
+
+    def _sync_health(self, now, force=False):
+        # отказы, замеченные другими процессами; force - перед самой отправкой
+        if self.shared is None:
+            return
+        if not force and self.health_synced is not None and now - self.health_synced < HEALTH_SYNC_S:
+            return
+        self.health_synced = now
+        health = self.shared.gateway_health()
+        with self.lock:
+            for gateway in self.gateways.values():
+                gateway.failures, gateway.down_until = health.get(gateway.id, (0, 0))
+
+    @contextmanager
+    def _slot(self, gateway):
+        """Место на шлюзе: между потоками - семафор, между процессами - строка в общей базе"""
+        with gateway.slots:
+            if self.shared is None:
+                yield
+                return
+            slot = self.shared.acquire_slot(gateway.id, gateway.concurrency)
+            while slot is None:
+                time.sleep(SLOT_POLL_S)
+                slot = self.shared.acquire_slot(gateway.id, gateway.concurrency)
+            try:
+                yield
+            finally:
+                self.shared.release_slot(gateway.id, slot)
+
+    def _result(self, gateway, tag, result):
+        """True - шлюз не ответил. База и слушатель - без блокировки реестра"""
+        failed = gateway_failed(result)
+        now = self.clock()
+        if self.shared is not None:
+            health = self.shared.update_gateway_health(
+                gateway.id, lambda failures, down_until: next_health(failures, down_until, failed, now))
+        changed = None
+        with self.lock:
+            if self.shared is None:
+                health = next_health(gateway.failures, gateway.down_until, failed, now)
+            gateway.failures, gateway.down_until, flipped = health
+            if failed:
+                gateway.failed += 1
+            else:
+                gateway.sent += result['success']
+                gateway.failed += not result['success']
+            if flipped:
+                if failed:
+                    print(f"Шлюз {gateway.id} ({gateway.ip}) недоступен, ценники через резервные")
+                else:
+                    print(f"Шлюз {gateway.id} ({gateway.ip}) снова отвечает")
+                changed = gateway.status(now)
+        if changed is not None and self.listener is not None:
+            self.listener(changed)
+        return failed
+
+    def _backup(self, tag, gateway, tried):
+        backup = self.route(tag, exclude=tried)
+        if backup.id in tried:
+            return None
+        with self.lock:
+            gateway.failovers += 1
+        print(f"Ценник {tag['id']}: шлюз {gateway.id} не ответил, отправка через {backup.id}")
+        return backup
+
+    def _detour(self, tag, gateway, tried):
+        """Резервный шлюз, если gateway уже признан недоступным (в том числе другим процессом)"""
+        now = self.clock()
+        # один SELECT рядом с HTTP-запросом к шлюзу (секунды при отказе) - не в счет
+        self._sync_health(now, force=True)
+        with self.lock:
+            if gateway.healthy(now):
+                return None
+        return self._backup(tag, gateway, tried)
+
+    def send_now(self, tag, send):
+        """
+        Отправка сразу (ждет свободного места на шлюзе). send(ip) -> результат
+        esp_sender; если шлюз не ответил - повтор через резервный
+        """
+        tried = []
+        gateway = self.route(tag)
+        while True:
+            tried.append(gateway.id)
+            with self._slot(gateway):
+                # пока ждали места, шлюз могли признать недоступным
+                detour = self._detour(tag, gateway, tried)
+                if detour is None:
+                    with self.lock:
+                        gateway.in_flight += 1
+                    try:
+                        result = send(gateway.ip)
+                    finally:
+                        with self.lock:
+                            gateway.in_flight -= 1
+                    # до освобождения места: следующий на этом месте уже видит отказ
+                    failed = self._result(gateway, tag, result)
+            if detour is not None:
+                gateway = detour
+                continue
+            if not failed:
+                return result
+            gateway = self._backup(tag, gateway, tried)
+            if gateway is None:
+                return result
+
+    def request(self, ip, call):
+        """
+        Запрос к шлюзу не для отправки (опрос доставки): занимает место
+        concurrency, как отправка, на отказы шлюза не влияет
+        """
+        with self.lock:
+            gateway = self.by_ip.get(ip) or self._add(Gateway(ip, ip))
+        with self._slot(gateway):
+            return call()
+
+    def submit(self, tag, send):
+        """
+        В очередь шлюза; ценник в очереди не больше одного раза, уходят
+        данные на момент отправки. Очередь разбирают concurrency потоков шлюза
+        """
+        self._enqueue(self.route(tag), tag, send, [])
+
+    def _enqueue(self, gateway, tag, send, tried):
+        with self.lock:
+            gateway.queue[tag['id']] = (tag, send, tried)
+            if gateway.workers < gateway.concurrency:
+                gateway.workers += 1
+                threading.Thread(target=self._worker, args=(gateway,), daemon=True).start()
+            self.lock.notify_all()
+
+    def _worker(self, gateway):
+        while True:
+            with self.lock:
+                while not gateway.queue:
+                    self.lock.wait()
+                _, (tag, send, tried) = gateway.queue.popitem(last=False)
+                gateway.in_flight += 1
+            try:
+                self._deliver(gateway, tag, send, tried + [gateway.id])
+            except Exception as e:
+                # ошибка на сервере (рисование, база), а не отказ шлюза: шлюз остается
+                # доступным, поток очереди - живым
+                print(f"Ошибка отправки ценника {tag['id']}: {e}")
+                with self.lock:
+                    gateway.failed += 1
+
+    def _deliver(self, gateway, tag, send, tried):
+        """Ценник из очереди gateway (in_flight уже учтен)"""
+        try:
+            # шлюз могли признать недоступным, пока ценник ждал в очереди, и пока ждал места
+            detour = self._detour(tag, gateway, tried)
+            if detour is None:
+                with self._slot(gateway):
+                    detour = self._detour(tag, gateway, tried)
+                    if detour is None:
+                        result = send(gateway.ip)
+                        failed = self._result(gateway, tag, result)
+        finally:
+            with self.lock:
+                gateway.in_flight -= 1
+        if detour is not None:
+            self._enqueue(detour, tag, send, tried)
+            return
+        if failed:
+            backup = self._backup(tag, gateway, tried)
+            if backup is not None:
+                self._enqueue(backup, tag, send, tried)
+                return
+        if not result['success']:
+            print(f"Ценник {tag['id']} не отправлен: {result.get('error', 'unknown')}")
+
+    def status(self):
+        now = self.clock()
+        with self.lock:
+            return [gateway.status(now) for gateway in self.gateways.values()]
@@ -0,0 +1,2193 @@
+"""
+Замеры кода прошивки на CPython (через заглушки host_shim)
+
+    python host_bench.py http        # один замер
+    python host_bench.py all         # все замеры
+    python host_bench.py render --png out   # и кадры панели в out/*.png
+
+Абсолютные числа на ПК меньше, чем на ESP32, сравнивать имеет смысл
+только варианты между собой.
+"""
+
+import argparse
+import io
+import json
+import time
+import tracemalloc
+
+import host_shim
+
+host_shim.install()
+
+
+def measure(func, repeat):
+    """Среднее время вызова (мкс) и пик выделенной памяти за один вызов (байт)"""
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat * 1000000
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def print_table(title, header, rows):
+    print(f"\n{title}")
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+# ---------------------------------------------------------------------------
+# HTTP: чтение и разбор запроса на шлюзе
+# ---------------------------------------------------------------------------
+
+class FakeClient:
+    """Сокет клиента: отдает запрос кусками по chunk байт"""
+
+    def __init__(self, data, chunk):
+        self.data = data
+        self.chunk = chunk
+        self.pos = 0
+
+    def recv(self, size):
+        size = min(size, self.chunk)
+        data = self.data[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def recv_into(self, view):
+        data = self.recv(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+def legacy_read_request(client):
+    """Цикл чтения из start_web_server до перехода на HttpRequestReader"""
+    request = b""
+    while True:
+        chunk = client.recv(1024)
+        if not chunk:
+            break
+        request += chunk
+
+        if b"\r\n\r\n" in request:
+            request_str = request.decode("utf-8")
+            headers_part = request_str.split("\r\n\r\n")[0]
+            content_length = 0
+
+            for line in headers_part.split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    content_length = int(line.split(":", 1)[1].strip())
+                    break
+
+            if content_length > 0:
+                body_received = len(request) - len(headers_part) - 4
+                while body_received < content_length:
+                    chunk = client.recv(1024)
+                    if not chunk:
+                        break
+                    request += chunk
+                    body_received += len(chunk)
+            break
+    return request
+
+
+def legacy_parse_http_request(request):
+    """parse_http_request до перехода на HttpRequestReader"""
+    request_str = request.decode("utf-8", errors='ignore')
+    lines = request_str.split("\r\n")
+    request_line = lines[0].split()
+    method = request_line[0]
+    path = request_line[1]
+
+    headers = {}
+    for i in range(1, len(lines)):
+        if not lines[i]:
+            break
+        if ": " in lines[i]:
+            key, value = lines[i].split(": ", 1)
+            headers[key.lower()] = value
+
+    body = None
+    if "\r\n\r\n" in request_str:
+        body_str = request_str.split("\r\n\r\n", 1)[1]
+        if body_str.strip():
+            body = body_str
+    return method, path, headers, body
+
+
+def make_request(method, path, body=None):
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        "Host: 10.133.210.157",
+        "User-Agent: python-requests/2.31.0",
+        "Accept-Encoding: gzip, deflate",
+        "Accept: */*",
+        "Connection: keep-alive",
+    ]
+    payload = b""
+    if body is not None:
+        payload = json.dumps(body).encode()
+        lines.append("Content-Type: application/json")
+        lines.append(f"Content-Length: {len(payload)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + payload
+
+
+def bench_http(args):
+    import lora_sender_display as gateway
+
+    price = {
+        "device_id": "11",
+        "product_name": "Яблоки Голден",
+        "current_price": 129.9,
+        "weight": 0.75,
+    }
+    requests = [
+        ("GET /api/status", make_request("GET", "/api/status")),
+        ("POST /api/price", make_request("POST", "/api/price", price)),
+        ("POST 3 KB", make_request("POST", "/api/price", dict(price, note="x" * 3000))),
+    ]
+    reader = gateway.HttpRequestReader()
+
+    rows = []
+    for name, data in requests:
+        for chunk in (64, 536, 1460):
+            def legacy():
+                return legacy_parse_http_request(legacy_read_request(FakeClient(data, chunk)))
+
+            def current():
+                reader.read(FakeClient(data, chunk))
+                return reader.method, reader.path, reader.headers, reader.body()
+
+            assert legacy()[:2] == current()[:2]
+            assert legacy()[3] == current()[3]
+            legacy_us, legacy_peak = measure(legacy, args.repeat)
+            current_us, current_peak = measure(current, args.repeat)
+            rows.append((name, chunk, f"{legacy_us:.1f}", f"{current_us:.1f}",
+                         legacy_peak, current_peak))
+
+    print_table(
+        f"HTTP request read+parse (buffer {gateway.MAX_REQUEST_SIZE} B preallocated once)",
+        ("request", "chunk", "legacy us", "reader us", "legacy peak B", "reader peak B"),
+        rows)
+
+    oversized = make_request("POST", "/api/price", dict(price, note="x" * 8000))
+    print(f"\n{len(oversized)} B request -> {reader.read(FakeClient(oversized, 1460))}, "
+          f"bytes read: {reader.length}")
+
+
+# ---------------------------------------------------------------------------
+# HTTP: формирование ответов на шлюзе
+# ---------------------------------------------------------------------------
+
+class SinkClient:
+    """Сокет клиента: копит отправленные байты"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data.extend(data)
+        return len(data)
+
+    sendall = send
+
+    def body(self):
+        return bytes(self.data).split(b"\r\n\r\n", 1)[1]
+
+
+def legacy_send_http_response(client, status_code, content_type, content):
+    """send_http_response до перехода на HttpResponseWriter"""
+    response = f"HTTP/1.1 {status_code}\r\n"
+    response += "Content-Type: " + content_type + "\r\n"
+    response += "Content-Length: " + str(len(content)) + "\r\n"
+    response += "Connection: close\r\n"
+    response += "\r\n"
+    response += content
+    client.send(response.encode("utf-8"))
+
+
+def legacy_index_page(gateway, price_data, lora_module):
+    return f"""<html>
+<head><title>ESP32 Price Tag - {gateway.DEVICE_ID}</title></head>
+<body>
+<h1>ESP32 Price Tag</h1>
+<p><strong>Device ID:</strong> {price_data['device_id']}</p>
+<p><strong>Product:</strong> {price_data['product_name']}</p>
+<p><strong>Price:</strong> {price_data['current_price']} RUB</p>
+<p><strong>Weight:</strong> {price_data['weight']} kg</p>
+<p><strong>Battery:</strong> {price_data['battery']}%</p>
+<p><strong>Status:</strong> {'Active' if price_data['is_active'] else 'Inactive'}</p>
+<p><strong>LoRa:</strong> {'Ready' if lora_module else 'Off'}</p>
+<hr>
+<h3>API:</h3>
+<ul>
+<li><a href="/api/status">/api/status</a> - Status</li>
+<li><a href="/api/price">/api/price</a> - Price (GET/POST/PUT)</li>
+</ul>
+<p><strong>Last update:</strong> {'Never'}</p>
+</body></html>"""
+
+
+def bench_response(args):
+    import lora_sender_display as gateway
+
+    price = {
+        "device_id": "11",
+        "product_name": "Яблоки Голден",
+        "current_price": 129.9,
+        "weight": 0.75,
+    }
+    gateway.tag_table[gateway.DEVICE_ID] = ("Shluz", 0.0, 0.5, None)
+    price_data = gateway.tag_data(gateway.DEVICE_ID)
+    lora_module = object()
+    w = gateway.response_writer
+
+    def legacy_index():
+        client = SinkClient()
+        legacy_send_http_response(client, "200 OK", "text/html",
+                                  legacy_index_page(gateway, price_data, lora_module))
+        return client
+
+    def current_index():
+        client = SinkClient()
+        w.begin(client, "200 OK", "text/html")
+        gateway.write_index_page(w, lora_module)
+        w.finish()
+        return client
+
+    def legacy_post():
+        client = SinkClient()
+        legacy_send_http_response(client, "200 OK", "application/json", json.dumps({
+            "success": True,
+            "device_id": gateway.DEVICE_ID,
+            "message": "Data updated and forwarded via LoRa",
+            "updated": True,
+            "lora_forwarded": True,
+            "received_data": price,
+            "current_data": price_data,
+            "battery": price_data["battery"],
+            "timestamp": time.time()
+        }))
+        return client
+
+    def current_post(compact):
+        def run():
+            client = SinkClient()
+            w.begin(client, "200 OK", "application/json")
+            gateway.write_price_update(w, price, True, True, False, 1, "11", compact)
+            w.finish()
+            return client
+        return run
+
+    rows = []
+    for name, legacy, current in (
+            ("index page", legacy_index, current_index),
+            ("POST response", legacy_post, current_post(False)),
+            ("POST compact=1", legacy_post, current_post(True))):
+        legacy_us, legacy_peak = measure(legacy, args.repeat)
+        current_us, current_peak = measure(current, args.repeat)
+        rows.append((name, len(legacy().data), len(current().data),
+                     f"{legacy_us:.1f}", f"{current_us:.1f}", legacy_peak, current_peak))
+
+    print_table(
+        f"HTTP response build+send (buffer {gateway.RESPONSE_BUFFER_SIZE} B preallocated once)",
+        ("response", "legacy B", "writer B", "legacy us", "writer us",
+         "legacy peak B", "writer peak B"),
+        rows)
+
+
+# ---------------------------------------------------------------------------
+# Таблица ценников шлюза: журнал на флеше
+# ---------------------------------------------------------------------------
+
+def bench_tags(args):
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import lora_sender_display as gateway
+
+    rows = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for count in (10, 100, 500):
+                if os.path.exists(gateway.TAGS_JOURNAL):
+                    os.remove(gateway.TAGS_JOURNAL)
+                gateway.load_tag_table()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    # по 5 обновлений на ценник, журнал периодически сжимается
+                    for round_no in range(5):
+                        for i in range(count):
+                            gateway.update_price_data(f"TAG-{i}", {
+                                "product_name": f"Товар {i}",
+                                "current_price": 100 + round_no + i / 100,
+                                "weight": 0.5,
+                            })
+                records = gateway._journal_records
+                size = os.path.getsize(gateway.TAGS_JOURNAL)
+                expected = dict(gateway.tag_table)
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    load_us, _ = measure(gateway.load_tag_table, max(1, args.repeat // 100))
+                assert {k: v[:3] for k, v in gateway.tag_table.items()} == \
+                    {k: v[:3] for k, v in expected.items()}
+                rows.append((count, records, size, f"{load_us / 1000:.2f}"))
+        finally:
+            os.chdir(cwd)
+
+    print_table("Gateway tag table restore from journal",
+                ("tags", "journal records", "journal B", "restore ms"), rows)
+
+
+# ---------------------------------------------------------------------------
+# Прием LoRa на ценнике: сборка кадров из фрагментов UART
+# ---------------------------------------------------------------------------
+
+class LegacyMessageBuffer:
+    """MessageBuffer приемника до перехода на кольцевой буфер"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def add_fragment(self, fragment):
+        self.buffer += fragment
+
+    def try_extract_json(self):
+        start = self.buffer.find('{')
+        if start == -1:
+            return None
+
+        balance = 0
+        end = -1
+        for i in range(start, len(self.buffer)):
+            if self.buffer[i] == '{':
+                balance += 1
+            elif self.buffer[i] == '}':
+                balance -= 1
+                if balance == 0:
+                    end = i
+                    break
+
+        if end != -1:
+            json_str = self.buffer[start:end + 1]
+            self.buffer = self.buffer[end + 1:]
+            return json_str
+        return None
+
+
+def legacy_extract_message_from_raw(raw_data):
+    """extract_message_from_raw приемника до перехода на кольцевой буфер"""
+    if len(raw_data) >= 3 and raw_data[0:2] == b'\xff\xff':
+        message_bytes = raw_data[3:]
+    elif len(raw_data) >= 1 and raw_data[0] == 0x17:
+        message_bytes = raw_data[1:]
+    else:
+        message_bytes = raw_data
+    try:
+        return message_bytes.decode('utf-8')
+    except UnicodeError:
+        return str(message_bytes)
+
+
+def make_lora_stream(count, seed=1):
+    """Поток UART ценника: префикс бродкаста + JSON-кадр, как шлет шлюз"""
+    import random
+    from collections import OrderedDict
+
+    rnd = random.Random(seed)
+    names = ["Яблоки Голден", "Сыр {Российский}", 'Молоко "Домик"', "Чай \\ кофе",
+             "Хлеб}{", "Banana"]
+    frames = []
+    stream = bytearray()
+    for i in range(count):
+        frame = OrderedDict()
+        frame["name"] = rnd.choice(names)[:20]
+        frame["weight"] = str(rnd.choice([0.5, 1, 0.75]))
+        frame["price"] = str(round(rnd.uniform(10, 999), 2))
+        frame["id"] = "11"
+        frame["seq"] = i
+        text = json.dumps(frame, ensure_ascii=False)
+        frames.append(text)
+        stream += b"\xff\xff\x17" + text.encode("utf-8")
+    return frames, bytes(stream)
+
+
+def split_stream(stream, max_chunk, seed=2):
+    import random
+
+    rnd = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(1, max_chunk)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def bench_framing(args):
+    import lora_receiver_display as receiver
+
+    expected, stream = make_lora_stream(200)
+
+    def legacy(chunks):
+        def run():
+            buf = LegacyMessageBuffer()
+            out = []
+            for chunk in chunks:
+                buf.add_fragment(legacy_extract_message_from_raw(chunk))
+                json_str = buf.try_extract_json()
+                while json_str:
+                    out.append(json_str)
+                    json_str = buf.try_extract_json()
+            return out
+        return run
+
+    def current(chunks):
+        def run():
+            uart = host_shim.UART(1)
+            buf = receiver.MessageBuffer()
+            out = []
+            for chunk in chunks:
+                uart.inject(chunk)
+                buf.read_from(uart)
+                json_str = buf.try_extract_json()
+                while json_str:
+                    out.append(json_str)
+                    json_str = buf.try_extract_json()
+            return out
+        return run
+
+    rows = []
+    repeat = max(1, args.repeat // 100)
+    for max_chunk in (8, 58, 256, len(stream)):
+        chunks = split_stream(stream, max_chunk)
+        legacy_ok = sum(a == b for a, b in zip(legacy(chunks)(), expected))
+        current_out = current(chunks)()
+        assert current_out == expected, "MessageBuffer lost or corrupted frames"
+        legacy_us, legacy_peak = measure(legacy(chunks), repeat)
+        current_us, current_peak = measure(current(chunks), repeat)
+        rows.append((max_chunk, f"{legacy_ok}/{len(expected)}", f"{len(current_out)}/{len(expected)}",
+                     f"{len(expected) / legacy_us * 1e6:.0f}",
+                     f"{len(expected) / current_us * 1e6:.0f}",
+                     f"{len(stream) / current_us:.2f}",
+                     legacy_peak, current_peak))
+
+    print_table(
+        f"LoRa frame assembly, {len(expected)} frames / {len(stream)} B "
+        f"(ring {receiver.MESSAGE_BUFFER_SIZE} B)",
+        ("max chunk", "legacy ok", "ring ok", "legacy frames/s", "ring frames/s",
+         "ring MB/s", "legacy peak B", "ring peak B"),
+        rows)
+
+    # кадр длиннее кольца отбрасывается целиком, следующий принимается
+    buf = receiver.MessageBuffer(128)
+    buf.add_fragment(b'\xff\xff\x17{"name": "' + b"x" * 200 + b'"}' + stream[:3 + len(expected[0].encode())])
+    print(f"\noversized frame: dropped={buf.dropped}, next frame ok={buf.try_extract_json() == expected[0]}")
+
+
+def bench_rx(args):
+    import asyncio
+    import contextlib
+    import io
+    import random
+    import lora_receiver_display as receiver
+
+    count = 30
+    rnd = random.Random(3)
+    gaps = [rnd.uniform(0.02, 0.08) for _ in range(count)]
+    payloads = [b"\xff\xff\x17" + json.dumps({
+        "name": "Apples", "weight": "1", "price": str(100 + i), "id": "11", "seq": i,
+    }).encode() for i in range(count)]
+
+    async def produce(uart, arrived):
+        for i, payload in enumerate(payloads):
+            await asyncio.sleep(gaps[i])
+            # E32 отдает длинный кадр в UART кусками по 58 байт
+            for pos in range(0, len(payload), 58):
+                if pos:
+                    await asyncio.sleep(0.002)
+                uart.inject(payload[pos:pos + 58])
+            arrived[i] = time.perf_counter()
+        await asyncio.sleep(0.2)
+
+    async def legacy(uart, parsed, wakeups):
+        # цикл main() до перехода на StreamReader: опрос any() и sleep_ms(100)
+        buf = LegacyMessageBuffer()
+        while True:
+            wakeups[0] += 1
+            if uart.any() > 0:
+                buf.add_fragment(legacy_extract_message_from_raw(uart.read()))
+                json_str = buf.try_extract_json()
+                while json_str:
+                    parsed[json.loads(json_str)["seq"]] = time.perf_counter()
+                    json_str = buf.try_extract_json()
+            await asyncio.sleep(0.1)
+
+    async def current(uart, parsed, wakeups):
+        def on_frame(json_str, product_data):
+            parsed[product_data["seq"]] = time.perf_counter()
+        await receiver.receive_frames(uart, receiver.MessageBuffer(), on_frame)
+
+    async def run(consumer):
+        uart = host_shim.UART(2)
+        arrived, parsed, wakeups = {}, {}, [0]
+        task = asyncio.create_task(consumer(uart, parsed, wakeups))
+        start = time.perf_counter()
+        await produce(uart, arrived)
+        elapsed = time.perf_counter() - start
+        task.cancel()
+        latency = [(parsed[i] - arrived[i]) * 1000 for i in arrived if i in parsed]
+        return latency, wakeups[0], elapsed
+
+    rows = []
+    for name, consumer in (("poll + sleep_ms(100)", legacy), ("StreamReader", current)):
+        for key in receiver.rx_stats:
+            receiver.rx_stats[key] = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            latency, wakeups, elapsed = asyncio.run(run(consumer))
+        if consumer is current:
+            wakeups = receiver.rx_stats["wakeups"]
+        rows.append((name, f"{len(latency)}/{count}", f"{sum(latency) / len(latency):.1f}",
+                     f"{max(latency):.1f}", f"{wakeups / elapsed:.1f}"))
+
+    print_table(
+        "Receiver: last byte of frame in UART -> frame parsed",
+        ("loop", "frames", "avg ms", "max ms", "wakeups/s"),
+        rows)
+    stats = receiver.rx_stats
+    print(f"\nrx_stats (wake -> parse): avg {stats['total_us'] / max(1, stats['frames']):.0f} us, "
+          f"max {stats['max_us']} us")
+
+
+# ---------------------------------------------------------------------------
+# Товары на ценнике: индекс в RAM + журнал на флеше
+# ---------------------------------------------------------------------------
+
+def legacy_read_products_from_file(receiver, filename="product_list.txt"):
+    """read_products_from_file приемника до перехода на ProductStore"""
+    products = []
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    product = receiver.parse_product_message(line)
+                    if product:
+                        products.append(product)
+    except OSError:
+        pass
+    return products
+
+
+def legacy_save_products_to_file(products, filename="product_list.txt"):
+    with open(filename, "w") as f:
+        for product in products:
+            f.write(f"{product['name']},{product['weight']},{product['price']}\n")
+    return True
+
+
+def legacy_update_or_add_product(products, new_product):
+    for i, product in enumerate(products):
+        if product['name'] == new_product['name']:
+            products[i] = new_product
+            return products, "updated"
+    products.append(new_product)
+    return products, "added"
+
+
+class CountingFile:
+    """Файл, считающий записанные байты (износ флеша)"""
+
+    written = 0
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+    def __iter__(self):
+        return iter(self.f)
+
+    def write(self, data):
+        CountingFile.written += len(data.encode("utf-8"))
+        return self.f.write(data)
+
+
+def bench_store(args):
+    import builtins
+    import contextlib
+    import os
+    import tempfile
+    import lora_receiver_display as receiver
+
+    real_open = builtins.open
+
+    def counting_open(*a, **kw):
+        return CountingFile(real_open(*a, **kw))
+
+    rows = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        # open в модуле приемника и в legacy-функциях здесь считает записанные байты
+        receiver.open = counting_open
+        globals()["open"] = counting_open
+        try:
+            for count in (10, 100, 500):
+                messages = [{"name": f"Товар {i % count}", "weight": "0.5",
+                             "price": str(100 + n)} for n, i in enumerate(range(count * 3))]
+
+                def legacy():
+                    products = legacy_read_products_from_file(receiver)
+                    for message in messages:
+                        products, _ = legacy_update_or_add_product(products, dict(message))
+                        legacy_save_products_to_file(products)
+                    return products
+
+                def current():
+                    store = receiver.ProductStore()
+                    store.load()
+                    for message in messages:
+                        store.put(message)
+                    return store
+
+                for name in ("product_list.txt", receiver.PRODUCTS_LOG):
+                    if os.path.exists(name):
+                        os.remove(name)
+                CountingFile.written = 0
+                start = time.perf_counter()
+                products = legacy()
+                legacy_us = (time.perf_counter() - start) / len(messages) * 1e6
+                legacy_written = CountingFile.written
+
+                legacy_load_us, _ = measure(lambda: legacy_read_products_from_file(receiver), 20)
+                os.rename("product_list.txt", "product_list.bak")
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    CountingFile.written = 0
+                    start = time.perf_counter()
+                    store = current()
+                    current_us = (time.perf_counter() - start) / len(messages) * 1e6
+                    current_written = CountingFile.written
+                    assert list(store.values()) == products
+
+                    # перенос старого product_list.txt в журнал при первой загрузке
+                    os.rename("product_list.bak", "product_list.txt")
+                    os.remove(receiver.PRODUCTS_LOG)
+                    migrated = receiver.ProductStore()
+                    migrated.load()
+                    assert list(migrated.values()) == products
+                    load_us, _ = measure(receiver.ProductStore().load, 20)
+
+                rows.append((count, len(messages),
+                             f"{legacy_us:.0f}", f"{current_us:.0f}",
+                             legacy_written // len(messages), current_written // len(messages),
+                             f"{legacy_load_us / 1000:.2f}", f"{load_us / 1000:.2f}"))
+        finally:
+            del receiver.open
+            del globals()["open"]
+            os.chdir(cwd)
+
+    print_table(
+        "Receiver product store: list + full rewrite vs index + append-only log",
+        ("products", "messages", "legacy us/msg", "store us/msg",
+         "legacy B/msg", "store B/msg", "legacy load ms", "store load ms"),
+        rows)
+
+
+# ---------------------------------------------------------------------------
+# Экран ценника
+# ---------------------------------------------------------------------------
+
+def bench_display(args):
+    import contextlib
+    import lora_receiver_display as receiver
+
+    # повторы: шлюз переслал тот же товар, цена не изменилась, повтор после сбоя
+    messages = [
+        ("Яблоки", "1", "120"), ("Яблоки", "1", "120"), ("Яблоки", "1", "120"),
+        ("Яблоки", "1", "125"), ("Яблоки", "1", "125"), ("Груши", "0.5", "200"),
+        ("Груши", "0.5", "200"), ("Яблоки", "1", "125"), ("Яблоки", "1.0", "125"),
+        ("Яблоки", "1", "125"),
+    ]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+        spi = epd.spi
+        init_bytes = spi.bytes_written
+        start = time.perf_counter()
+        for name, weight, price in messages:
+            receiver.draw_price_tag_with_data(epd, name, weight, price)
+        elapsed = time.perf_counter() - start
+
+    stats = receiver.display_stats
+    digest_us, _ = measure(lambda: receiver.framebuffer_digest(epd), args.repeat)
+    print_table(
+        f"Receiver display: {len(messages)} messages, refresh only when framebuffers change",
+        ("messages", "refreshes", "skipped", "SPI bytes", "legacy SPI bytes", "host ms",
+         "digest us"),
+        [(len(messages), stats["refreshes"], stats["skipped"],
+          spi.bytes_written - init_bytes,
+          (spi.bytes_written - init_bytes) // max(1, stats["refreshes"]) * len(messages),
+          f"{elapsed * 1000:.0f}", f"{digest_us:.1f}")])
+
+
+def bench_partial(args):
+    import contextlib
+    import lora_receiver_display as receiver
+
+    # смена цены трогает строку Price/kg и окно Total, смена товара - почти все
+    updates = [
+        ("price change", ("Яблоки", "1", "125")),
+        ("weight change", ("Яблоки", "1.5", "125")),
+        ("new product", ("Bananas Ecuador", "0.75", "99")),
+    ]
+
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    for name, (product, weight, price) in updates:
+        for mode in ("full", "partial"):
+            with contextlib.redirect_stdout(io.StringIO()):
+                receiver.draw_price_tag_with_data(epd, "Яблоки", "1", "120")
+                epd.display()
+                receiver.render_price_tag(epd, product, weight, price)
+                spi = epd.spi
+                before_bytes, before_calls = spi.bytes_written, spi.transactions
+                if mode == "full":
+                    epd.display()
+                else:
+                    epd.display_partial()
+            stats = epd.last_update_stats
+            rows.append((name, mode, stats["rects"], stats["pixels"],
+                         spi.bytes_written - before_bytes, spi.transactions - before_calls))
+
+    print_table(
+        "EPD landscape: full display() vs display_partial() (dirty RAM windows)",
+        ("update", "path", "rects", "pixels sent", "SPI bytes", "SPI writes"),
+        rows)
+
+
+class PanelBusy:
+    """
+    BUSY панели на заглушке: команда 0x20 поднимает его на refresh_s.
+    Опускается по таймеру цикла (с прерыванием по спаду) или, если цикл
+    заблокирован опросом ReadBusy, при первом чтении после срока
+    """
+
+    def __init__(self, epd, refresh_s):
+        self.pin = epd.busy_pin
+        self.refresh_s = refresh_s
+        self.until = 0
+        self.refreshes = 0
+        send_command, digital_read = epd.send_command, epd.digital_read
+
+        def hooked_command(command):
+            send_command(command)
+            if command == 0x20:
+                self.start()
+
+        def hooked_read(pin):
+            if pin is self.pin and pin.value() and time.perf_counter() >= self.until:
+                pin.drive(0)
+            return digital_read(pin)
+
+        epd.send_command = hooked_command
+        epd.digital_read = hooked_read
+
+    def start(self):
+        import asyncio
+        self.refreshes += 1
+        self.until = time.perf_counter() + self.refresh_s
+        self.pin.drive(1)
+        token = self.refreshes
+        try:
+            asyncio.get_running_loop().call_later(self.refresh_s, self.release, token)
+        except RuntimeError:
+            pass
+
+    def release(self, token):
+        if token == self.refreshes and self.pin.value():
+            self.pin.drive(0)
+
+
+def bench_busy(args):
+    import asyncio
+    import contextlib
+    import os
+    import tempfile
+    import lora_receiver_display as receiver
+
+    # обновление B/W/R панели ~15 с, здесь в 10 раз быстрее; цена меняется
+    # каждые 0.3 с - за одно обновление приходит несколько кадров
+    refresh_s = 1.5
+    count = 8
+    payloads = [b"\xff\xff\x17" + json.dumps({
+        "name": "Apples", "weight": "1", "price": str(100 + i), "id": receiver.TAG_ID, "seq": i,
+    }).encode() for i in range(count)]
+
+    class Lora:
+        def __init__(self):
+            self.acked = {}
+
+        def send_fixed_message(self, addh, addl, channel, message):
+            self.acked[json.loads(message)["ack"]] = time.perf_counter()
+            return receiver.ResponseStatusCode.SUCCESS
+
+    async def run(background):
+        uart, lora = host_shim.UART(2), Lora()
+        epd = receiver.init_display()
+        panel = PanelBusy(epd, refresh_s)
+        store = receiver.ProductStore()
+        recent_seqs = []
+        receiver.display_updater = receiver.DisplayUpdater(epd) if background else None
+        tasks = [asyncio.create_task(receiver.receive_frames(
+            uart, receiver.MessageBuffer(),
+            lambda json_str, data: receiver.handle_frame(lora, epd, store, recent_seqs,
+                                                         json_str, data)))]
+        if background:
+            tasks.append(asyncio.create_task(receiver.display_updater.run()))
+
+        arrived = {}
+        start = time.perf_counter()
+        for i, payload in enumerate(payloads):
+            await asyncio.sleep(0.3)
+            uart.inject(payload)
+            arrived[i] = time.perf_counter()
+        # ждем, пока все подтверждено и панель отпущена
+        while len(lora.acked) < count or panel.pin.value() or (
+                background and receiver.display_updater.busy()):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        for task in tasks:
+            task.cancel()
+        receiver.display_updater = None
+
+        latency = [(lora.acked[i] - arrived[i]) * 1000 for i in arrived]
+        # на экране (в RAM панели) должен быть последний кадр
+        epd.buffer_balck[:], epd.buffer_red[:] = epd.shown_black, epd.shown_red
+        shown = receiver.framebuffer_digest(epd)
+        receiver.render_price_tag(epd, "Apples", "1", str(100 + count - 1))
+        newest = receiver.framebuffer_digest(epd) == shown
+        return latency, panel.refreshes, newest, elapsed
+
+    rows = []
+    cwd = os.getcwd()
+    power_save, receiver.POWER_SAVE = receiver.POWER_SAVE, False
+    try:
+        for name, background in (("blocking ReadBusy", False), ("DisplayUpdater + BUSY IRQ", True)):
+            with tempfile.TemporaryDirectory() as tmp:
+                os.chdir(tmp)
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        latency, refreshes, newest, elapsed = asyncio.run(run(background))
+                finally:
+                    os.chdir(cwd)
+            rows.append((name, refreshes, f"{sum(latency) / len(latency):.0f}",
+                         f"{max(latency):.0f}", "yes" if newest else "no", f"{elapsed:.1f}"))
+    finally:
+        receiver.POWER_SAVE = power_save
+
+    print_table(
+        f"Receiver: {count} price frames every 0.3 s, panel refresh {refresh_s} s (BUSY)",
+        ("display", "refreshes", "frame -> ACK avg ms", "max ms", "newest shown", "total s"),
+        rows)
+
+
+def bench_render(args):
+    import contextlib
+    import os
+    import zlib
+    import lora_receiver_display as receiver
+
+    products = [
+        ("short", ("Яблоки", "1", "120")),
+        ("long name", ("Bananas Ecuador premium", "0.75", "99.9")),
+        ("big total", ("Cheese", "12.5", "1899")),
+    ]
+    other = ("Груши", "0.5", "200")
+    repeat = max(1, args.repeat // 100)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    # паузы сброса и ожидания BUSY - время панели, а не кода, в замер не входят
+    epd.delay_ms = lambda ms: None
+    panel = host_shim.SSD1680(epd)
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd.init()
+        epd.display()
+
+    rows = []
+    for name, product in products:
+        turn = [False]
+
+        def draw():
+            # через раз другой товар, иначе одинаковый кадр не дойдет до панели
+            turn[0] = not turn[0]
+            receiver.draw_price_tag_with_data(epd, *(product if turn[0] else other))
+
+        # модель контроллера на чистом Python, на время замеров отключена
+        epd.spi.device = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            render_us, _ = measure(lambda: receiver.render_price_tag(epd, *product), repeat)
+            draw_us, _ = measure(draw, repeat)
+            display_us, _ = measure(lambda: epd.display(wait=False), repeat)
+
+        # проверка: RAM панели после полного и частичного обновления = буферы кадра
+        epd.spi.device = panel
+        with contextlib.redirect_stdout(io.StringIO()):
+            receiver.render_price_tag(epd, *other)
+            epd.display()
+            receiver.render_price_tag(epd, *product)
+            before = epd.spi.bytes_written
+            epd.display_partial()
+        sent = epd.spi.bytes_written - before
+        shown = panel.landscape_planes()
+        ok = shown == (bytes(epd.buffer_balck), bytes(epd.buffer_red))
+        if args.png:
+            os.makedirs(args.png, exist_ok=True)
+            panel.save_png(os.path.join(args.png, name.replace(" ", "_") + ".png"))
+        rows.append((name, f"{render_us / 1000:.2f}", f"{draw_us / 1000:.2f}",
+                     f"{display_us / 1000:.2f}", sent, "ok" if ok else "DIFFERS",
+                     f"{zlib.crc32(shown[0] + shown[1]):08x}"))
+
+    print_table(
+        "Receiver render per call (host, SSD1680 model checks panel RAM)",
+        ("product", "render_price_tag ms", "draw_price_tag_with_data ms", "display() ms",
+         "partial SPI B", "panel RAM", "RAM crc32"),
+        rows)
+    if args.png:
+        print(f"\nPNG: {args.png}/")
+
+
+def bench_bitmap(args):
+    import contextlib
+    import os
+    import tempfile
+    import tag_render
+    import tag_bitmap
+    import tag_codec
+    import lora_sender_display as gateway
+    import lora_receiver_display as receiver
+
+    # E32 433T20D по умолчанию: 2.4 кбит/с в эфире
+    air_bps = 2400
+    updates = [
+        ("first image", ("Apples", "1", "120")),
+        ("price change", ("Apples", "1", "125")),
+        ("weight change", ("Apples", "1.5", "125")),
+        ("new product", ("Bananas Ecuador", "0.75", "99")),
+    ]
+
+    class Lora:
+        acked = []
+
+        def send_fixed_message(self, addh, addl, channel, message):
+            self.acked.append(json.loads(message)["ack"])
+            return receiver.ResponseStatusCode.SUCCESS
+
+    def airtime(frames):
+        return sum(len(frame) for frame in frames) * 8 * 1000 // air_bps
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    cwd = os.getcwd()
+    rows = []
+    acked = None
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            store, lora = receiver.ProductStore(), Lora()
+            for name, product in updates:
+                image, base = tag_render.render_image(*product), acked
+                update = tag_render.bitmap_update(image, base)
+                data = update["data"]
+                parts = (len(data) + gateway.BITMAP_PART_CHARS - 1) // gateway.BITMAP_PART_CHARS
+                frames = [tag_codec.encode_bitmap_part(
+                    receiver.TAG_ID, data[i * gateway.BITMAP_PART_CHARS:(i + 1) * gateway.BITMAP_PART_CHARS],
+                    i, parts, update["base"], update["img"], 1000 + i) for i in range(parts)]
+
+                lora.acked = []
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for frame in frames:
+                        receiver.handle_frame(lora, epd, store, [], frame, receiver.parse_frame(frame))
+                ok = bytes(epd.buffer_balck) + bytes(epd.buffer_red) == image
+                if ok and len(lora.acked) == parts:
+                    acked = image
+
+                raw = tag_bitmap.encode(image, base)
+                apply_us, _ = measure(lambda: tag_bitmap.apply(bytearray(4000), bytearray(4000), raw),
+                                      max(1, args.repeat // 100))
+                price_frame = gateway._encode_price_frame(
+                    {"product_name": product[0], "weight": product[1], "current_price": product[2],
+                     "device_id": receiver.TAG_ID}, 1000)
+                rows.append((name, "delta" if update["base"] else "key", update["bytes"],
+                             f"{tag_bitmap.IMAGE_SIZE / update['bytes']:.0f}x", parts,
+                             sum(len(frame) for frame in frames), airtime(frames),
+                             airtime([price_frame]), f"{apply_us / 1000:.2f}",
+                             "ok" if ok else "DIFFERS", f"{len(lora.acked)}/{parts}"))
+
+            # ценник перерисовался сам (кадр с товаром): база не совпадет
+            with contextlib.redirect_stdout(io.StringIO()):
+                receiver.draw_price_tag_with_data(epd, "Pears", "1", "80")
+                image = tag_render.render_image("Pears", "1", "85")
+                update = tag_render.bitmap_update(image, acked)
+                frame = tag_codec.encode_bitmap_part(receiver.TAG_ID, update["data"], 0, 1,
+                                                     update["base"], update["img"], 2000)
+                lora.acked = []
+                receiver.handle_frame(lora, epd, store, [], frame, receiver.parse_frame(frame))
+            stale = "rejected, no ACK" if not lora.acked else "ACKED"
+        finally:
+            os.chdir(cwd)
+
+    print_table(
+        f"Server-rendered image: XOR delta to last ACKed + RLE, base64 in LoRa frames "
+        f"(raw {tag_bitmap.IMAGE_SIZE} B, airtime at {air_bps} bit/s)",
+        ("update", "kind", "RLE B", "ratio", "frames", "LoRa B", "air ms", "price air ms",
+         "apply ms", "tag frame", "ACKs"),
+        rows)
+    print(f"\nDelta against a base the tag no longer shows: {stale}")
+
+
+def legacy_landscape_display(epd):
+    """EPD_2in13_B_V4_Landscape.display() до пересылки плоскостей одним spi.write"""
+    epd.send_command(0x24)
+    for j in range(int(epd.width / 8) - 1, -1, -1):
+        for i in range(0, epd.height):
+            epd.send_data(epd.buffer_balck[i + j * epd.height])
+
+    epd.send_command(0x26)
+    for j in range(int(epd.width / 8) - 1, -1, -1):
+        for i in range(0, epd.height):
+            epd.send_data(epd.buffer_red[i + j * epd.height])
+
+    epd.TurnOnDisplay()
+
+
+def bench_transpose(args):
+    import contextlib
+    import random
+    import lora_receiver_display as receiver
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    # без ожидания BUSY: меряем только пересылку буферов
+    epd.TurnOnDisplay = lambda wait=True: epd.send_command(0x20)
+    panel = host_shim.SSD1680(epd)
+
+    def draw_random():
+        rnd = random.Random(4)
+        epd.buffer_balck[:] = rnd.randbytes(len(epd.buffer_balck))
+        epd.buffer_red[:] = rnd.randbytes(len(epd.buffer_red))
+
+    frames = [("tag", lambda: receiver.render_price_tag(epd, "Яблоки", "1", "120")),
+              ("random", draw_random)]
+    rows = []
+    for name, draw in frames:
+        draw()
+        epd.spi.device = panel
+        legacy = panel.capture(lambda: legacy_landscape_display(epd))
+        current = panel.capture(epd.display)
+        assert legacy == current, f"{name}: SPI stream differs"
+        # модель контроллера на чистом Python, в замер времени не входит
+        epd.spi.device = None
+
+        spi = epd.spi
+        calls = spi.transactions
+        legacy_us, legacy_peak = measure(lambda: legacy_landscape_display(epd), max(1, args.repeat // 200))
+        legacy_calls = (spi.transactions - calls) // (max(1, args.repeat // 200) + 2)
+        calls = spi.transactions
+        current_us, current_peak = measure(epd.display, max(1, args.repeat // 200))
+        current_calls = (spi.transactions - calls) // (max(1, args.repeat // 200) + 2)
+        rows.append((name, sum(len(data) for _, data in current), "identical",
+                     legacy_calls, current_calls, f"{legacy_us / 1000:.2f}", f"{current_us / 1000:.2f}",
+                     legacy_peak, current_peak))
+
+    print_table(
+        "EPD landscape display(): byte-per-call vs page-reversed tx buffer + one spi.write",
+        ("frame", "SPI bytes", "stream", "legacy writes", "bulk writes", "legacy ms", "bulk ms",
+         "legacy peak B", "bulk peak B"),
+        rows)
+
+
+class CallCounter:
+    """Обертка FrameBuffer: считает вызовы методов (на ESP32 каждый - вызов из Python в C)"""
+
+    def __init__(self, fb):
+        self.fb = fb
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.fb, name)
+
+        def call(*args):
+            self.calls += 1
+            return method(*args)
+        return call
+
+
+def scaled_text(fb, text, x, y, scale):
+    """Увеличенный встроенный шрифт 8x8: pixel() на каждую точку, fill_rect на закрашенные"""
+    import framebuf
+
+    small = CallCounter(framebuf.FrameBuffer(bytearray(8 * len(text)), 8 * len(text), 8,
+                                             framebuf.MONO_VLSB))
+    small.fill(0)
+    small.text(text, 0, 0, 1)
+    for sy in range(8):
+        for sx in range(8 * len(text)):
+            if small.pixel(sx, sy):
+                fb.fill_rect(x + sx * scale, y + sy * scale, scale, scale, 0)
+    return small.calls
+
+
+def bench_font(args):
+    import contextlib
+    import price_font
+    import lora_receiver_display as receiver
+    import tag_layout
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    text = "1234.50 ₽"
+    repeat = max(1, args.repeat // 100)
+
+    def cold():
+        tag_layout._glyph_cache.clear()
+        tag_layout.draw_price_text(epd.imagered, text, 10, 80)
+
+    def warm():
+        tag_layout.draw_price_text(epd.imagered, text, 10, 80)
+
+    def scaled():
+        return scaled_text(epd.imagered, "1234.50r", 10, 80, 4)
+
+    rows = []
+    for name, func in (("8x8 text x4, fill_rect per pixel", scaled),
+                       ("price_font, glyph cache cold", cold),
+                       ("price_font, glyph cache warm", warm)):
+        counter = CallCounter(epd.imagered)
+        real, epd.imagered = epd.imagered, counter
+        extra = func() or 0
+        counter.calls += extra
+        epd.imagered = real
+        us, peak = measure(func, repeat)
+        rows.append((name, counter.calls, f"{us / 1000:.2f}", peak))
+
+    print_table(
+        f"Big price rendering '{text}' ({price_font.HEIGHT} px, "
+        f"{len(price_font.BITMAPS)} B of bitmaps, {len(price_font.GLYPHS)} glyphs)",
+        ("method", "framebuf calls", "host ms", "peak B"),
+        rows)
+    print("\nhost ms: framebuf здесь на чистом Python, на ESP32 blit - один вызов в C на глиф")
+
+
+def bench_layout(args):
+    import contextlib
+    import json
+    import lora_receiver_display as receiver
+    import tag_layout
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    layout = tag_layout.Layout(tag_layout.DEFAULT_LAYOUT)
+    repeat = max(1, args.repeat // 100)
+
+    def uncached():
+        # как до кэша: каждый кадр рисует рамку и подписи заново
+        layout.static_black = None
+        layout.render(epd, "Яблоки Голден", "0.75", "129.9")
+
+    def cached():
+        layout.render(epd, "Яблоки Голден", "0.75", "129.9")
+
+    rows = []
+    for name, func in (("static redrawn every frame", uncached),
+                       ("static copied from cache", cached)):
+        func()
+        black, red = CallCounter(epd.imageblack), CallCounter(epd.imagered)
+        real = epd.imageblack, epd.imagered
+        epd.imageblack, epd.imagered = black, red
+        func()
+        epd.imageblack, epd.imagered = real
+        us, peak = measure(func, repeat)
+        rows.append((name, black.calls + red.calls, f"{us / 1000:.2f}", peak))
+
+    # макет, который не рисуется, отвергается целиком (ValueError), а не падает при рисовании
+    for bad in ({"static": [["rect", "black", None, 1, 2, 3]], "fields": []},
+                {"fields": [["name", "black", 0, 0, "text", "{1}", 10, "left"]]},
+                {"fields": [["name", "black", None, 0, "text", "{}", 10, "left"]]}):
+        try:
+            tag_layout.Layout(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"layout accepted: {bad}")
+
+    spec = json.dumps(tag_layout.DEFAULT_LAYOUT, ensure_ascii=False, separators=(",", ":"))
+    print_table(
+        f"Price tag render, default layout ({len(layout.static)} static ops, "
+        f"{len(layout.fields)} fields, {len(spec.encode())} B JSON)",
+        ("method", "framebuf calls", "host ms", "peak B"),
+        rows)
+
+
+
+# ---------------------------------------------------------------------------
+# Формат кадров: tag_codec на шлюзе, ценнике и сервере
+# ---------------------------------------------------------------------------
+
+def legacy_parse_frame(receiver, message):
+    """parse_frame приемника до tag_codec: префиксы, затем JSON / CSV / k=v по очереди"""
+    if message.startswith('{"layout"') or message.startswith('{"bmp"'):
+        try:
+            data = json.loads(message)
+            if isinstance(data, dict) and ('layout' in data or 'bmp' in data):
+                return data
+        except ValueError:
+            pass
+    return receiver.parse_product_message(message)
+
+
+FUZZ_CHARS = 'aZ09 .,-_{}"|%\\/:;=\t\nЯблокиЁё€😀'
+
+
+def fuzz_text(rnd, max_len):
+    return "".join(rnd.choice(FUZZ_CHARS) for _ in range(rnd.randint(0, max_len)))
+
+
+def fuzz_frames(rnd, count):
+    """Случайные кадры всех форматов: (кадр, что должен вернуть decode)"""
+    import tag_codec
+
+    cases = []
+    for i in range(count):
+        kind = rnd.randrange(5)
+        device_id = fuzz_text(rnd, 8)
+        seq = rnd.choice([None, rnd.randrange(65536)])
+        if kind < 2:
+            name, weight, price = fuzz_text(rnd, 30), fuzz_text(rnd, 6), fuzz_text(rnd, 8)
+            frame = tag_codec.encode_price(device_id, name, weight, price, seq, compact=kind == 0)
+            expected = {"name": name, "weight": weight, "price": price}
+            if seq is not None:
+                expected.update(id=device_id, seq=seq)
+        elif kind < 4:
+            seq = rnd.randrange(65536)
+            frame = tag_codec.encode_ack(device_id, seq, compact=kind == 2)
+            expected = {"ack": seq, "id": device_id}
+        else:
+            seq = rnd.randrange(65536)
+            chunk = "".join(rnd.choice("ABCxyz0189+/=") for _ in range(rnd.randint(1, 400)))
+            frame = tag_codec.encode_bitmap_part(device_id, chunk, 0, 1, rnd.randrange(2 ** 32),
+                                                 rnd.randrange(2 ** 32), seq)
+            expected = json.loads(frame)
+        cases.append((frame, expected))
+    return cases
+
+
+def mutate(rnd, data):
+    data = bytearray(data)
+    for _ in range(rnd.randint(1, 4)):
+        op = rnd.randrange(4)
+        pos = rnd.randrange(len(data) + 1)
+        if op == 0 and data:
+            data[pos % len(data)] = rnd.randrange(256)
+        elif op == 1:
+            data.insert(pos, rnd.choice(b'{}"|%\\:,P A\xd0\xff'))
+        elif op == 2 and data:
+            del data[pos % len(data)]
+        else:
+            data = data[:pos]
+    return bytes(data)
+
+
+def bench_fuzz(args):
+    import contextlib
+    import random
+    import tag_codec
+    import lora_sender_display as gateway
+    import lora_receiver_display as receiver
+
+    rnd = random.Random(43)
+    count = max(100, args.repeat)
+    cases = fuzz_frames(rnd, count)
+    rows = []
+
+    # кодирование -> разбор
+    bad = [(frame, tag_codec.decode(frame)) for frame, expected in cases
+           if tag_codec.decode(frame) != expected or tag_codec.decode(frame.encode()) != expected]
+    rows.append(("round trip str/bytes", len(cases), len(bad)))
+
+    # те же кадры потоком UART через MessageBuffer ценника: границы кадров
+    # не сбивают ни скобки, ни кавычки, ни | и % в полях
+    stream = b"".join(b"\xff\xff\x17" + frame.encode() for frame, _ in cases)
+    uart, buf, got = host_shim.UART(1), receiver.MessageBuffer(1024), []
+    for chunk in split_stream(stream, 58):
+        uart.inject(chunk)
+        buf.read_from(uart)
+        frame = buf.try_extract_json()
+        while frame:
+            got.append(receiver.parse_frame(frame))
+            frame = buf.try_extract_json()
+    framed_errors = len(cases) - sum(a == b for a, (_, b) in zip(got, cases))
+    rows.append(("MessageBuffer stream", len(got), framed_errors))
+
+    # ACK на шлюзе: _extract_frames + decode
+    acks = [(frame, expected) for frame, expected in cases if "ack" in expected
+            and "{" not in expected["id"] and "}" not in expected["id"]]
+    frames, _ = gateway._extract_frames(b"".join(frame.encode() for frame, _ in acks))
+    rows.append(("gateway ACK frames", len(frames),
+                 len(acks) - sum(tag_codec.decode(a) == b for a, (_, b) in zip(frames, acks))))
+
+    # искаженные и оборванные кадры и мусор: decode не бросает исключений
+    crashes, accepted = [], 0
+    for i in range(count * 5):
+        frame = cases[i % len(cases)][0].encode()
+        data = mutate(rnd, frame) if i % 5 else bytes(rnd.randrange(256) for _ in range(rnd.randint(0, 40)))
+        try:
+            accepted += tag_codec.decode(data) is not None
+        except Exception as e:
+            crashes.append((data, e))
+    rows.append(("mutated / garbage", count * 5, len(crashes)))
+
+    # разобранный кадр не роняет handle_frame ценника
+    handled_errors = 0
+
+    class Lora:
+        def send_fixed_message(self, addh, addl, channel, message):
+            return receiver.ResponseStatusCode.SUCCESS
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        epd = receiver.init_display()
+    lora, store = Lora(), receiver.ProductStore()
+    store.put = lambda product: "added"
+    store.last_product = lambda: None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(count):
+            text = mutate(rnd, cases[i][0].encode()).decode("utf-8", "replace")
+            frame = receiver.parse_frame(text)
+            if frame is None or "bmp" in frame or "layout" in frame:
+                continue
+            try:
+                receiver.handle_frame(lora, epd, store, [], text, frame)
+            except Exception:
+                handled_errors += 1
+    rows.append(("decoded mutants -> handle_frame", count, handled_errors))
+
+    print_table("Codec fuzz (tag_codec.decode)", ("check", "frames", "errors"), rows)
+    print(f"\nmutated frames still decoded (compact fields have no checksum): {accepted}")
+    for data, e in crashes[:5]:
+        print(f"  crash {e!r} on {data!r}")
+    for frame, result in bad[:5]:
+        print(f"  round trip {frame!r} -> {result!r}")
+    assert not crashes and not bad and not framed_errors and not handled_errors, "codec fuzz failed"
+
+
+def bench_codec(args):
+    import tag_codec
+    import tag_layout
+    import lora_receiver_display as receiver
+
+    air_bps = 2400
+    name, weight, price = "Яблоки Голден", "1.5", "129.9"
+    formats = [
+        ("price JSON", lambda: tag_codec.encode_price("11", name, weight, price, 1000, compact=False), True),
+        ("price compact", lambda: tag_codec.encode_price("11", name, weight, price, 1000), False),
+        ("ACK JSON", lambda: tag_codec.encode_ack("11", 1000), False),
+        ("ACK compact", lambda: tag_codec.encode_ack("11", 1000, compact=True), False),
+        ("layout", lambda: tag_codec.encode_layout("11", tag_layout.DEFAULT_LAYOUT, 1000), True),
+        ("bitmap part", lambda: tag_codec.encode_bitmap_part("11", "A" * 400, 0, 4, 123456789,
+                                                              987654321, 1000), True),
+    ]
+
+    rows = []
+    for label, encode, legacy_ok in formats:
+        frame = encode()
+        assert tag_codec.decode(frame) is not None, label
+        encode_us, _ = measure(encode, args.repeat)
+        decode_us, decode_peak = measure(lambda: tag_codec.decode(frame), args.repeat)
+        if legacy_ok:
+            legacy_us, _ = measure(lambda: legacy_parse_frame(receiver, frame), args.repeat)
+            legacy = f"{legacy_us:.1f}"
+        else:
+            # компактные кадры старый разбор не понимает, ACK он не разбирал
+            legacy = "-"
+        rows.append((label, len(frame.encode()), len(frame.encode()) * 8 * 1000 // air_bps,
+                     f"{encode_us:.1f}", f"{decode_us:.1f}", legacy, decode_peak))
+
+    print_table(f"LoRa frame formats (air ms at {air_bps} bit/s)",
+                ("format", "bytes", "air ms", "encode us", "decode us", "legacy decode us",
+                 "decode peak B"),
+                rows)
+
+    # кадр не того формата: старый разбор пробует JSON (исключение), CSV и k=v,
+    # decode отказывает по маркеру
+    rows = []
+    for label, frame in (("compact price", formats[1][1]()), ("noise", "{\x07\x13a,b;c=d}")):
+        legacy_us, _ = measure(lambda: legacy_parse_frame(receiver, frame), args.repeat)
+        decode_us, _ = measure(lambda: tag_codec.decode(frame), args.repeat)
+        rows.append((label, f"{legacy_us:.1f}", f"{decode_us:.1f}"))
+    print_table("Frames the legacy parser does not know", ("frame", "legacy us", "decode us"), rows)
+
+# ---------------------------------------------------------------------------
+# Сервер: загрузка прайс-листа
+# ---------------------------------------------------------------------------
+
+def make_price_list(tags, rows, seed=44):
+    """Выгрузка: каждая 10-я строка меняет цену, каждая 50-я - неизвестный ценник"""
+    import random
+
+    rnd = random.Random(seed)
+    out = []
+    for i in range(rows):
+        tag = tags[rnd.randrange(len(tags))]
+        row = {"tag_id": tag["id"], "name": tag["name"], "current_price": tag["current_price"],
+               "weight": tag["weight"]}
+        if i % 10 == 0:
+            row["current_price"] = round(rnd.uniform(10, 999), 2)
+        if i % 50 == 1:
+            row["tag_id"] = 100000 + i
+        out.append(row)
+    return out
+
+
+def legacy_batch_update(tags, body, push):
+    """/batch-update: весь JSON в памяти, поиск ценника перебором, отправка каждой строки"""
+    data = json.loads(body)
+    results = []
+    for update in data.get("updates", []):
+        tag = next((t for t in tags if t["id"] == update.get("tag_id")), None)
+        if tag is None:
+            results.append({"tag_id": update.get("tag_id"), "status": "error"})
+            continue
+        tag["current_price"] = update["current_price"]
+        tag["weight"] = update["weight"]
+        results.append({"tag_id": update.get("tag_id"), "status": "success"})
+        push(tag)
+    return results
+
+
+def bench_import(args):
+    import copy
+    import price_import
+
+    tags = [{"id": i, "name": f"Товар {i}", "current_price": float(i % 500 + 10), "weight": 1.0,
+             "esp_ip": "10.0.0.1"} for i in range(1, 2001)]
+    rows = make_price_list(tags, max(2000, args.repeat * 10))
+
+    csv_body = io.StringIO()
+    csv_body.write("tag_id;name;price;weight\n")
+    for row in rows:
+        price = str(row["current_price"]).replace(".", ",")
+        csv_body.write(f'{row["tag_id"]};"{row["name"]}";{price};{row["weight"]}\n')
+    bodies = {
+        "CSV ;": (csv_body.getvalue().encode(), "csv"),
+        "NDJSON": ("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode(), "ndjson"),
+    }
+    batch = json.dumps({"updates": [{k: row[k] for k in ("tag_id", "current_price", "weight")}
+                                    for row in rows]}).encode()
+
+    def run(func):
+        store = copy.deepcopy(tags)
+        pushed = []
+        tracemalloc.start()
+        start = time.perf_counter()
+        func(store, pushed.append)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak, pushed
+
+    results = []
+    elapsed, peak, pushed = run(lambda store, push: legacy_batch_update(store, batch, push))
+    results.append(("/batch-update JSON", len(batch), f"{len(rows) / elapsed:.0f}", len(pushed), "-", peak))
+    for label, (body, fmt) in bodies.items():
+        summary = {}
+        elapsed, peak, pushed = run(lambda store, push: summary.update(
+            price_import.import_rows(price_import.iter_rows(io.BytesIO(body), fmt), store, push)))
+        assert summary["errors"] == 0, summary["messages"]
+        results.append((f"/api/import {label}", len(body), f"{len(rows) / elapsed:.0f}", len(pushed),
+                        f"{summary['unchanged']}/{summary['updated']}/{summary['unknown']}", peak))
+
+    # пустая ячейка названия не стирает название ценника
+    for body, fmt in ((b"tag_id;name;price;weight\n1;;12,5;\n", "csv"),
+                      (b'{"id": 1, "name": ""}\n{"id": 2, "name": "  ", "price": 3}\n', "ndjson")):
+        store, pushed = copy.deepcopy(tags), []
+        summary = price_import.import_rows(price_import.iter_rows(io.BytesIO(body), fmt), store, pushed.append)
+        assert summary["errors"] == 0, summary["messages"]
+        assert store[0]["name"] == tags[0]["name"] and store[1]["name"] == tags[1]["name"], fmt
+        assert store[0]["current_price"] == (12.5 if fmt == "csv" else tags[0]["current_price"])
+        assert all(tag["name"] for tag in pushed), pushed
+
+    print_table(f"Price list import: {len(rows)} rows, {len(tags)} tags "
+                f"(every 10th row changes a price, every 50th unknown tag)",
+                ("path", "body B", "rows/s", "pushes", "same/changed/unknown", "peak B"),
+                results)
+
+
+def bench_schedule(args):
+    import tag_codec
+    import tag_render
+    import price_schedule
+
+    gateways = ["10.0.0.%d" % i for i in range(1, 5)]
+    count = max(400, args.repeat // 5)
+    # каждый 10-й ценник рисует сервер
+    tags = [{"id": i, "name": f"Товар {i}", "current_price": 100.0, "weight": 1.0,
+             "esp_ip": gateways[i % len(gateways)], "render": "server" if i % 10 == 0 else "tag"}
+            for i in range(count)]
+    send_s = 0.002      # HTTP-запрос к шлюзу
+
+    def payload(tag, changes):
+        future = dict(tag, **changes)
+        if future["render"] == "server":
+            return tag_render.render_image(future["name"], future["weight"], future["current_price"])
+        return tag_codec.price_request(tag["id"], future["name"], future["current_price"], future["weight"])
+
+    def send(data):
+        time.sleep(send_s)
+        return True
+
+    def stats(lag):
+        lag = sorted(lag)
+        return f"{lag[len(lag) // 2] * 1000:.0f}", f"{lag[-1] * 1000:.0f}"
+
+    changes = [(tag["id"], {"current_price": 79.9}) for tag in tags]
+    rows = []
+
+    # клик в at: данные готовятся и отправляются одним циклом по всем шлюзам
+    at = time.time()
+    lag = []
+    for tag_id, change in changes:
+        send(payload(tags[tag_id], change))
+        lag.append(time.time() - at)
+    rows.append(("sequential at click", "-", *stats(lag)))
+
+    # планировщик: подготовка заранее, шлюзы параллельно
+    scheduler = price_schedule.Scheduler(
+        lambda tag_id, change: (tags[tag_id]["esp_ip"], payload(tags[tag_id], change)),
+        send, prestage=0.5, spacing=0, background=False)
+    batch = scheduler.schedule(time.time() + 1, changes)
+    while batch["state"] != "done":
+        scheduler.run_due(time.time())
+        time.sleep(price_schedule.TICK_S / 10)
+    report = scheduler.report(batch)
+    assert report["sent"] == count, report
+    rows.append(("timer wheel, prestaged", f"{report['start_lag_s'] * 1000:.0f}", *stats(batch["lag"])))
+
+    # ведущий процесс сменился в момент at: пакет есть у обоих планировщиков, отправляет один
+    import os
+    import tempfile
+    import tag_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = tag_store.TagStore(os.path.join(tmp, "state.db"))
+        batch_id = store.add_batch(time.time(), changes)
+        sent = []
+        leaders = [price_schedule.Scheduler(lambda tag_id, change: ("gw", tag_id), lambda data: sent.append(data) or True,
+                                            prestage=0, spacing=0, background=False, claim=store.claim_batch)
+                   for _ in range(2)]
+        batches = [leader.schedule(time.time(), changes, batch_id=batch_id) for leader in leaders]
+        for leader in leaders:
+            leader.run_due(time.time() + 1)
+        deadline = time.time() + 5
+        while any(batch["state"] == "sending" for batch in batches) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(sent) == count, f"{len(sent)} sends for {count} tags"
+        assert sum(batch_id in leader.batches for leader in leaders) == 1
+        assert store.batches()[0]["fired"] is not None and not store.cancel_batch(batch_id)
+
+    print_table(f"Scheduled price change: {count} tags on {len(gateways)} gateways "
+                f"({send_s * 1000:.0f} ms per request, every 10th tag server-rendered)",
+                ("dispatch", "start lag ms", "lag p50 ms", "lag max ms"),
+                rows)
+
+    # само колесо: добавление и срабатывание таймеров
+    timers = 100000
+    wheel = price_schedule.TimerWheel(0)
+    start = time.perf_counter()
+    for i in range(timers):
+        wheel.add(i * 0.007 % 3600, i)
+    added = time.perf_counter() - start
+    fired = 0
+    for second in range(3601):
+        fired += len(wheel.advance(second))
+    elapsed = time.perf_counter() - start
+    print(f"\ntimer wheel: {timers} timers over 1 h, add {added / timers * 1e6:.2f} us, "
+          f"add + fire {elapsed / timers * 1e6:.2f} us per timer, fired {fired}")
+
+
+def bench_gateways(args):
+    import contextlib
+    import gateway_registry
+
+    config = {
+        "gw-1": {"ip": "10.0.0.1", "zones": ["A"], "capacity": 300},
+        "gw-2": {"ip": "10.0.0.2", "zones": ["A", "B"], "capacity": 300},
+        "gw-3": {"ip": "10.0.0.3", "zones": ["B"], "capacity": 300},
+    }
+    count = max(300, args.repeat // 10)
+    send_s = 0.002
+    timeout_s = 0.02
+
+    def make_tags():
+        # как сейчас: весь зал A на gw-1, зал B на gw-3
+        return [{"id": i, "zone": "A" if i % 3 else "B", "esp_ip": "10.0.0.1" if i % 3 else "10.0.0.3"}
+                for i in range(count)]
+
+    def make_send(dead):
+        def send(ip):
+            if ip in dead:
+                time.sleep(timeout_s)
+                return {"success": False, "error": "timeout"}
+            time.sleep(send_s)
+            return {"success": True, "status_code": 200}
+        return send
+
+    rows = []
+    for dead in ((), ("10.0.0.1",)):
+        label = "gw-1 down" if dead else "all up"
+        send = make_send(dead)
+
+        tags = make_tags()
+        start = time.perf_counter()
+        sent = sum(send(tag["esp_ip"])["success"] for tag in tags)
+        elapsed = time.perf_counter() - start
+        per_ip = [sum(tag["esp_ip"] == info["ip"] for tag in tags) for info in config.values()]
+        rows.append((label, "fixed esp_ip, sequential", "/".join(map(str, per_ip)),
+                     f"{sent}/{count}", 0, f"{elapsed * 1000:.0f}"))
+
+        tags = make_tags()
+        registry = gateway_registry.GatewayRegistry(config)
+        registry.assign(tags)
+        start = time.perf_counter()
+        results = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for tag in tags:
+                registry.submit(tag, lambda ip, send=send: results.append(send(ip)) or results[-1])
+            while True:
+                status = registry.status()
+                if all(g["queued"] == 0 and g["in_flight"] == 0 for g in status) and \
+                        sum(r["success"] for r in results) + sum(g["failed"] for g in status) >= count:
+                    break
+                time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        # все ценники отправлены, распределение по capacity, через резервный - только ценники gw-1
+        assert sum(g["sent"] for g in status) == count, status
+        assert sum(g["assigned"] for g in status) == count and \
+            max(g["assigned"] for g in status) - min(g["assigned"] for g in status) <= 2, status
+        assert sum(g["failovers"] for g in status) == (status[0]["assigned"] if dead else 0), status
+        rows.append((label, "registry + failover", "/".join(str(g["assigned"]) for g in status),
+                     f"{sum(g['sent'] for g in status)}/{count}", sum(g["failovers"] for g in status),
+                     f"{elapsed * 1000:.0f}"))
+
+    # исключение в send() (рисование, база) - не отказ шлюза: шлюз доступен, очередь работает
+    registry = gateway_registry.GatewayRegistry(config)
+    tags = make_tags()[:gateway_registry.FAIL_THRESHOLD * 3]
+    registry.assign(tags)
+    done = []
+
+    def broken(ip):
+        raise RuntimeError("render failed")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tag in tags:
+            registry.submit(tag, broken)
+        registry.submit({"id": -1, "zone": "A", "esp_ip": "10.0.0.1"},
+                        lambda ip: done.append(ip) or {"success": True, "status_code": 200})
+        deadline = time.time() + 5
+        while time.time() < deadline and not (
+                done and sum(g["failed"] for g in registry.status()) >= len(tags)):
+            time.sleep(0.001)
+    status = registry.status()
+    assert done and all(g["healthy"] and g["failures"] == 0 and g["failovers"] == 0 for g in status), status
+    assert sum(g["failed"] for g in status) == len(tags), status
+    try:
+        gateway_registry.GatewayRegistry({"gw-0": {"ip": "10.0.0.9", "capacity": 0}})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("capacity 0 accepted")
+
+    print_table(f"Dispatch of {count} tags: zone A in range of gw-1 and gw-2, zone B of gw-2 and gw-3 "
+                f"({send_s * 1000:.0f} ms per request, {timeout_s * 1000:.0f} ms timeout)",
+                ("gateways", "dispatch", "tags per gw", "sent", "failovers", "total ms"),
+                rows)
+
+
+def bench_events(args):
+    import os
+    import event_bus
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    # перезагрузка главной: шаблоны без подстановок - нижняя граница ответа
+    page = sum(os.path.getsize(os.path.join(here, "templates", name)) for name in ("base.html", "index.html"))
+    tag = {"id": 11, "name": "Яблоки Голден", "current_price": 129.9, "weight": 1.0,
+           "battery_level": 85, "last_seen": "2026-10-20T08:00:00", "esp_ip": "10.133.210.157"}
+
+    rows = []
+    for clients in (1, 10, 50):
+        bus = event_bus.EventBus(max_clients=clients)
+        queues = [bus.subscribe() for _ in range(clients)]
+
+        def publish():
+            bus.publish("tag", tag)
+            for client in queues:
+                client.get_nowait()
+
+        publish_us, _ = measure(publish, args.repeat)
+        size = len(bus.history[-1][1].encode())
+        rows.append((clients, size, f"{publish_us:.1f}", f"{publish_us / clients:.2f}",
+                     f"{page * clients}", f"{size * clients}"))
+
+    print_table(f"SSE fan-out of one tag change (reload of / is at least {page} B per client)",
+                ("clients", "event B", "publish us", "us per client", "reload B", "SSE B"),
+                rows)
+
+    # переподключение с Last-Event-ID и отставший клиент
+    bus = event_bus.EventBus()
+    for i in range(10):
+        bus.publish("tag", dict(tag, current_price=i))
+    replay = bus.subscribe(last_event_id=7)
+    replayed = [replay.get_nowait() for _ in range(replay.qsize())]
+    stale = bus.subscribe(last_event_id=-5)
+    slow = bus.subscribe()
+    for i in range(event_bus.CLIENT_QUEUE_SIZE + 1):
+        bus.publish("tag", tag)
+    print(f"\nreconnect after id 7: {len(replayed)} events replayed; "
+          f"too old: {stale.get_nowait().splitlines()[1]}; "
+          f"slow client dropped: {slow not in bus.clients} (dropped {bus.dropped})")
+
+    # клиентов у процесса не больше max_clients, место освобождается при отключении
+    bus = event_bus.EventBus(max_clients=2)
+    first, second = bus.subscribe(), bus.subscribe()
+    assert bus.subscribe() is None and bus.rejected == 1
+    stream = bus.stream(first)
+    next(stream)
+    stream.close()
+    assert first not in bus.clients and bus.subscribe() is not None and second in bus.clients
+
+
+def _catalog_request(tags, count, rnd, write, write_ratio):
+    """Запрос к серверу: чаще список ценников (сортировка + JSON, как /tags и /api/tags), иногда правка"""
+    if rnd.random() < write_ratio:
+        write(rnd.randrange(count) + 1, round(rnd.uniform(10, 999), 2))
+        return
+    json.dumps(sorted(tags(), key=lambda tag: tag["name"].lower()), ensure_ascii=False)
+
+
+def _workers_globals(seed, count, duration, write_ratio, start, out):
+    import random
+
+    # как было: у каждого процесса свой PRICE_TAGS
+    tags = [{"id": i, "name": f"Товар {i}", "current_price": 100.0, "weight": 1.0} for i in range(1, count + 1)]
+    rnd = random.Random(seed)
+    start.wait()
+    ops = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        _catalog_request(lambda: [dict(tag) for tag in tags], count, rnd,
+                         lambda tag_id, price: tags[tag_id - 1].update(current_price=price), write_ratio)
+        ops += 1
+    out.put((ops, json.dumps(tags, sort_keys=True)))
+
+
+def _workers_store(path, seed, count, duration, write_ratio, start, out):
+    import random
+    import tag_store
+
+    store = tag_store.TagStore(path)
+    rnd = random.Random(seed)
+    start.wait()
+    ops = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        _catalog_request(store.tags, count, rnd,
+                         lambda tag_id, price: store.update(tag_id, {"current_price": price}), write_ratio)
+        ops += 1
+    out.put((ops, None))
+
+
+def _workers_gateway(path, sends, down, start, out, stats, stats_lock):
+    import threading
+    import gateway_registry
+    import tag_store
+
+    # шлюз gw с concurrency 1 и резервный; path=None - реестр только процесса
+    registry = gateway_registry.GatewayRegistry(
+        {"gw": {"ip": "gw", "concurrency": 1}, "backup": {"ip": "backup", "concurrency": 4}},
+        shared=tag_store.TagStore(path) if path else None)
+
+    def send(ip):
+        with stats_lock:
+            if ip == "gw":
+                stats[0] += 1
+                stats[1] = max(stats[1], stats[0])
+                stats[2] += 1
+        time.sleep(0.005)
+        with stats_lock:
+            if ip == "gw":
+                stats[0] -= 1
+        if down and ip == "gw":
+            return {"success": False, "status_code": None, "error": "timeout"}
+        return {"success": True, "status_code": 200}
+
+    def thread(n):
+        for i in range(sends):
+            registry.send_now({"id": n * sends + i, "gateway": "gw", "esp_ip": "gw"}, send)
+
+    start.wait()
+    threads = [threading.Thread(target=thread, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    out.put(True)
+
+
+def bench_workers(args):
+    import multiprocessing
+    import os
+    import tempfile
+    import gateway_registry
+    import tag_store
+
+    count = 500
+    write_ratio = 0.05
+    duration = max(1.0, args.repeat / 2000)
+    cores = os.cpu_count() or 1
+
+    def run(target, workers, make_args):
+        start = multiprocessing.Event()
+        out = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=target, args=make_args(i) + (start, out)) for i in range(workers)]
+        for proc in procs:
+            proc.start()
+        start.set()
+        results = [out.get(timeout=duration + 30) for _ in procs]
+        for proc in procs:
+            proc.join()
+        return sum(ops for ops, _ in results) / duration, [view for _, view in results]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        store = tag_store.TagStore(path)
+        store.seed([{"id": i, "name": f"Товар {i}", "current_price": 100.0, "weight": 1.0}
+                    for i in range(1, count + 1)])
+        base = None
+        for workers in (1, 2, 4):
+            rate, views = run(_workers_globals, workers, lambda i: (i, count, duration, write_ratio))
+            rows.append(("module globals", workers, f"{rate:.0f}", "-", "-", len(set(views))))
+            rate, _ = run(_workers_store, workers, lambda i: (path, i, count, duration, write_ratio))
+            base = base or rate
+            # все процессы видят одно: свежие TagStore читают ту же базу
+            views = {json.dumps(tag_store.TagStore(path).tags(), sort_keys=True) for _ in range(workers)}
+            assert len(views) == 1, f"{workers} workers: {len(views)} catalogs"
+            rows.append(("tag_store (SQLite)", workers, f"{rate:.0f}", f"{rate / base:.2f}",
+                         f"{rate / base / min(workers, cores) * 100:.0f}%", len(views)))
+
+    print_table(f"Catalog requests across worker processes: {count} tags, {write_ratio * 100:.0f}% writes, "
+                f"{duration:.1f} s per run, {cores} CPU core(s) - speedup is bounded by cores",
+                ("state", "workers", "requests/s", "speedup", "per core", "distinct catalogs"),
+                rows)
+
+    # места и доступность шлюза: у каждого процесса свои или общие в базе
+    sends = 10
+    rows = []
+    for workers in (1, 4):
+        for shared in (False, True):
+            row = ["shared (SQLite)" if shared else "per process", workers]
+            for down in (False, True):
+                with tempfile.TemporaryDirectory() as tmp:
+                    stats = multiprocessing.Array("i", 3)
+                    stats_lock = multiprocessing.Lock()
+                    path = os.path.join(tmp, "state.db") if shared else None
+                    if path:
+                        tag_store.TagStore(path)
+                    start = multiprocessing.Event()
+                    out = multiprocessing.Queue()
+                    procs = [multiprocessing.Process(target=_workers_gateway,
+                                                     args=(path, sends, down, start, out, stats, stats_lock))
+                             for _ in range(workers)]
+                    for proc in procs:
+                        proc.start()
+                    start.set()
+                    for _ in procs:
+                        out.get(timeout=120)
+                    for proc in procs:
+                        proc.join()
+                    row.append(stats[1] if not down else stats[2])
+            peak, requests = row[2:]
+            # общая база: concurrency 1 и FAIL_THRESHOLD отказов - на все процессы вместе
+            limit = 1 if shared else workers
+            assert peak <= limit, f"{row[0]}, {workers} workers: {peak} concurrent requests on gw"
+            assert requests == gateway_registry.FAIL_THRESHOLD * limit, \
+                f"{row[0]}, {workers} workers: {requests} requests to down gw"
+            rows.append(row)
+    print_table(f"Gateway with concurrency 1, 4 threads x {sends} sends per process; "
+                f"down: every request to it times out (FAIL_THRESHOLD {gateway_registry.FAIL_THRESHOLD})",
+                ("gateway state", "workers", "peak concurrent on gw", "requests to down gw"),
+                rows)
+
+
+def bench_threads(args):
+    import os
+    import random
+    import sys
+    import tempfile
+    import threading
+    import tag_store
+
+    pairs = 100
+    total = 200.0       # цены ценников 2k и 2k+1 в сумме всегда total
+    readers, writers = 8, 2
+    duration = max(1.0, args.repeat / 2000)
+
+    def make_tags():
+        return [{"id": i, "name": f"Товар {i}", "current_price": total / 2, "weight": 1.0,
+                 "last_seen": "2026-10-20T08:00:00"} for i in range(pairs * 2)]
+
+    def torn(tags):
+        prices = {tag["id"]: tag["current_price"] for tag in tags}
+        return sum(prices[i] + prices[i + 1] != total for i in range(0, pairs * 2, 2))
+
+    def run(read, write):
+        stop = threading.Event()
+        counts = {"reads": 0, "writes": 0, "torn": 0, "errors": 0, "stale": 0}
+        lock = threading.Lock()
+
+        def reader():
+            seen = -1
+            mine = {"reads": 0, "torn": 0, "errors": 0, "stale": 0}
+            while not stop.is_set():
+                try:
+                    version, tags = read()
+                    # как /tags и /api/tags: сортировка и JSON того же списка
+                    json.dumps(sorted(tags, key=lambda tag: tag["name"].lower()), ensure_ascii=False)
+                    mine["torn"] += torn(tags) > 0
+                    mine["stale"] += version < seen
+                    seen = max(seen, version)
+                except RuntimeError:
+                    # dictionary changed size during iteration
+                    mine["errors"] += 1
+                mine["reads"] += 1
+            with lock:
+                for key, value in mine.items():
+                    counts[key] += value
+
+        def writer(seed):
+            rnd = random.Random(seed)
+            done = 0
+            while not stop.is_set():
+                pair = rnd.randrange(pairs) * 2
+                write(pair, round(rnd.uniform(1, total - 1), 2), rnd)
+                done += 1
+            with lock:
+                counts["writes"] += done
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return counts
+
+    # как было: общий список, ценники меняются на месте, без блокировок
+    legacy = make_tags()
+
+    def legacy_read():
+        return 0, legacy.copy()
+
+    def legacy_write(pair, price, rnd):
+        a, b = legacy[pair], legacy[pair + 1]
+        a["current_price"] = price
+        a["last_seen"] = time.time()
+        b["current_price"] = total - price
+        # send_tag / send-test: ключи ценника появляются и пропадают
+        if rnd.random() < 0.5:
+            a["delivery"] = {"seq": 1, "state": "pending"}
+        else:
+            a.pop("delivery", None)
+
+    rows = []
+    switch = sys.getswitchinterval()
+    # частое переключение потоков - как на сервере под нагрузкой
+    sys.setswitchinterval(1e-5)
+    try:
+        counts = run(legacy_read, legacy_write)
+        rows.append(("shared list, in place", *(counts[key] for key in ("reads", "writes")),
+                     f"{counts['reads'] / duration:.0f}", f"{counts['writes'] / duration:.0f}",
+                     counts["torn"], counts["errors"], "-", torn(legacy)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = tag_store.TagStore(os.path.join(tmp, "state.db"))
+            store.seed(make_tags())
+
+            def store_read():
+                snapshot = store.snapshot()
+                return snapshot.version, snapshot.values
+
+            def store_write(pair, price, rnd):
+                store.update_many([(pair, {"current_price": price, "last_seen": time.time(),
+                                           "delivery": {"seq": 1, "state": "pending"} if rnd.random() < 0.5
+                                           else None}),
+                                   (pair + 1, {"current_price": total - price})])
+
+            counts = run(store_read, store_write)
+            try:
+                store.tag(0)["current_price"] = 0
+                frozen = "no"
+            except TypeError:
+                frozen = "yes"
+            rows.append(("tag_store snapshots", *(counts[key] for key in ("reads", "writes")),
+                         f"{counts['reads'] / duration:.0f}", f"{counts['writes'] / duration:.0f}",
+                         counts["torn"], counts["errors"], counts["stale"], torn(store.tags())))
+            # снимок: все ценники на один номер изменения, номер у читателя не убывает
+            assert counts["reads"] and counts["writes"], counts
+            assert counts["torn"] == 0 and counts["errors"] == 0 and counts["stale"] == 0, counts
+            assert torn(store.tags()) == 0 and frozen == "yes"
+    finally:
+        sys.setswitchinterval(switch)
+
+    print_table(f"{readers} readers + {writers} writers for {duration:.1f} s: {pairs} tag pairs, "
+                f"each write moves price within a pair (sum stays {total:.0f})",
+                ("store", "reads", "writes", "reads/s", "writes/s", "torn reads", "read errors",
+                 "version went back", "torn at end"),
+                rows)
+    print(f"snapshot tags read-only: {frozen}")
+
+
+def bench_pages(args):
+    import os
+    import tempfile
+    try:
+        import flask
+    except ImportError:
+        print("\npages: нужен Flask (pip install flask)")
+        return
+    import fragment_cache
+    import tag_store
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    app = flask.Flask("pages", template_folder=os.path.join(here, "templates"))
+    count = 500
+    repeat = max(20, args.repeat // 100)
+
+    def index(cache, snapshot):
+        tags = snapshot.values
+        row = cache.template(app.jinja_env, "fragments/index_row.html")
+        stats = cache.template(app.jinja_env, "fragments/stats.html")
+        return flask.render_template("index.html", total_tags=len(tags),
+                                     stats=stats("index", snapshot.version, total_tags=len(tags)),
+                                     rows=[row(tag["id"], snapshot.versions[tag["id"]], tag=tag) for tag in tags],
+                                     PRICE_TAGS=tags, current_user="admin", user_role="admin")
+
+    def tags_list(cache, snapshot):
+        tags = sorted(snapshot.values, key=lambda tag: tag["current_price"])
+        row = cache.template(app.jinja_env, "fragments/tags_row.html")
+        return flask.render_template("tags.html", tags=tags, search="", sort_by="current_price", sort_order="asc",
+                                     rows=[row(tag["id"], snapshot.versions[tag["id"]], tag=tag) for tag in tags],
+                                     current_user="admin", user_role="admin")
+
+    def detail(cache, snapshot):
+        tag = snapshot.tags[1]
+        render = cache.template(app.jinja_env, "fragments/tag_detail.html")
+        return flask.render_template("tag_detail.html", tag=tag, detail=render(1, snapshot.versions[1], tag=tag),
+                                     current_user="admin", user_role="admin")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp, app.test_request_context("/"):
+        store = tag_store.TagStore(os.path.join(tmp, "state.db"))
+        store.seed([{"id": i, "name": f"Товар {i}", "current_price": float(i % 500 + 10), "weight": 1.0,
+                     "battery_level": i % 100, "last_seen": "2026-10-20T08:00:00", "esp_ip": "10.0.0.1"}
+                    for i in range(1, count + 1)])
+        price = [100.0]
+
+        def edit(tags):
+            # правка / пакет изменений между запросами (время не считается)
+            price[0] += 1
+            store.update_many([(tag_id, {"current_price": price[0]}) for tag_id in tags])
+
+        for name, page in (("/", index), ("/tags", tags_list), ("/tag/1", detail)):
+            off = fragment_cache.FragmentCache(size=0)
+            cache = fragment_cache.FragmentCache()
+            assert page(off, store.snapshot()) == page(cache, store.snapshot())
+            for label, cached, changed in (("no cache", off, ()), ("cache, nothing changed", cache, ()),
+                                           ("cache, 1 tag edited", cache, (1,)),
+                                           ("cache, batch of 50 tags", cache, range(1, 51))):
+                elapsed = 0
+                misses = cached.misses
+                for _ in range(repeat):
+                    if changed:
+                        edit(changed)
+                    snapshot = store.snapshot()
+                    start = time.perf_counter()
+                    html = page(cached, snapshot)
+                    elapsed += time.perf_counter() - start
+                rows.append((name, label, f"{elapsed / repeat * 1000:.2f}",
+                             f"{(cached.misses - misses) / repeat:.0f}", len(html)))
+            # кэш отдает то же, что рисуется заново
+            assert page(off, store.snapshot()) == page(cache, store.snapshot())
+
+    print_table(f"Page render with fragment cache: {count} tags, {repeat} renders per row",
+                ("page", "case", "ms per page", "fragments drawn", "page B"),
+                rows)
+
+
+BENCHES = {
+    "busy": bench_busy,
+    "bitmap": bench_bitmap,
+    "codec": bench_codec,
+    "display": bench_display,
+    "events": bench_events,
+    "font": bench_font,
+    "framing": bench_framing,
+    "gateways": bench_gateways,
+    "fuzz": bench_fuzz,
+    "http": bench_http,
+    "import": bench_import,
+    "layout": bench_layout,
+    "pages": bench_pages,
+    "partial": bench_partial,
+    "render": bench_render,
+    "response": bench_response,
+    "rx": bench_rx,
+    "schedule": bench_schedule,
+    "store": bench_store,
+    "tags": bench_tags,
+    "threads": bench_threads,
+    "transpose": bench_transpose,
+    "workers": bench_workers,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры кода прошивки на CPython")
+    parser.add_argument("bench", choices=sorted(BENCHES) + ["all"])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--png", help="папка для PNG кадров панели (render)")
+    args = parser.parse_args()
+
+    names = sorted(BENCHES) if args.bench == "all" else [args.bench]
+    for name in names:
+        BENCHES[name](args)
+
+
+if __name__ == "__main__":
+    main()
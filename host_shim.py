@@ -0,0 +1,790 @@
+"""
+Заглушки модулей MicroPython для запуска кода прошивки на CPython
+
+Нужны для замеров и отладки на ПК, на контроллер не загружаются:
+
+    import host_shim
+    host_shim.install()
+    import lora_sender_display
+"""
+
+import json
+import random
+import sys
+import time
+import types
+
+
+# ---------------------------------------------------------------------------
+# utime / urandom / ujson
+# ---------------------------------------------------------------------------
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_START = time.perf_counter()
+
+
+def ticks_ms():
+    return int((time.perf_counter() - _TICKS_START) * 1000) % _TICKS_PERIOD
+
+
+def ticks_us():
+    return int((time.perf_counter() - _TICKS_START) * 1000000) % _TICKS_PERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % _TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) % _TICKS_PERIOD
+    if diff >= _TICKS_PERIOD // 2:
+        diff -= _TICKS_PERIOD
+    return diff
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000.0)
+
+
+def sleep_us(us):
+    time.sleep(us / 1000000.0)
+
+
+def _make_utime():
+    module = types.ModuleType("utime")
+    for name in ("time", "sleep", "localtime", "gmtime", "mktime", "ctime"):
+        setattr(module, name, getattr(time, name))
+    for func in (ticks_ms, ticks_us, ticks_add, ticks_diff, sleep_ms, sleep_us):
+        setattr(module, func.__name__, func)
+    return module
+
+
+def _make_urandom():
+    module = types.ModuleType("urandom")
+    for name in ("getrandbits", "randint", "random", "choice", "uniform"):
+        setattr(module, name, getattr(random, name))
+    return module
+
+
+# ---------------------------------------------------------------------------
+# machine / network
+# ---------------------------------------------------------------------------
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self.mode = mode
+        self._value = 0 if value is None else value
+        self.handler = None
+        self.trigger = None
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, handler=None, trigger=None, **kwargs):
+        self.handler = handler
+        self.trigger = trigger
+        return self
+
+    def drive(self, value):
+        """Внешний сигнал на входе: новое значение и прерывание по фронту/спаду"""
+        old, self._value = self._value, 1 if value else 0
+        edge = self.IRQ_RISING if self._value > old else self.IRQ_FALLING if self._value < old else 0
+        if self.handler is not None and (self.trigger or 0) & edge:
+            self.handler(self)
+
+
+class UART:
+    def __init__(self, uart_id, *args, **kwargs):
+        self.id = uart_id
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self._readable = None
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def inject(self, data):
+        """Положить байты во входной FIFO (как будто их принял модуль)"""
+        self.rx.extend(data)
+        if self._readable is not None:
+            self._readable.set()
+
+    async def wait_readable(self):
+        """Для uasyncio.StreamReader: ждать данных без опроса"""
+        import asyncio
+        while not self.rx:
+            self._readable = asyncio.Event()
+            await self._readable.wait()
+        self._readable = None
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, nbytes=None):
+        if not self.rx:
+            return None
+        if nbytes is None:
+            nbytes = len(self.rx)
+        data = bytes(self.rx[:nbytes])
+        del self.rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        self.tx.extend(data)
+        return len(data)
+
+
+class SPI:
+    def __init__(self, spi_id, *args, **kwargs):
+        self.id = spi_id
+        self.bytes_written = 0
+        self.transactions = 0
+        # устройство на шине (SSD1680), получает каждую запись
+        self.device = None
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        self.transactions += 1
+        if self.device is not None:
+            self.device.write(data)
+
+
+def _make_machine():
+    module = types.ModuleType("machine")
+    module.Pin = Pin
+    module.UART = UART
+    module.SPI = SPI
+    module.reset = lambda: sys.exit("machine.reset()")
+    module.freq = lambda *args: 240000000
+    module.lightsleep = lambda ms=None: sleep_ms(ms or 0)
+    module.deepsleep = lambda ms=None: sys.exit("machine.deepsleep()")
+    module.wake_reason = lambda: 0
+    module.PIN_WAKE = module.EXT0_WAKE = 2
+    module.EXT1_WAKE = 3
+    module.TIMER_WAKE = 4
+    return module
+
+
+def _make_esp32():
+    module = types.ModuleType("esp32")
+    module.WAKEUP_ALL_LOW = False
+    module.WAKEUP_ANY_HIGH = True
+    module.wake_on_ext0 = lambda pin=None, level=False: None
+    module.wake_on_ext1 = lambda pins=None, level=False: None
+    return module
+
+
+class WLAN:
+    def __init__(self, interface=0):
+        self._active = False
+        self._connected = False
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = value
+
+    def connect(self, ssid, password):
+        self._connected = True
+
+    def isconnected(self):
+        return self._connected
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+
+def _make_network():
+    module = types.ModuleType("network")
+    module.STA_IF = 0
+    module.AP_IF = 1
+    module.WLAN = WLAN
+    return module
+
+
+# ---------------------------------------------------------------------------
+# uasyncio
+# ---------------------------------------------------------------------------
+
+class Stream:
+    """uasyncio.StreamReader поверх заглушки UART"""
+
+    def __init__(self, s):
+        self.s = s
+
+    async def readinto(self, buf):
+        await self.s.wait_readable()
+        return self.s.readinto(buf)
+
+    async def read(self, n=-1):
+        await self.s.wait_readable()
+        return self.s.read(None if n < 0 else n)
+
+
+class ThreadSafeFlag:
+    """uasyncio.ThreadSafeFlag: set() из прерывания, wait() сбрасывает флаг"""
+
+    def __init__(self):
+        import asyncio
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+def _make_uasyncio():
+    import asyncio
+
+    module = types.ModuleType("uasyncio")
+    for name in ("run", "sleep", "create_task", "gather", "wait_for", "Event", "Lock",
+                 "TimeoutError", "CancelledError", "get_event_loop", "new_event_loop"):
+        setattr(module, name, getattr(asyncio, name))
+    module.sleep_ms = lambda ms: asyncio.sleep(ms / 1000.0)
+    module.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000.0)
+    module.ThreadSafeFlag = ThreadSafeFlag
+    module.Stream = Stream
+    module.StreamReader = Stream
+    module.StreamWriter = Stream
+    return module
+
+
+# ---------------------------------------------------------------------------
+# lora_e32 (библиотека E32 для MicroPython)
+# ---------------------------------------------------------------------------
+
+class ResponseStatusCode:
+    SUCCESS = 1
+    ERR_E32_UNKNOWN = 2
+
+    @staticmethod
+    def get_description(code):
+        return "Success" if code == ResponseStatusCode.SUCCESS else "Error"
+
+
+class FixedTransmission:
+    TRANSPARENT_TRANSMISSION = 0
+    FIXED_TRANSMISSION = 1
+
+
+class _Option:
+    fixedTransmission = FixedTransmission.TRANSPARENT_TRANSMISSION
+
+
+class Configuration:
+    def __init__(self, model):
+        self.model = model
+        self.ADDH = 0
+        self.ADDL = 0
+        self.CHAN = 23
+        self.OPTION = _Option()
+
+
+class LoRaE32:
+    """Модуль E32: отправленные сообщения копятся в sent, прием через uart.inject()"""
+
+    def __init__(self, model, uart, aux_pin=None, m0_pin=None, m1_pin=None):
+        self.model = model
+        self.uart = uart
+        self.sent = []
+
+    def begin(self):
+        return ResponseStatusCode.SUCCESS
+
+    def set_configuration(self, configuration):
+        return ResponseStatusCode.SUCCESS, configuration
+
+    def send_broadcast_message(self, channel, message):
+        self.sent.append((0xFF, 0xFF, channel, message))
+        return ResponseStatusCode.SUCCESS
+
+    def send_fixed_message(self, addh, addl, channel, message):
+        self.sent.append((addh, addl, channel, message))
+        return ResponseStatusCode.SUCCESS
+
+    def send_transparent_message(self, message):
+        self.sent.append((None, None, None, message))
+        return ResponseStatusCode.SUCCESS
+
+
+def _make_lora_modules():
+    lora_e32 = types.ModuleType("lora_e32")
+    lora_e32.LoRaE32 = LoRaE32
+    lora_e32.Configuration = Configuration
+    lora_e32.BROADCAST_ADDRESS = 0xFF
+
+    constants = types.ModuleType("lora_e32_constants")
+    constants.FixedTransmission = FixedTransmission
+
+    operation = types.ModuleType("lora_e32_operation_constant")
+    operation.ResponseStatusCode = ResponseStatusCode
+    return lora_e32, constants, operation
+
+
+# ---------------------------------------------------------------------------
+# framebuf
+# ---------------------------------------------------------------------------
+
+# Шрифт 5x7 в ячейке 8x8 для FrameBuffer.text(). Встроенный шрифт
+# MicroPython (petme128) другой: надписи совпадают по месту и размеру,
+# но не попиксельно.
+_FONT_ROWS = r"""
+SP ..... ..... ..... ..... ..... ..... .....
+!  ..#.. ..#.. ..#.. ..#.. ..#.. ..... ..#..
+"  .#.#. .#.#. ..... ..... ..... ..... .....
+#  .#.#. .#.#. ##### .#.#. ##### .#.#. .#.#.
+$  ..#.. .#### #.#.. .###. ..#.# ####. ..#..
+%  ##... ##..# ...#. ..#.. .#... #..## ...##
+&  .##.. #..#. #.#.. .#... #.#.# #..#. .##.#
+'  ..#.. ..#.. .#... ..... ..... ..... .....
+(  ...#. ..#.. .#... .#... .#... ..#.. ...#.
+)  .#... ..#.. ...#. ...#. ...#. ..#.. .#...
+*  ..... ..#.. #.#.# .###. #.#.# ..#.. .....
++  ..... ..#.. ..#.. ##### ..#.. ..#.. .....
+,  ..... ..... ..... ..... .##.. ..#.. .#...
+-  ..... ..... ..... ##### ..... ..... .....
+.  ..... ..... ..... ..... ..... .##.. .##..
+/  ..... ....# ...#. ..#.. .#... #.... .....
+0  .###. #...# #..## #.#.# ##..# #...# .###.
+1  ..#.. .##.. ..#.. ..#.. ..#.. ..#.. .###.
+2  .###. #...# ....# ...#. ..#.. .#... #####
+3  ##### ...#. ..#.. ...#. ....# #...# .###.
+4  ...#. ..##. .#.#. #..#. ##### ...#. ...#.
+5  ##### #.... ####. ....# ....# #...# .###.
+6  ..##. .#... #.... ####. #...# #...# .###.
+7  ##### ....# ...#. ..#.. .#... .#... .#...
+8  .###. #...# #...# .###. #...# #...# .###.
+9  .###. #...# #...# .#### ....# ...#. .##..
+:  ..... .##.. .##.. ..... .##.. .##.. .....
+;  ..... .##.. .##.. ..... .##.. ..#.. .#...
+<  ...#. ..#.. .#... #.... .#... ..#.. ...#.
+=  ..... ..... ##### ..... ##### ..... .....
+>  .#... ..#.. ...#. ....# ...#. ..#.. .#...
+?  .###. #...# ....# ...#. ..#.. ..... ..#..
+@  .###. #...# ....# .##.# #.#.# #.#.# .###.
+A  .###. #...# #...# ##### #...# #...# #...#
+B  ####. #...# #...# ####. #...# #...# ####.
+C  .###. #...# #.... #.... #.... #...# .###.
+D  ###.. #..#. #...# #...# #...# #..#. ###..
+E  ##### #.... #.... ####. #.... #.... #####
+F  ##### #.... #.... ####. #.... #.... #....
+G  .###. #...# #.... #.### #...# #...# .####
+H  #...# #...# #...# ##### #...# #...# #...#
+I  .###. ..#.. ..#.. ..#.. ..#.. ..#.. .###.
+J  ..### ...#. ...#. ...#. ...#. #..#. .##..
+K  #...# #..#. #.#.. ##... #.#.. #..#. #...#
+L  #.... #.... #.... #.... #.... #.... #####
+M  #...# ##.## #.#.# #.#.# #...# #...# #...#
+N  #...# #...# ##..# #.#.# #..## #...# #...#
+O  .###. #...# #...# #...# #...# #...# .###.
+P  ####. #...# #...# ####. #.... #.... #....
+Q  .###. #...# #...# #...# #.#.# #..#. .##.#
+R  ####. #...# #...# ####. #.#.. #..#. #...#
+S  .#### #.... #.... .###. ....# ....# ####.
+T  ##### ..#.. ..#.. ..#.. ..#.. ..#.. ..#..
+U  #...# #...# #...# #...# #...# #...# .###.
+V  #...# #...# #...# #...# #...# .#.#. ..#..
+W  #...# #...# #...# #.#.# #.#.# #.#.# .#.#.
+X  #...# #...# .#.#. ..#.. .#.#. #...# #...#
+Y  #...# #...# #...# .#.#. ..#.. ..#.. ..#..
+Z  ##### ....# ...#. ..#.. .#... #.... #####
+[  .###. .#... .#... .#... .#... .#... .###.
+\  ..... #.... .#... ..#.. ...#. ....# .....
+]  .###. ...#. ...#. ...#. ...#. ...#. .###.
+^  ..#.. .#.#. #...# ..... ..... ..... .....
+_  ..... ..... ..... ..... ..... ..... #####
+`  .#... ..#.. ...#. ..... ..... ..... .....
+a  ..... ..... .###. ....# .#### #...# .####
+b  #.... #.... #.##. ##..# #...# #...# ####.
+c  ..... ..... .###. #.... #.... #...# .###.
+d  ....# ....# .##.# #..## #...# #...# .####
+e  ..... ..... .###. #...# ##### #.... .###.
+f  ..##. .#..# .#... ###.. .#... .#... .#...
+g  ..... .#### #...# #...# .#### ....# .###.
+h  #.... #.... #.##. ##..# #...# #...# #...#
+i  ..#.. ..... .##.. ..#.. ..#.. ..#.. .###.
+j  ...#. ..... ..##. ...#. ...#. #..#. .##..
+k  #.... #.... #..#. #.#.. ##... #.#.. #..#.
+l  .##.. ..#.. ..#.. ..#.. ..#.. ..#.. .###.
+m  ..... ..... ##.#. #.#.# #.#.# #...# #...#
+n  ..... ..... #.##. ##..# #...# #...# #...#
+o  ..... ..... .###. #...# #...# #...# .###.
+p  ..... ..... ####. #...# ####. #.... #....
+q  ..... ..... .##.# #..## .#### ....# ....#
+r  ..... ..... #.##. ##..# #.... #.... #....
+s  ..... ..... .###. #.... .###. ....# ####.
+t  .#... .#... ###.. .#... .#... .#..# ..##.
+u  ..... ..... #...# #...# #...# #..## .##.#
+v  ..... ..... #...# #...# #...# .#.#. ..#..
+w  ..... ..... #...# #...# #.#.# #.#.# .#.#.
+x  ..... ..... #...# .#.#. ..#.. .#.#. #...#
+y  ..... ..... #...# #...# .#### ....# .###.
+z  ..... ..... ##### ...#. ..#.. .#... #####
+{  ...#. ..#.. ..#.. .#... ..#.. ..#.. ...#.
+|  ..#.. ..#.. ..#.. ..#.. ..#.. ..#.. ..#..
+}  .#... ..#.. ..#.. ...#. ..#.. ..#.. .#...
+~  ..... ..... .#... #.#.# ...#. ..... .....
+"""
+
+
+def _load_font():
+    font = {}
+    for line in _FONT_ROWS.strip("\n").split("\n"):
+        char, *rows = line.split()
+        char = " " if char == "SP" else char
+        glyph = []
+        for row in rows:
+            glyph.append([x + 1 for x, cell in enumerate(row) if cell == "#"])
+        font[char] = glyph
+    return font
+
+
+_FONT = _load_font()
+_FONT_MISSING = [[1, 2, 3, 4, 5]] + [[1, 5]] * 5 + [[1, 2, 3, 4, 5]]
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+class FrameBuffer:
+    """Монохромные форматы framebuf.FrameBuffer MicroPython на чистом Python"""
+
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format not in (MONO_VLSB, MONO_HLSB, MONO_HMSB):
+            raise ValueError("unsupported format")
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.format = format
+        if stride is None:
+            stride = width
+        if format != MONO_VLSB:
+            stride = (stride + 7) & ~7
+        self.stride = stride
+
+    def _locate(self, x, y):
+        if self.format == MONO_VLSB:
+            return (y >> 3) * self.stride + x, 1 << (y & 7)
+        index = (y * self.stride + x) >> 3
+        if self.format == MONO_HLSB:
+            return index, 0x80 >> (x & 7)
+        return index, 1 << (x & 7)
+
+    def _set(self, x, y, c):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            index, mask = self._locate(x, y)
+            if c & 1:
+                self.buffer[index] |= mask
+            else:
+                self.buffer[index] &= ~mask & 0xFF
+
+    def _get(self, x, y):
+        index, mask = self._locate(x, y)
+        return 1 if self.buffer[index] & mask else 0
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        if c is None:
+            return self._get(x, y)
+        self._set(x, y, c)
+
+    def fill(self, c):
+        value = 0xFF if c & 1 else 0x00
+        self.buffer[:] = bytes([value]) * len(self.buffer)
+
+    def fill_rect(self, x, y, w, h, c):
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(self.width, x + w), min(self.height, y + h)
+        for yy in range(y0, y1):
+            for xx in range(x0, x1):
+                self._set(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        dx, dy = abs(x2 - x1), -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self._set(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def text(self, s, x, y, c=1):
+        for char in s:
+            glyph = _FONT.get(char, _FONT_MISSING)
+            for row, columns in enumerate(glyph):
+                for column in columns:
+                    self._set(x + column, y + row, c)
+            x += 8
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        for yy in range(fbuf.height):
+            for xx in range(fbuf.width):
+                c = fbuf._get(xx, yy)
+                if palette is not None:
+                    c = palette._get(c, 0)
+                if c != key:
+                    self._set(x + xx, y + yy, c)
+
+    def scroll(self, xstep, ystep):
+        copy = FrameBuffer(bytearray(self.buffer), self.width, self.height,
+                           self.format, self.stride)
+        for yy in range(self.height):
+            for xx in range(self.width):
+                sx, sy = xx - xstep, yy - ystep
+                if 0 <= sx < self.width and 0 <= sy < self.height:
+                    self._set(xx, yy, copy._get(sx, sy))
+
+
+def _make_framebuf():
+    module = types.ModuleType("framebuf")
+    module.FrameBuffer = FrameBuffer
+    module.MONO_VLSB = MONO_VLSB
+    module.MONO_HLSB = MONO_HLSB
+    module.MONO_HMSB = MONO_HMSB
+    return module
+
+
+# ---------------------------------------------------------------------------
+# e-paper: контроллер SSD1680 (Waveshare 2.13" B V4) на шине SPI
+# ---------------------------------------------------------------------------
+
+class SSD1680:
+    """
+    Модель контроллера панели: разбирает поток SPI по уровню DC (0 - команда,
+    1 - данные), ведет RAM обеих плоскостей с окном, счетчиком адреса и
+    режимом ввода (0x11), по 0x20 запоминает показанный кадр.
+
+        panel = host_shim.SSD1680(epd)
+        epd.init()          # режим ввода и окно задаются в init()
+        epd.display()
+        panel.save_png("tag.png")
+
+    RAM: 16 байт по X (128 точек) на 296 строк Y, бит 7 - меньший X,
+    бит 0 - черный / красный.
+    """
+
+    X_BYTES = 16
+    Y_LINES = 296
+    # команда -> число байт параметров, применяются после последнего
+    PARAMS = {0x01: 3, 0x10: 1, 0x11: 1, 0x18: 1, 0x21: 2, 0x3C: 1,
+              0x44: 2, 0x45: 4, 0x4E: 1, 0x4F: 2}
+
+    def __init__(self, epd):
+        self.dc_pin = epd.dc_pin
+        size = self.X_BYTES * self.Y_LINES
+        self.ram = {0x24: bytearray(b"\xff" * size), 0x26: bytearray(b"\xff" * size)}
+        self.shown = None
+        self.refreshes = 0
+        self.asleep = False
+        self.stream = None
+        self._reset_registers()
+        self.command = None
+        self.params = bytearray()
+        epd.spi.device = self
+
+    def _reset_registers(self):
+        self.entry = 0x03
+        self.x_start, self.x_end = 0, self.X_BYTES - 1
+        self.y_start, self.y_end = 0, self.Y_LINES - 1
+        self.x = self.y = 0
+
+    def capture(self, func):
+        """Поток SPI за время func() как [(dc, bytes)], соседние записи с одним DC склеены"""
+        self.stream = []
+        try:
+            func()
+            return self.stream
+        finally:
+            self.stream = None
+
+    def write(self, data):
+        dc = self.dc_pin.value()
+        if self.stream is not None:
+            if self.stream and self.stream[-1][0] == dc:
+                self.stream[-1] = (dc, self.stream[-1][1] + bytes(data))
+            else:
+                self.stream.append((dc, bytes(data)))
+        for byte in bytes(data):
+            if dc:
+                self._data(byte)
+            else:
+                self._command(byte)
+
+    def _command(self, command):
+        self.command = command
+        self.params = bytearray()
+        if command == 0x12:             # SWRESET: регистры по умолчанию, RAM не трогается
+            self._reset_registers()
+            self.asleep = False
+        elif command == 0x20:           # обновление экрана из RAM
+            self.shown = {plane: bytes(ram) for plane, ram in self.ram.items()}
+            self.refreshes += 1
+
+    def _data(self, byte):
+        command = self.command
+        if command in (0x24, 0x26):
+            self.ram[command][self.x * self.Y_LINES + self.y] = byte
+            self._advance()
+            return
+        self.params.append(byte)
+        if len(self.params) != self.PARAMS.get(command):
+            return
+        p = self.params
+        if command == 0x11:
+            self.entry = p[0] & 0x07
+        elif command == 0x44:
+            self.x_start, self.x_end = p[0] & 0x1F, p[1] & 0x1F
+        elif command == 0x45:
+            self.y_start, self.y_end = p[0] | (p[1] & 1) << 8, p[2] | (p[3] & 1) << 8
+        elif command == 0x4E:
+            self.x = p[0] & 0x1F
+        elif command == 0x4F:
+            self.y = p[0] | (p[1] & 1) << 8
+        elif command == 0x10:
+            self.asleep = p[0] != 0
+
+    def _advance(self):
+        # бит 0 - X растет, бит 1 - Y растет, бит 2 - сначала меняется Y
+        dx = 1 if self.entry & 1 else -1
+        dy = 1 if self.entry & 2 else -1
+        if self.entry & 4:
+            self.y, wrapped = self._step(self.y, dy, self.y_start, self.y_end)
+            if wrapped:
+                self.x, _ = self._step(self.x, dx, self.x_start, self.x_end)
+        else:
+            self.x, wrapped = self._step(self.x, dx, self.x_start, self.x_end)
+            if wrapped:
+                self.y, _ = self._step(self.y, dy, self.y_start, self.y_end)
+
+    @staticmethod
+    def _step(value, delta, start, end):
+        value += delta
+        if delta > 0 and value > end:
+            return start, True
+        if delta < 0 and value < start:
+            return end, True
+        return value, False
+
+    def landscape_planes(self, width=250, pages=16, shown=True):
+        """
+        Плоскости в раскладке буфера кадра EPD_2in13_B_V4_Landscape
+        (MONO_VLSB, страница j - байт X = pages - 1 - j, x буфера = Y RAM),
+        для сравнения с epd.buffer_balck / epd.buffer_red
+        """
+        source = self.shown if shown else self.ram
+        if source is None:
+            return None
+        planes = []
+        for command in (0x24, 0x26):
+            ram = source[command]
+            plane = bytearray()
+            for j in range(pages):
+                a = (pages - 1 - j) * self.Y_LINES
+                plane += ram[a:a + width]
+            planes.append(bytes(plane))
+        return tuple(planes)
+
+    def save_png(self, filename, width=250, height=122, shown=True):
+        """Кадр как на экране (белый / черный / красный, красный поверх черного)"""
+        black, red = self.landscape_planes(width, (height + 7) // 8, shown)
+        rows = []
+        for y in range(height):
+            a, bit = (y >> 3) * width, 1 << (y & 7)
+            rows.append(bytes(2 if not red[a + x] & bit else 1 if not black[a + x] & bit else 0
+                              for x in range(width)))
+        write_png(filename, width, rows, (b"\xff\xff\xff", b"\x00\x00\x00", b"\xd0\x10\x10"))
+
+
+def write_png(filename, width, rows, palette):
+    """PNG с палитрой (8 бит на точку) без сторонних библиотек"""
+    import struct
+    import zlib
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    raw = b"".join(b"\x00" + row for row in rows)
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, len(rows), 8, 3, 0, 0, 0)))
+        f.write(chunk(b"PLTE", b"".join(palette)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 9)))
+        f.write(chunk(b"IEND", b""))
+
+
+def install():
+    """Зарегистрировать заглушки в sys.modules (реальные модули не трогаются)"""
+    lora_e32, constants, operation = _make_lora_modules()
+    modules = {
+        "utime": _make_utime(),
+        "urandom": _make_urandom(),
+        "ujson": json,
+        "machine": _make_machine(),
+        "esp32": _make_esp32(),
+        "framebuf": _make_framebuf(),
+        "uasyncio": _make_uasyncio(),
+        "network": _make_network(),
+        "lora_e32": lora_e32,
+        "lora_e32_constants": constants,
+        "lora_e32_operation_constant": operation,
+    }
+    for name, module in modules.items():
+        sys.modules.setdefault(name, module)
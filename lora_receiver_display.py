@@ -1,50 +1,209 @@
 from pico_display import EPD_2in13_B_V4_Landscape
+import tag_layout
+import tag_bitmap
+import tag_codec
 from lora_e32 import LoRaE32, Configuration, BROADCAST_ADDRESS
-from machine import UART
+from machine import UART, Pin
+import machine
+from collections import OrderedDict
+import uasyncio as asyncio
 import utime
 import ujson
+import os
+import binascii
 
 from lora_e32_constants import FixedTransmission
 from lora_e32_operation_constant import ResponseStatusCode
 
+# идентификатор ценника (device_id, который шлюз кладет в поле "id")
+TAG_ID = "11"
+
+# куда отправлять ACK: адрес и канал шлюза
+LORA_CHANNEL = 23
+GATEWAY_ADDH = 0x00
+GATEWAY_ADDL = 0x02
+
+# размер кольцевого буфера приема: кадр длиннее отбрасывается
+MESSAGE_BUFFER_SIZE = 1024
+# недособранный кадр сбрасывается, если за это время не пришло ни байта
+PARTIAL_FRAME_TIMEOUT_MS = 1000
+
+# журнал товаров на флеше: строка на каждое изменение, сжатие при разрастании
+PRODUCTS_LOG = "products.log"
+PRODUCTS_COMPACT_SLACK = 16     # сжатие, когда записей > 2 * товаров + это
+# файл до перехода на журнал, переносится в журнал при первой загрузке
+LEGACY_PRODUCTS_FILE = "product_list.txt"
+
+# энергосбережение: панель в deep sleep после каждого обновления,
+# MCU в lightsleep, пока модуль E32 не опустит AUX (прием кадра)
+POWER_SAVE = True
+# AUX модуля E32 для пробуждения: нужен RTC GPIO (0, 2, 4, 12-15, 25-27, 32-39).
+# В текущей схеме AUX на GPIO5 вместе с CS дисплея, будить им нельзя -
+# MCU не засыпает, пока AUX не заведен, например, на 33
+AUX_WAKE_PIN = None
+POWER_IDLE_MS = 200             # простой перед сном (хвост кадра, ACK)
+POWER_SLEEP_MAX_MS = 60000      # дольше не спим, даже если AUX молчит
+
+# lead_ms - от пробуждения по AUX до первого байта в UART (0 - байты успели прийти во сне)
+power_stats = {
+    "sleeps": 0,
+    "slept_ms": 0,
+    "aux_wakeups": 0,
+    "lead_ms": None,
+    "panel_sleeps": 0,
+}
+
+# обновления экрана: digest - crc32 обоих буферов кадра, который сейчас на экране,
+# coalesced - кадры, замененные более новым, пока панель была занята,
+# busy_ms - длительность последнего обновления (BUSY)
+display_stats = {
+    "refreshes": 0,
+    "skipped": 0,
+    "digest": None,
+    "coalesced": 0,
+    "busy_ms": None,
+}
+
+# фоновое обновление экрана (DisplayUpdater), None - обновлять сразу, как при загрузке
+display_updater = None
+
+# макет ценника (заменяется кадром {"layout": ...} от шлюза)
+active_layout = tag_layout.Layout(tag_layout.DEFAULT_LAYOUT)
+
+# изображение от сервера (кадры {"bmp": ...}): части собираются по crc32
+# целевого кадра img, status - None (собирается) / "done" / "failed"
+BITMAP_MAX_PARTS = 8
+bitmap_rx = {
+    "img": None,
+    "parts": None,
+    "status": None,
+}
+
+# пробуждения по данным UART и задержка от пробуждения до разобранного кадра
+rx_stats = {
+    "wakeups": 0,
+    "frames": 0,
+    "last_us": 0,
+    "max_us": 0,
+    "total_us": 0,
+}
+
 class MessageBuffer:
-    def __init__(self):
-        # для сборки фрагм сообщ
-        self.buffer = ""
+    """
+    Сборка кадров {...} из фрагментов UART в кольцевом буфере фиксированного размера.
+    Каждый байт просматривается один раз, состояние разбора (глубина скобок,
+    строка, экранирование) сохраняется между фрагментами, поэтому скобки
+    внутри названий товаров не ломают подсчет.
+    """
+    def __init__(self, size=MESSAGE_BUFFER_SIZE):
+        self.ring = bytearray(size)
+        self.view = memoryview(self.ring)
+        self.size = size
+        self.head = 0               # куда пишется следующий байт
+        self.frames = []            # собранные кадры (str)
+        self.dropped = 0            # кадры длиннее буфера или не UTF-8
         self.last_receive_time = utime.ticks_ms()
+        self.clear()
     
-    def add_fragment(self, fragment):
-        self.buffer += fragment
-        self.last_receive_time = utime.ticks_ms()
+    def clear(self):
+        # сбрасываем недособранный кадр, собранные кадры остаются
+        self.count = 0              # байт текущего кадра, он лежит в [head - count, head)
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.discarding = False     # кадр не поместился: дочитываем его до конца без сохранения
     
-    def try_extract_json(self):
-        start = self.buffer.find('{')
-        if start == -1:
-            return None
-        
-        balance = 0
-        end = -1
-        
-        for i in range(start, len(self.buffer)):
-            if self.buffer[i] == '{':
-                balance += 1
-            elif self.buffer[i] == '}':
-                balance -= 1
-                if balance == 0:
-                    end = i
-                    break
+    def has_partial(self):
+        return self.depth > 0
+    
+    def writable(self):
+        """Свободный непрерывный участок после head (для readinto напрямую из UART)"""
+        if self.count >= self.size:
+            print(f"Frame longer than {self.size} bytes dropped")
+            self.dropped += 1
+            self.count = 0
+            self.discarding = True
+        return self.view[self.head:min(self.size, self.head + self.size - self.count)]
+    
+    def commit(self, n):
+        """Разобрать n байт, записанных с позиции head"""
+        self.last_receive_time = utime.ticks_ms()
+        ring = self.ring
+        pos = self.head
+        end = pos + n
         
-        if end != -1:
-            # json нашелся
-            json_str = self.buffer[start:end+1]
-            # убираю обработанную часть из буфера
-            self.buffer = self.buffer[end+1:]
-            return json_str
+        while pos < end:
+            c = ring[pos]
+            pos += 1
+            
+            if self.depth == 0:
+                # вне кадра: все до '{' (префикс адреса LoRa, мусор) пропускаем
+                if c == 0x7B:  # {
+                    self.depth = 1
+                    self.count = 1
+                continue
+            
+            if not self.discarding:
+                self.count += 1
+            
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == 0x5C:  # \\
+                    self.escape = True
+                elif c == 0x22:  # "
+                    self.in_string = False
+            elif c == 0x22:
+                self.in_string = True
+            elif c == 0x7B:
+                self.depth += 1
+            elif c == 0x7D:  # }
+                self.depth -= 1
+                if self.depth == 0:
+                    if not self.discarding:
+                        self._emit(pos)
+                    self.clear()
         
-        return None
+        self.head = end % self.size
     
-    def clear(self):
-        self.buffer = ""
+    def _emit(self, end):
+        start = end - self.count
+        if start >= 0:
+            data = bytes(self.view[start:end])
+        else:
+            # кадр переходит через конец кольца
+            data = bytes(self.view[start + self.size:]) + bytes(self.view[:end])
+        try:
+            self.frames.append(data.decode('utf-8'))
+        except UnicodeError:
+            self.dropped += 1
+    
+    def read_from(self, uart):
+        """Забрать все, что накопилось в FIFO UART, прямо в кольцо (readinto)"""
+        total = 0
+        while uart.any() > 0:
+            received = uart.readinto(self.writable())
+            if not received:
+                break
+            self.commit(received)
+            total += received
+        return total
+    
+    def add_fragment(self, fragment):
+        if isinstance(fragment, str):
+            fragment = fragment.encode('utf-8')
+        pos = 0
+        while pos < len(fragment):
+            free = self.writable()
+            n = min(len(free), len(fragment) - pos)
+            free[:n] = fragment[pos:pos + n]
+            pos += n
+            self.commit(n)
+    
+    def try_extract_json(self):
+        if self.frames:
+            return self.frames.pop(0)
+        return None
     
     def is_timed_out(self, timeout_ms=1000):
         return utime.ticks_diff(utime.ticks_ms(), self.last_receive_time) > timeout_ms
@@ -54,40 +213,104 @@ def init_display():
     epd.Clear(0xff, 0xff)
     epd.imageblack.fill(0xff)
     epd.imagered.fill(0xff)
+    display_stats["digest"] = framebuffer_digest(epd)
     return epd
 
+def sleep_display(epd):
+    # изображение на e-paper остается, панель будится перед следующим обновлением
+    if POWER_SAVE and not epd.asleep:
+        # из DisplayUpdater BUSY уже опущен, 2 с паузы драйвера не нужны
+        epd.sleep(wait=display_updater is None)
+        power_stats["panel_sleeps"] += 1
+
+def framebuffer_digest(epd):
+    return binascii.crc32(epd.buffer_red, binascii.crc32(epd.buffer_balck))
+
+def refresh_display(epd, wait=True):
+    """
+    Обновление панели (секунды BUSY и мигание) только если нарисованное
+    отличается от того, что уже на экране, хотя бы одним пикселем.
+    wait=False - только запуск обновления, конец ждет DisplayUpdater
+    """
+    digest = framebuffer_digest(epd)
+    if digest == display_stats["digest"]:
+        display_stats["skipped"] += 1
+        print(f"Display unchanged, refresh skipped ({display_stats['skipped']} skipped)")
+        return False
+    # в RAM панели пишутся только изменившиеся окна (весь кадр, если RAM неизвестна)
+    epd.display_partial(wait)
+    display_stats["digest"] = digest
+    display_stats["refreshes"] += 1
+    print(f"Display updated: {epd.last_update_stats}")
+    return True
+
+def update_display(epd):
+    # в цикле приема - в фоне, до его запуска (загрузка) - сразу
+    if display_updater is None:
+        refresh_display(epd)
+    else:
+        display_updater.request()
+
+class DisplayUpdater:
+    """
+    Обновление экрана в отдельной задаче, прием кадров не ждет панель.
+
+    Два набора буферов: задний - буферы кадра драйвера, в них кадр рисуется
+    сразу при приеме; передний - теневые буферы shown_* (то, что в RAM панели).
+    После передачи по SPI задний набор свободен, и пока панель обновляется
+    (BUSY, секунды), новые кадры перерисовывают его поверх. Когда BUSY
+    опускается (прерывание по спаду), на экран уходит только последнее
+    состояние, промежуточные не показываются вовсе.
+    """
+    def __init__(self, epd):
+        self.epd = epd
+        self.pending = False
+        self.refreshing = False
+        self.changed = asyncio.Event()
+        self.idle = asyncio.ThreadSafeFlag()
+        epd.busy_pin.irq(trigger=Pin.IRQ_FALLING, handler=self._busy_released)
+
+    def _busy_released(self, pin):
+        self.idle.set()
+
+    def busy(self):
+        return self.pending or self.refreshing
+
+    def request(self):
+        # задний набор уже перерисован, ждущий показа кадр заменен новым
+        if self.pending:
+            display_stats["coalesced"] += 1
+        self.pending = True
+        self.changed.set()
+
+    async def wait_idle(self):
+        start = utime.ticks_ms()
+        # флаг мог остаться от прошлого спада, поэтому проверяем сам BUSY
+        while self.epd.is_busy():
+            await self.idle.wait()
+        await asyncio.sleep_ms(20)
+        display_stats["busy_ms"] = utime.ticks_diff(utime.ticks_ms(), start)
+
+    async def run(self):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            self.refreshing = True
+            while self.pending:
+                self.pending = False
+                if refresh_display(self.epd, wait=False):
+                    await self.wait_idle()
+            # в deep sleep только после конца обновления и если новых кадров нет
+            sleep_display(self.epd)
+            self.refreshing = False
+
 def draw_price_tag_with_data(epd, product_name, weight, price_per_kg):
-    epd.imageblack.fill(0xff)
-    epd.imagered.fill(0xff)
-    
-    epd.imageblack.rect(5, 10, 240, 112, 0x00)
-    epd.imageblack.text("Name:", 15, 15, 0x00)
-    
-    display_name = product_name[:20] if len(product_name) > 20 else product_name
-    epd.imageblack.text(display_name, 60, 15, 0x00)
-    
-    epd.imageblack.hline(10, 40, 230, 0x00)
-    
-    epd.imageblack.text("Weight:", 15, 55, 0x00)
-    weight_text = f"{weight} kg"
-    epd.imageblack.text(weight_text, 75, 55, 0x00)
-    
-    epd.imageblack.text("Price/kg:", 15, 75, 0x00)
-    price_text = f"{price_per_kg} rub"
-    epd.imageblack.text(price_text, 90, 75, 0x00)
-    
-    epd.imageblack.text("Total:", 15, 95, 0x00)
-    
-    try:
-        total_price = float(weight) * float(price_per_kg)
-    except:
-        total_price = 0
-    
-    total_text = f"{total_price:.2f} rub"
-    epd.imageblack.rect(65, 90, 120, 20, 0x00)
-    epd.imageblack.text(total_text, 70, 95, 0x00)
-    
-    epd.display()
+    render_price_tag(epd, product_name, weight, price_per_kg)
+    update_display(epd)
+
+def render_price_tag(epd, product_name, weight, price_per_kg):
+    # статический слой макета копируется из кэша, рисуются только данные товара
+    active_layout.render(epd, product_name, weight, price_per_kg)
 
 def draw_waiting_message(epd):
     epd.imageblack.fill(0xff)
@@ -95,9 +318,10 @@ def draw_waiting_message(epd):
     epd.imageblack.rect(5, 10, 240, 112, 0x00)
     epd.imageblack.text("Waiting for", 70, 40, 0x00)
     epd.imageblack.text("messages...", 70, 60, 0x00)
-    epd.display()
+    update_display(epd)
 
 def parse_product_message(message):
+    # только для старого product_list.txt: по радио кадры разбирает tag_codec.decode
     # 1 пробую парсить как JSON с моими 3 полями
     try:
         data = ujson.loads(message)
@@ -130,42 +354,155 @@ def parse_product_message(message):
     
     return None
 
-def read_products_from_file(filename="product_list.txt"):
-    products = []
-    try:
-        with open(filename, "r") as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    product = parse_product_message(line)
+class ProductStore:
+    """
+    Товары в RAM (индекс по названию) + журнал на флеше.
+    Изменение дописывает одну строку name<TAB>weight<TAB>price, удаление - "-name".
+    Когда записей становится вдвое больше товаров, журнал переписывается
+    во временный файл и подменяется через rename: после сбоя питания остается
+    либо старый, либо новый журнал, а оборванная последняя строка пропускается.
+    """
+    def __init__(self, filename=PRODUCTS_LOG):
+        self.filename = filename
+        self.index = OrderedDict()  # name -> {'name', 'weight', 'price'}
+        self.last = None            # название последнего принятого товара
+        self.records = 0            # строк в журнале
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def values(self):
+        return self.index.values()
+    
+    def get(self, name):
+        return self.index.get(name)
+    
+    def last_product(self):
+        return self.index.get(self.last) if self.last is not None else None
+    
+    def load(self):
+        start = utime.ticks_ms()
+        try:
+            os.remove(self.filename + ".tmp")
+        except OSError:
+            pass
+        
+        self.index = OrderedDict()
+        self.last = None
+        self.records = 0
+        bad = 0
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    self.records += 1
+                    if not self._replay(line):
+                        bad += 1
+        except OSError:
+            self._migrate()
+        if bad:
+            # следующая запись не должна приклеиться к оборванной строке
+            self.compact()
+        
+        print(f"Loaded {len(self.index)} products from {self.records} records "
+              f"in {utime.ticks_diff(utime.ticks_ms(), start)} ms")
+    
+    def _replay(self, line):
+        if line.startswith("-"):
+            name = line[1:].rstrip("\n")
+            self.index.pop(name, None)
+            if self.last == name:
+                self.last = None
+            return True
+        parts = line.rstrip("\n").split("\t")
+        if len(parts) != 3 or not line.endswith("\n"):
+            # оборванная запись (питание пропало во время записи)
+            print(f"Skipped bad log line: {line}")
+            return False
+        self.index[parts[0]] = {'name': parts[0], 'weight': parts[1], 'price': parts[2]}
+        self.last = parts[0]
+        return True
+    
+    def _migrate(self):
+        # старый product_list.txt разбирается всеми тремя форматами один раз
+        try:
+            with open(LEGACY_PRODUCTS_FILE, "r") as f:
+                for line in f:
+                    product = parse_product_message(line.strip())
                     if product:
-                        products.append(product)
-    except:
-        pass                    # или нет или он пуст
-    return products
-
-def save_products_to_file(products, filename="product_list.txt"):
-    try:
-        with open(filename, "w") as f:
-            for product in products:
-                f.write(f"{product['name']},{product['weight']},{product['price']}\n")
+                        self.index[product['name']] = product
+                        self.last = product['name']
+        except OSError:
+            return
+        if self.compact():
+            os.remove(LEGACY_PRODUCTS_FILE)
+            print(f"Migrated {len(self.index)} products from {LEGACY_PRODUCTS_FILE}")
+    
+    @staticmethod
+    def _line(product):
+        # табуляция и перевод строки - разделители, из значений их убираем
+        fields = [str(product[key]).replace("\t", " ").replace("\n", " ")
+                  for key in ('name', 'weight', 'price')]
+        return "\t".join(fields) + "\n"
+    
+    def put(self, product):
+        """Добавить или обновить товар: "added", "updated" или "unchanged" (без записи)"""
+        product = {key: str(product[key]) for key in ('name', 'weight', 'price')}
+        name = product['name']
+        old = self.index.get(name)
+        if old == product and self.last == name:
+            # повтор того же товара: флеш не трогаем
+            return "unchanged"
+        self.index[name] = product
+        self.last = name
+        self._append(self._line(product))
+        if old is None:
+            return "added"
+        return "updated" if old != product else "unchanged"
+    
+    def remove(self, name):
+        if self.index.pop(name, None) is None:
+            return False
+        if self.last == name:
+            self.last = None
+        self._append("-" + name + "\n")
         return True
-    except Exception as e:
-        print(f"Error saving to file: {e}")
-        return False
-
-def update_or_add_product(products, new_product):
-    for i, product in enumerate(products):
-        if product['name'] == new_product['name']:
-            products[i] = new_product
-            return products, "updated"
     
-    products.append(new_product)
-    return products, "added"
+    def clear(self):
+        self.index = OrderedDict()
+        self.last = None
+        self.compact()
+    
+    def compact(self):
+        """Переписать журнал по одной строке на товар; последний принятый - в конце"""
+        tmp = self.filename + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                for name, product in self.index.items():
+                    if name != self.last:
+                        f.write(self._line(product))
+                if self.last is not None:
+                    f.write(self._line(self.index[self.last]))
+            os.rename(tmp, self.filename)
+            self.records = len(self.index)
+            return True
+        except OSError as e:
+            print(f"Error compacting {self.filename}: {e}")
+            return False
+    
+    def _append(self, line):
+        try:
+            with open(self.filename, "a") as f:
+                f.write(line)
+            self.records += 1
+        except OSError as e:
+            print(f"Error writing {self.filename}: {e}")
+            return
+        if self.records > 2 * len(self.index) + PRODUCTS_COMPACT_SLACK:
+            self.compact()
 
-def show_last_product(epd, products):
-    if products:
-        last_product = products[-1]
+def show_last_product(epd, store):
+    last_product = store.last_product()
+    if last_product:
         draw_price_tag_with_data(epd, last_product['name'], last_product['weight'], last_product['price'])
         return True
     else:
@@ -173,33 +510,213 @@ def show_last_product(epd, products):
         return False
 
 
-# первый байт - ADDH (адрес высокого уровня) отправителя, в бродкасте вижу 0xFF
-# второй байт - ADDL (адрес низкого уровня) отправителя, в бродкасте вижу 0xFF
-# третий байт - CHAN (канал), в моем случае 0x17 (23 в dec: 0x17 = 1 * 16 + 7 = 16 + 7 = 23)
-def extract_message_from_raw(raw_data):
-    if not raw_data: return ""
+def parse_frame(message):
+    """
+    Товар (JSON или компактный {P...}), кадр макета {"layout": ..., "id", "seq"}
+    или часть изображения {"bmp": ..., "part", "parts", "base", "img", "id", "seq"}.
+    Формат определяется по байту после "{", см. tag_codec
+    """
+    return tag_codec.decode(message)
+
+def apply_layout(epd, store, spec):
+    global active_layout
+    try:
+        layout = tag_layout.Layout(spec)
+        # пробная отрисовка до сохранения: макет, который не рисуется,
+        # не должен попасть в layout.json и загружаться при каждом старте
+        product = store.last_product() or {'name': "", 'weight': "0", 'price': "0"}
+        layout.render(epd, product['name'], product['weight'], product['price'])
+    except Exception as e:
+        print(f"Bad layout: {e}")
+        return False
+    active_layout = layout
+    print(f"Layout applied: {len(layout.static)} static ops, {len(layout.fields)} fields")
+    show_last_product(epd, store)
+    tag_layout.save_layout(layout)
+    return True
+
+def apply_bitmap_part(epd, frame):
+    """
+    Часть изображения от сервера. Когда собраны все части: проверка базы
+    (crc32 буферов кадра), XOR-дельта прямо в буферы, проверка результата.
+    Возвращает True, если часть можно подтвердить: последняя недостающая
+    часть подтверждается только после успешного применения, части
+    отвергнутого кадра - никогда (шлюз покажет failed, сервер пришлет
+    ключевой кадр).
+    """
+    img, part, parts = frame['img'], frame['part'], frame['parts']
+    if not 0 < parts <= BITMAP_MAX_PARTS or not 0 <= part < parts:
+        print(f"Bad bitmap part {part}/{parts}")
+        return False
+    if bitmap_rx["img"] != img:
+        bitmap_rx["img"] = img
+        bitmap_rx["parts"] = [None] * parts
+        bitmap_rx["status"] = None
+    if bitmap_rx["status"] is not None:
+        # повтор части уже примененного (потерялся ACK) или отвергнутого кадра
+        return bitmap_rx["status"] == "done"
     
-    if isinstance(raw_data, bytes):
-        # минус префикс бродкаста (первые 3 байта И если они есть)
-        if len(raw_data) >= 3 and raw_data[0:2] == b'\xff\xff':
-            message_bytes = raw_data[3:]
-        elif len(raw_data) >= 1 and raw_data[0] == 0x17:
-            # первый байт 0x17
-            message_bytes = raw_data[1:]
-        else:
-            message_bytes = raw_data
-        
+    bitmap_rx["parts"][part] = frame['bmp']
+    if None in bitmap_rx["parts"]:
+        return True
+    
+    try:
+        data = binascii.a2b_base64("".join(bitmap_rx["parts"]))
+    except ValueError as e:
+        print(f"Bitmap is not base64 ({e}), rejected")
+        bitmap_rx["parts"] = None
+        bitmap_rx["status"] = "failed"
+        return False
+    bitmap_rx["parts"] = None
+    base = frame['base']
+    if base == 0:
+        # ключевой кадр: дельта к белому
+        epd.imageblack.fill(0xff)
+        epd.imagered.fill(0xff)
+    elif base != framebuffer_digest(epd):
+        print(f"Bitmap base {base} does not match framebuffers, rejected")
+        bitmap_rx["status"] = "failed"
+        return False
+    
+    if not tag_bitmap.apply(epd.buffer_balck, epd.buffer_red, data) or framebuffer_digest(epd) != img:
+        # буферы испорчены, но кадр не показываем: следующий товар или
+        # ключевой кадр перерисует их целиком
+        print("Bitmap corrupted, rejected")
+        bitmap_rx["status"] = "failed"
+        return False
+    
+    bitmap_rx["status"] = "done"
+    print(f"Bitmap applied: {len(data)} B in {parts} parts")
+    update_display(epd)
+    return True
+
+def is_for_this_tag(product_data):
+    # кадры без id - старый формат без подтверждений
+    return 'id' not in product_data or str(product_data['id']) == TAG_ID
+
+def send_ack(lora, seq):
+    ack = tag_codec.encode_ack(TAG_ID, seq)
+    try:
+        code = lora.send_fixed_message(GATEWAY_ADDH, GATEWAY_ADDL, LORA_CHANNEL, ack)
+        print(f"ACK {seq}: {ResponseStatusCode.get_description(code)}")
+        return code == ResponseStatusCode.SUCCESS
+    except Exception as e:
+        print(f"ACK {seq} error: {e}")
+        return False
+
+async def receive_frames(uart, msg_buffer, on_frame):
+    """
+    Прием по событию: задача спит в StreamReader, пока в FIFO UART пусто,
+    и просыпается, как только пришли байты. Каждый собранный кадр сразу
+    разбирается и передается в on_frame(json_str, product_data).
+    """
+    reader = asyncio.StreamReader(uart)
+    while True:
         try:
-            return message_bytes.decode('utf-8')
-        except:
+            if msg_buffer.has_partial():
+                received = await asyncio.wait_for_ms(
+                    reader.readinto(msg_buffer.writable()), PARTIAL_FRAME_TIMEOUT_MS)
+            else:
+                received = await reader.readinto(msg_buffer.writable())
+        except asyncio.TimeoutError:
+            print(f"Buffer timeout, clearing incomplete frame ({msg_buffer.count} bytes)")
+            msg_buffer.clear()
+            continue
+        
+        woke = utime.ticks_us()
+        rx_stats["wakeups"] += 1
+        if not received:
+            continue
+        msg_buffer.commit(received)
+        
+        json_str = msg_buffer.try_extract_json()
+        while json_str:
+            product_data = parse_frame(json_str)
+            latency = utime.ticks_diff(utime.ticks_us(), woke)
+            rx_stats["frames"] += 1
+            rx_stats["last_us"] = latency
+            rx_stats["total_us"] += latency
+            if latency > rx_stats["max_us"]:
+                rx_stats["max_us"] = latency
+            print(f"Frame parsed {latency} us after wake")
+            
             try:
-                return str(message_bytes)
-            except:
-                return ""
+                on_frame(json_str, product_data)
+            except Exception as e:
+                # один необработанный кадр не должен останавливать прием
+                print(f"Frame handling error: {e}")
+            json_str = msg_buffer.try_extract_json()
+
+async def power_manager(uart, msg_buffer, aux):
+    """
+    Lightsleep между кадрами с пробуждением по AUX (ext0). E32 опускает AUX
+    за 2-3 мс до вывода принятых данных в UART, выход из lightsleep быстрее,
+    и первый фрагмент не теряется (deepsleep - это перезагрузка, не успеет).
+    """
+    import esp32
+    esp32.wake_on_ext0(pin=aux, level=esp32.WAKEUP_ALL_LOW)
+    while True:
+        await asyncio.sleep_ms(POWER_IDLE_MS)
+        if msg_buffer.has_partial() or uart.any() or aux.value() == 0:
+            continue
+        # во время обновления панели не спим: BUSY IRQ не будит из lightsleep
+        if display_updater is not None and display_updater.busy():
+            continue
+        
+        start = utime.ticks_ms()
+        machine.lightsleep(POWER_SLEEP_MAX_MS)
+        woke = utime.ticks_ms()
+        power_stats["sleeps"] += 1
+        power_stats["slept_ms"] += utime.ticks_diff(woke, start)
+        
+        if machine.wake_reason() == machine.EXT0_WAKE:
+            power_stats["aux_wakeups"] += 1
+            while not uart.any() and utime.ticks_diff(utime.ticks_ms(), woke) < 20:
+                pass
+            power_stats["lead_ms"] = utime.ticks_diff(utime.ticks_ms(), woke)
+
+def handle_frame(lora, epd, store, recent_seqs, json_str, product_data):
+    print(f"extracted JSON from buffer: {json_str}")
+    
+    if product_data and not is_for_this_tag(product_data):
+        print(f"Frame for tag {product_data['id']}, skipped")
+    elif product_data and 'bmp' in product_data:
+        seq = product_data.get('seq')
+        if apply_bitmap_part(epd, product_data) and seq is not None:
+            send_ack(lora, seq)
+    elif product_data and 'layout' in product_data:
+        # неверный макет не подтверждаем: шлюз покажет, что доставка не удалась
+        seq = product_data.get('seq')
+        if apply_layout(epd, store, product_data['layout']) and seq is not None:
+            send_ack(lora, seq)
+    elif product_data and 'name' in product_data:
+        print(f"Parsed product: {product_data}")
+        seq = product_data.pop('seq', None)
+        product_data.pop('id', None)
+        
+        if seq is not None and seq in recent_seqs:
+            print(f"Duplicate seq {seq}, already shown")
+        else:
+            action = store.put(product_data)
+            print(f"Product {action}: {product_data['name']} ({len(store)} in store)")
+            
+            # пока ласт продукта
+            show_last_product(epd, store)
+            
+            if seq is not None:
+                recent_seqs.append(seq)
+                if len(recent_seqs) > 8:
+                    recent_seqs.pop(0)
+        
+        # ACK после записи в журнал и отрисовки в буфер кадра: на экран кадр
+        # попадет, как только освободится панель (или его заменит более новый)
+        if seq is not None:
+            send_ack(lora, seq)
     else:
-        return str(raw_data)
+        print(f"Could not parse JSON: {json_str}")
 
 def main():
+    global active_layout
     uart2 = UART(2)
     lora = LoRaE32('433T20D', uart2, aux_pin=5, m0_pin=25, m1_pin=26)
     code = lora.begin()
@@ -217,71 +734,51 @@ def main():
 
     epd = init_display()
 
-    products = read_products_from_file()
-    print(f"Loaded {len(products)} products from file")
+    store = ProductStore()
+    store.load()
+    
+    active_layout = tag_layout.load_layout()
     
     # последний продукт или ожидание
-    show_last_product(epd, products)
+    show_last_product(epd, store)
+    sleep_display(epd)
     
     # буфер для сборки сообщений
     msg_buffer = MessageBuffer()
+    # последние принятые seq: повтор кадра (потерялся ACK) только подтверждаем
+    recent_seqs = []
     print("Waiting for LoRa messages...")
     
-    while True:
-        if lora.uart.any() > 0:
-            raw_data = lora.uart.read()
-            if raw_data:
-                message = extract_message_from_raw(raw_data)
-                print(f"Received raw: {raw_data}")
-                print(f"Extracted message: {message}")
-                
-                msg_buffer.add_fragment(message)
-                
-                json_str = msg_buffer.try_extract_json()
-                while json_str:
-                    print(f"extracted JSON from buffer: {json_str}")
-                    
-                    product_data = parse_product_message(json_str)
-                    if product_data:
-                        print(f"Parsed product: {product_data}")
-                        products, action = update_or_add_product(products, product_data)
-                        print(f"Product {action}: {product_data['name']}")
-                        
-                        # пока в products всегда 1 элемент
-                        if save_products_to_file(products):
-                            print(f"Saved {len(products)} products to file")
-                        
-                        # пока ласт продукта
-                        show_last_product(epd, products)
-                    else:
-                        print(f"Could not parse JSON: {json_str}")
-                    
-                    # извлечение следующего JSONа из буфера
-                    json_str = msg_buffer.try_extract_json()
-        
-        if msg_buffer.is_timed_out():
-            if msg_buffer.buffer:
-                print(f"Buffer timeout, clearing incomplete data: {msg_buffer.buffer}")
-                msg_buffer.clear()
-        
-        utime.sleep_ms(100)
+    def on_frame(json_str, product_data):
+        handle_frame(lora, epd, store, recent_seqs, json_str, product_data)
+    
+    # AUX модуля E32 (aux_pin=5) делит GPIO5 с CS дисплея, прерывание по нему
+    # срабатывало бы на каждую передачу по SPI, поэтому ждем сами данные UART
+    async def run():
+        global display_updater
+        display_updater = DisplayUpdater(epd)
+        asyncio.create_task(display_updater.run())
+        if POWER_SAVE and AUX_WAKE_PIN is not None:
+            asyncio.create_task(power_manager(lora.uart, msg_buffer, Pin(AUX_WAKE_PIN, Pin.IN)))
+        await receive_frames(lora.uart, msg_buffer, on_frame)
+    
+    asyncio.run(run())
 
 # для REPL
 def view_products():
-    products = read_products_from_file()
-    if products:
-        print(f"\nTotal products: {len(products)}")
-        for i, product in enumerate(products, 1):
+    store = ProductStore()
+    store.load()
+    if len(store):
+        print(f"\nTotal products: {len(store)}")
+        for i, product in enumerate(store.values(), 1):
             print(f"{i}. {product['name']}: {product['weight']}kg, {product['price']}rub/kg")
     else:
         print("No products in file")
 
 def delete_product(product_name):
-    products = read_products_from_file()
-    new_products = [p for p in products if p['name'] != product_name]
-    
-    if len(new_products) < len(products):
-        save_products_to_file(new_products)
+    store = ProductStore()
+    store.load()
+    if store.remove(product_name):
         print(f"Deleted '{product_name}'")
         return True
     else:
@@ -289,13 +786,13 @@ def delete_product(product_name):
         return False
 
 def clear_all_products():
-    save_products_to_file([])
+    store = ProductStore()
+    store.clear()
     print("All products cleared")
 
 def show_file_size():
-    import os
     try:
-        stat = os.stat("product_list.txt")
+        stat = os.stat(PRODUCTS_LOG)
         print(f"File size: {stat[6]} bytes")
     except:
         print("File not found")
@@ -3,15 +3,17 @@ import network
 import time
 import socket
 import json
+import gc
+import os
+import binascii
 import machine
-import ujson
-from collections import OrderedDict
+import urandom
+import tag_codec
 
 # import for lora connection
 from lora_e32 import LoRaE32, Configuration
 from machine import UART
 import utime
-import ujson
 
 from lora_e32_constants import FixedTransmission
 from lora_e32_operation_constant import ResponseStatusCode
@@ -27,18 +29,41 @@ DEVICE_ID = "TAG-101"
 LORA_CHANNEL = 23
 LORA_SENDER_ADDRESS = 0x02
 
-# PRODUCT DATA
-price_data = {
-    "device_id": DEVICE_ID,
-    "product_name": "Shluz", 
-    "current_price": 0.0,  
-    "weight": 0.5,        
-    "battery": 85,       
+# HTTP
+MAX_REQUEST_SIZE = 4096      # запросы больше отклоняются с 413
+RESPONSE_BUFFER_SIZE = 2048  # ответ больше уходит по частям без Content-Length
+
+# LORA DELIVERY
+LORA_ACK_TIMEOUT_MS = 3000   # ожидание ACK до первого повтора
+LORA_MAX_RETRIES = 4         # повторов до статуса "failed"
+LORA_WINDOW = 2              # неподтвержденных кадров на один ценник
+LORA_COMPACT_FRAMES = True   # цена кадром {P...} (tag_codec), False - JSON для старых прошивок ценников
+LAYOUT_MAX_FRAME = 512       # кадр макета целиком должен влезть в буфер E32
+BITMAP_PART_CHARS = 400      # base64 изображения на кадр: с ключами < 512 B
+BITMAP_MAX_PARTS = 8         # ключевой кадр ценника обычно 4-6 частей, запрос < MAX_REQUEST_SIZE
+
+# TAG TABLE
+TAGS_JOURNAL = "tags.journal"
+TAGS_COMPACT_SLACK = 64      # сжатие журнала, когда записей > 2 * ценников + это
+
+# состояние самого шлюза
+gateway_state = {
+    "battery": 85,
     "signal": 92,
-    "is_active": True,
-    "last_update": None
+    "is_active": True
 }
 
+# Таблица ценников: device_id -> (name, price, weight, last_update)
+# кортеж вместо словаря: на сотни ценников заметно меньше памяти
+T_NAME = 0
+T_PRICE = 1
+T_WEIGHT = 2
+T_UPDATED = 3
+
+tag_table = {}
+last_device_id = None
+_journal_records = 0
+
 
 def init_lora():
     """
@@ -73,6 +98,14 @@ def init_lora():
         return None
 
 
+def _encode_price_frame(message_data, seq=None):
+    return tag_codec.encode_price(message_data.get("device_id", DEVICE_ID),
+                                  message_data.get("product_name", "Product"),
+                                  message_data.get("weight", 0),
+                                  message_data.get("current_price", 0),
+                                  seq, compact=LORA_COMPACT_FRAMES)
+
+
 def send_lora_message(lora_module, message_data):
     """
     Send data via LoRa - ОБНОВЛЕНО для нового формата данных
@@ -82,26 +115,21 @@ def send_lora_message(lora_module, message_data):
         return False
     
     try:
-        product_data = OrderedDict([
-            ('name', str(message_data.get("product_name", "Product"))[:20]),
-            ('weight', str(message_data.get("weight", 0))),
-            ('price', str(message_data.get("current_price", 0)))
-        ])
+        return send_lora_frame(lora_module, _encode_price_frame(message_data))
+    except Exception as e:
+        print(f"[LORA] Error: {e}")
+        return False
 
-       
-        print(f"[LORA] Подготовлены данные: {product_data}")
 
-        print("Sending messages...")
-        
-        # Преобразуем словарь в строку JSON
-        product_str = ujson.dumps(product_data)
+def send_lora_frame(lora_module, product_str):
+    """Send already encoded frame via LoRa"""
+    try:
         print(f"[LORA] Отправляем по LoRa: {product_str}")
         print(f"[LORA] Размер сообщения: {len(product_str)} байт")
     
         # Отправка сообщения
-        code = lora_module.send_broadcast_message(23, product_str)
+        code = lora_module.send_broadcast_message(LORA_CHANNEL, product_str)
         print(f"[LORA] Статус отправки: {ResponseStatusCode.get_description(code)}")
-        print(f"[LORA] Send code: {code}")
         
         if code == ResponseStatusCode.SUCCESS:
             print("[LORA] Success")
@@ -109,16 +137,258 @@ def send_lora_message(lora_module, message_data):
         else:
             print(f"[LORA] Failed: {ResponseStatusCode.get_description(code)}")
             return False
-    
-        utime.sleep(2)
-
-        print("All messages sent!")
             
     except Exception as e:
         print(f"[LORA] Error: {e}")
         return False
 
 
+# Надежная доставка: у каждого кадра есть seq, ценник отвечает {"ack": seq, "id": ...},
+# шлюз повторяет неподтвержденные кадры с удвоением таймаута.
+# seq начинается со случайного значения, чтобы после перезагрузки шлюза
+# ценник не принял новые кадры за дубликаты.
+_next_seq = urandom.getrandbits(16) or 1
+delivery = {}
+lora_stats = {"forwarded": 0, "suppressed": 0}
+_ack_rx = b""
+
+
+def _delivery_state(device_id):
+    state = delivery.get(device_id)
+    if state is None:
+        state = {
+            "state": "idle",       # idle / pending / delivered / failed
+            "in_flight": [],       # [seq, kind, frame, attempts, deadline_ms]
+            "queue": [],           # [seq, kind, frame] ждут места в окне
+            "acked_seq": None,
+            "last_ack": None,
+            "sent": 0,
+            "retries": 0,
+            "acked": 0,
+            "failed": 0,
+            "superseded": 0,
+            "suppressed": 0,
+            "hash": None,          # crc32 последнего отправленного кадра с ценой (без seq)
+            "hash_seq": None,
+            "hash_acked": False
+        }
+        delivery[device_id] = state
+    return state
+
+
+def _take_seq():
+    global _next_seq
+    seq = _next_seq
+    _next_seq = (_next_seq % 0xFFFF) + 1
+    return seq
+
+
+def _transmit(lora_module, state, entry):
+    entry[4] = utime.ticks_add(utime.ticks_ms(), LORA_ACK_TIMEOUT_MS << entry[3])
+    state["sent"] += 1
+    return send_lora_frame(lora_module, entry[2])
+
+
+def queue_lora_frame(lora_module, device_id, build_frame, kind="price", supersede=True):
+    """
+    Put frame for device_id into delivery queue.
+    build_frame(seq) returns encoded frame. Older frames of the same kind
+    are superseded: retransmitting them would overwrite newer data on the tag.
+    supersede=False for the second and later parts of one multi-frame update.
+    Returns (seq, transmitted)
+    """
+    state = _delivery_state(device_id)
+    seq = _take_seq()
+    frame = build_frame(seq)
+    
+    for pending in (state["in_flight"], state["queue"]):
+        for entry in pending[:]:
+            if supersede and entry[1] == kind:
+                pending.remove(entry)
+                state["superseded"] += 1
+    
+    state["state"] = "pending"
+    if len(state["in_flight"]) < LORA_WINDOW:
+        entry = [seq, kind, frame, 0, 0]
+        state["in_flight"].append(entry)
+        return seq, _transmit(lora_module, state, entry)
+    
+    state["queue"].append([seq, kind, frame])
+    print(f"[LORA] {device_id}: window full, seq {seq} queued")
+    return seq, False
+
+
+def _seq_pending(state, seq):
+    for entry in state["in_flight"]:
+        if entry[0] == seq:
+            return True
+    for entry in state["queue"]:
+        if entry[0] == seq:
+            return True
+    return False
+
+
+def forward_tag(lora_module, device_id, force=False):
+    """
+    Send current tag state via LoRa unless the same content is already
+    delivered or still being delivered: every frame costs the tag
+    a multi-second e-paper refresh.
+    force - send anyway: the tag was last updated through another gateway
+    (server failover), so what this gateway acked may no longer be on screen.
+    Returns (seq, transmitted, suppressed)
+    """
+    data = tag_data(device_id)
+    content_hash = binascii.crc32(_encode_price_frame(data).encode())
+    state = _delivery_state(device_id)
+    
+    if not force and state["hash"] == content_hash and (state["hash_acked"] or _seq_pending(state, state["hash_seq"])):
+        state["suppressed"] += 1
+        lora_stats["suppressed"] += 1
+        print(f"[LORA] {device_id}: content unchanged (seq {state['hash_seq']}), not sent")
+        return state["hash_seq"], False, True
+    
+    seq, sent = queue_lora_frame(lora_module, device_id,
+                                 lambda seq: _encode_price_frame(data, seq))
+    state["hash"] = content_hash
+    state["hash_seq"] = seq
+    state["hash_acked"] = False
+    lora_stats["forwarded"] += 1
+    return seq, sent, False
+
+
+def forward_layout(lora_module, device_id, spec):
+    """
+    Send tag layout via LoRa, same delivery queue as prices but its own
+    kind: a newer layout supersedes an older one, prices are left alone.
+    Returns (seq, transmitted)
+    """
+    return queue_lora_frame(lora_module, device_id,
+                            lambda seq: tag_codec.encode_layout(device_id, spec, seq),
+                            kind="layout")
+
+
+def forward_bitmap(lora_module, device_id, data, base, img):
+    """
+    Send server-rendered image (base64 of tag_bitmap delta) in parts.
+    A new image supersedes all parts of an older one still in flight:
+    the tag applies an image only when all its parts are in.
+    Returns (seq of the last part, all parts transmitted, parts)
+    """
+    parts = (len(data) + BITMAP_PART_CHARS - 1) // BITMAP_PART_CHARS
+    sent = True
+    seq = None
+    for part in range(parts):
+        chunk = data[part * BITMAP_PART_CHARS:(part + 1) * BITMAP_PART_CHARS]
+        seq, transmitted = queue_lora_frame(
+            lora_module, device_id,
+            lambda seq: tag_codec.encode_bitmap_part(device_id, chunk, part, parts, base, img, seq),
+            kind="bitmap", supersede=part == 0)
+        sent = sent and transmitted
+    # на ценнике теперь изображение: та же цена кадром с товаром снова уйдет
+    _delivery_state(device_id)["hash"] = None
+    return seq, sent, parts
+
+
+def handle_lora_ack(device_id, seq):
+    state = delivery.get(device_id)
+    if state is None:
+        return False
+    
+    for entry in state["in_flight"]:
+        if entry[0] == seq:
+            state["in_flight"].remove(entry)
+            state["acked_seq"] = seq
+            state["last_ack"] = time.time()
+            state["acked"] += 1
+            if seq == state["hash_seq"]:
+                state["hash_acked"] = True
+            if not state["in_flight"] and not state["queue"]:
+                state["state"] = "delivered"
+            print(f"[LORA] ACK {device_id} seq {seq}")
+            return True
+    
+    # повторный ACK на уже подтвержденный или вытесненный кадр
+    return False
+
+
+def _extract_frames(buf):
+    """Split received bytes into {...} frames, returns (frames, rest)"""
+    frames = []
+    while True:
+        start = buf.find(b"{")
+        if start == -1:
+            return frames, b""
+        end = buf.find(b"}", start)
+        if end == -1:
+            return frames, buf[start:]
+        frames.append(buf[start:end + 1])
+        buf = buf[end + 1:]
+
+
+def poll_lora(lora_module):
+    """Read ACK frames and retransmit expired ones. Called from server loop"""
+    global _ack_rx
+    if lora_module is None:
+        return
+    
+    try:
+        if lora_module.uart.any() > 0:
+            raw = lora_module.uart.read()
+            if raw:
+                frames, _ack_rx = _extract_frames(_ack_rx + raw)
+                if len(_ack_rx) > 256:
+                    # мусор без закрывающей скобки
+                    _ack_rx = b""
+                for frame in frames:
+                    ack = tag_codec.decode(frame)
+                    if ack is not None and "ack" in ack:
+                        handle_lora_ack(str(ack["id"]), ack["ack"])
+                    else:
+                        print(f"[LORA] Bad ACK frame: {frame}")
+    except Exception as e:
+        print(f"[LORA] Receive error: {e}")
+    
+    now = utime.ticks_ms()
+    for device_id, state in delivery.items():
+        for entry in state["in_flight"][:]:
+            if utime.ticks_diff(now, entry[4]) < 0:
+                continue
+            if entry[3] >= LORA_MAX_RETRIES:
+                state["in_flight"].remove(entry)
+                state["failed"] += 1
+                state["state"] = "failed"
+                print(f"[LORA] {device_id}: seq {entry[0]} not acknowledged, giving up")
+                continue
+            entry[3] += 1
+            state["retries"] += 1
+            print(f"[LORA] {device_id}: retransmit seq {entry[0]} (attempt {entry[3]})")
+            _transmit(lora_module, state, entry)
+        
+        while state["queue"] and len(state["in_flight"]) < LORA_WINDOW:
+            seq, kind, frame = state["queue"].pop(0)
+            entry = [seq, kind, frame, 0, 0]
+            state["in_flight"].append(entry)
+            _transmit(lora_module, state, entry)
+
+
+def delivery_status():
+    result = {}
+    for device_id, state in delivery.items():
+        result[device_id] = {
+            "state": state["state"],
+            "in_flight": [entry[0] for entry in state["in_flight"]],
+            "queued": len(state["queue"]),
+            "acked_seq": state["acked_seq"],
+            "last_ack": state["last_ack"],
+            "sent": state["sent"],
+            "retries": state["retries"],
+            "acked": state["acked"],
+            "failed": state["failed"],
+            "superseded": state["superseded"],
+            "suppressed": state["suppressed"]
+        }
+    return result
+
 
 def connect_wifi():
     print("\n[WIFI] Connecting to:", WIFI_SSID)
@@ -147,53 +417,177 @@ def connect_wifi():
         return None, None
 
 
-def update_price_data(new_data):
+def _journal_line(device_id, record):
+    # табуляция и перевод строки - разделители, из названия их убираем
+    name = record[T_NAME].replace("\t", " ").replace("\n", " ")
+    return f"{device_id}\t{name}\t{record[T_PRICE]}\t{record[T_WEIGHT]}\t{record[T_UPDATED] or 0}\n"
+
+
+def _parse_journal_line(line):
+    if not line.endswith("\n"):
+        # последняя строка без перевода строки - запись оборвана
+        return None, None
+    parts = line[:-1].split("\t")
+    if len(parts) != 5:
+        return None, None
+    try:
+        updated = int(float(parts[4])) or None
+        return parts[0], (parts[1], float(parts[2]), float(parts[3]), updated)
+    except ValueError:
+        return None, None
+
+
+def load_tag_table():
+    """Restore tag table by replaying the journal"""
+    global _journal_records, last_device_id
+    start = utime.ticks_ms()
+    
+    try:
+        # недописанное сжатие: журнал еще целый, временный файл лишний
+        os.remove(TAGS_JOURNAL + ".tmp")
+    except OSError:
+        pass
+    
+    tag_table.clear()
+    _journal_records = 0
+    bad = 0
+    try:
+        with open(TAGS_JOURNAL, "r") as f:
+            for line in f:
+                _journal_records += 1
+                if line.startswith("-") and line.endswith("\n"):
+                    tag_table.pop(line[1:-1], None)
+                    continue
+                device_id, record = _parse_journal_line(line)
+                if device_id is None:
+                    # оборванная запись (питание пропало во время записи)
+                    print("[TAGS] Skipped bad journal line:", line)
+                    bad += 1
+                    continue
+                tag_table[device_id] = record
+                last_device_id = device_id
+    except OSError:
+        print("[TAGS] No journal, starting empty")
+    if bad:
+        # следующая запись не должна приклеиться к оборванной строке
+        compact_journal()
+    
+    print(f"[TAGS] Restored {len(tag_table)} tags from {_journal_records} records "
+          f"in {utime.ticks_diff(utime.ticks_ms(), start)} ms")
+
+
+def compact_journal():
+    """Rewrite journal with one record per tag"""
+    global _journal_records
+    tmp = TAGS_JOURNAL + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            for device_id, record in tag_table.items():
+                f.write(_journal_line(device_id, record))
+        # rename заменяет журнал целиком: после сбоя будет либо старый, либо новый
+        os.rename(tmp, TAGS_JOURNAL)
+        _journal_records = len(tag_table)
+        print(f"[TAGS] Journal compacted to {_journal_records} records")
+    except OSError as e:
+        print(f"[TAGS] Compaction error: {e}")
+
+
+def _journal_append(line):
+    global _journal_records
+    try:
+        with open(TAGS_JOURNAL, "a") as f:
+            f.write(line)
+        _journal_records += 1
+    except OSError as e:
+        print(f"[TAGS] Journal write error: {e}")
+        return
+    
+    if _journal_records > 2 * len(tag_table) + TAGS_COMPACT_SLACK:
+        compact_journal()
+
+
+def remove_tag(device_id):
+    if tag_table.pop(device_id, None) is None:
+        return False
+    _journal_append("-" + device_id + "\n")
+    return True
+
+
+def tag_data(device_id):
+    """Tag state in the shape of the old price_data dict"""
+    record = tag_table.get(device_id)
+    if record is None:
+        return None
+    return {
+        "device_id": device_id,
+        "product_name": record[T_NAME],
+        "current_price": record[T_PRICE],
+        "weight": record[T_WEIGHT],
+        "battery": gateway_state["battery"],
+        "signal": gateway_state["signal"],
+        "is_active": gateway_state["is_active"],
+        "last_update": record[T_UPDATED]
+    }
+
+
+def update_price_data(device_id, new_data):
+    """
+    Apply new_data to the tag. Returns True if name/price/weight really changed:
+    the same values sent again are not an update and are not written to flash
+    """
+    global last_device_id
     update_count = 0
     
-    print(f"[DATA] New data received: {new_data}")
+    print(f"[DATA] {device_id}: new data received: {new_data}")
+    
+    record = tag_table.get(device_id)
+    if record is None:
+        record = ("Product", 0.0, 0.0, None)
+        # новый ценник записываем, даже если значения совпали с умолчаниями
+        update_count = 1
+    name, price, weight = record[T_NAME], record[T_PRICE], record[T_WEIGHT]
     
     for key, value in new_data.items():
-        if key == "product_name" and key in price_data:
-            old_value = price_data[key]
-            price_data[key] = str(value)
-            update_count += 1
-            print(f"[DATA] {key}: {old_value} -> {price_data[key]}")
+        if key == "product_name":
+            if str(value) != name:
+                print(f"[DATA] {key}: {name} -> {value}")
+                name = str(value)
+                update_count += 1
             
-        elif key == "current_price" and key in price_data:
+        elif key == "current_price":
             try:
-                old_value = price_data[key]
-                price_data[key] = float(value)
-                update_count += 1
-                print(f"[DATA] {key}: {old_value} -> {price_data[key]}")
+                old_value = price
+                price = float(value)
+                if price != old_value:
+                    update_count += 1
+                    print(f"[DATA] {key}: {old_value} -> {price}")
             except:
                 print(f"[DATA] Bad format for {key}: {value}")
                 
-        elif key == "weight" and key in price_data:
+        elif key == "weight":
             try:
-                old_value = price_data[key]
-                price_data[key] = float(value)
-                update_count += 1
-                print(f"[DATA] {key}: {old_value} -> {price_data[key]}")
+                old_value = weight
+                weight = float(value)
+                if weight != old_value:
+                    update_count += 1
+                    print(f"[DATA] {key}: {old_value} -> {weight}")
             except:
                 print(f"[DATA] Bad format for {key}: {value}")
                 
-        elif key == "battery" and key in price_data:
+        elif key == "battery":
+            # заряд шлюза, на ценник не передается
             try:
-                old_value = price_data[key]
-                price_data[key] = int(value)
-                update_count += 1
-                print(f"[DATA] {key}: {old_value} -> {price_data[key]}")
+                old_value = gateway_state[key]
+                gateway_state[key] = int(value)
+                print(f"[DATA] {key}: {old_value} -> {gateway_state[key]}")
             except:
                 print(f"[DATA] Bad format for {key}: {value}")
-                
-        elif key == "device_id":
-            pass
-                
-        else:
-            pass
     
     if update_count > 0:
-        price_data["last_update"] = time.time()
+        record = (name, price, weight, int(time.time()))
+        tag_table[device_id] = record
+        last_device_id = device_id
+        _journal_append(_journal_line(device_id, record))
         print(f"[DATA] Updated {update_count} fields")
         return True
     else:
@@ -201,124 +595,449 @@ def update_price_data(new_data):
         return False
 
 
-def parse_http_request(request):
-    """Parse HTTP request"""
-    try:
-        request_str = request.decode("utf-8", errors='ignore')
-    except:
+# у bytearray в MicroPython нет find - там ищем перевод строки циклом
+_BYTEARRAY_FIND = hasattr(bytearray, "find")
+
+
+class HttpRequestReader:
+    """
+    Read HTTP request into one preallocated buffer.
+    Header lines are parsed as soon as their line break arrives, each byte
+    is looked at once and the body is never scanned or copied until used.
+    """
+    
+    def __init__(self, size=MAX_REQUEST_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.reset()
+    
+    def reset(self):
+        self.length = 0          # получено байт
+        self.scan = 0            # до какого байта уже искали переводы строк
+        self.line_start = 0
+        self.body_start = -1
+        self.content_length = 0
+        self.method = None
+        self.path = None
+        self.headers = {}
+        self.malformed = False   # строка заголовков не в UTF-8
+    
+    def _parse_line(self, start, end):
         try:
-            request_str = request.decode("latin-1")
-        except:
-            request_str = str(request)
+            line = bytes(self.view[start:end]).decode("utf-8")
+        except UnicodeError:
+            self.malformed = True
+            return
+        
+        if self.method is None:
+            request_line = line.split()
+            if len(request_line) >= 2:
+                self.method = request_line[0]
+                self.path = request_line[1]
+            return
+        
+        sep = line.find(":")
+        if sep > 0:
+            key = line[:sep].strip().lower()
+            value = line[sep + 1:].strip()
+            self.headers[key] = value
+            if key == "content-length":
+                try:
+                    self.content_length = int(value)
+                except ValueError:
+                    self.content_length = -1
     
-    lines = request_str.split("\r\n")
+    def _find_lf(self, start, end):
+        buf = self.buf
+        if _BYTEARRAY_FIND:
+            return buf.find(b"\n", start, end)
+        for i in range(start, end):
+            if buf[i] == 10:
+                return i
+        return -1
     
-    if not lines:
-        return None, None, None, None
+    def feed(self, count):
+        """Account count new bytes at self.length and parse finished header lines"""
+        self.length += count
+        
+        while self.body_start < 0:
+            i = self._find_lf(self.scan, self.length)
+            if i == -1:
+                self.scan = self.length
+                break
+            line_end = i - 1 if i > self.line_start and self.buf[i - 1] == 13 else i
+            if line_end == self.line_start:
+                # пустая строка - конец заголовков
+                self.body_start = i + 1
+            else:
+                self._parse_line(self.line_start, line_end)
+            self.line_start = self.scan = i + 1
     
-    request_line = lines[0].split()
-    if len(request_line) < 2:
-        return None, None, None, None
+    def headers_done(self):
+        return self.body_start >= 0
     
-    method = request_line[0]
-    path = request_line[1]
+    def complete(self):
+        return self.body_start >= 0 and self.length - self.body_start >= self.content_length
     
-    headers = {}
-    for i in range(1, len(lines)):
-        if not lines[i]:
-            break
-        if ": " in lines[i]:
-            key, value = lines[i].split(": ", 1)
-            headers[key.lower()] = value
+    def read(self, client):
+        """
+        Read request from socket.
+        Returns None on success or HTTP status string on error
+        """
+        self.reset()
+        recv_into = getattr(client, "recv_into", None) or client.readinto
+        size = len(self.buf)
+        
+        while not self.complete():
+            if self.length >= size:
+                return "413 Payload Too Large"
+            try:
+                count = recv_into(self.view[self.length:])
+            except OSError as e:
+                print(f"[SERVER] Read error: {e}")
+                break
+            if not count:
+                break
+            self.feed(count)
+            
+            if self.malformed:
+                return "400 Bad Request"
+            if self.headers_done():
+                if self.method is None or self.content_length < 0:
+                    return "400 Bad Request"
+                if self.body_start + self.content_length > size:
+                    # тело не поместится - не читаем его вовсе
+                    return "413 Payload Too Large"
+        
+        if self.length == 0:
+            # соединение закрыто без запроса
+            return None
+        if not self.headers_done() or self.method is None:
+            return "400 Bad Request"
+        return None
+    
+    def body(self):
+        if self.body_start < 0:
+            return None
+        end = min(self.length, self.body_start + self.content_length)
+        if end <= self.body_start:
+            return None
+        body = bytes(self.view[self.body_start:end]).decode("utf-8")
+        return body if body.strip() else None
+
+
+# место перед телом ответа под статусную строку и заголовки:
+# их дописываем вплотную к телу и отправляем все одним send
+_HEADROOM = 128
+
+
+class HttpResponseWriter:
+    """
+    Response body is written incrementally (see write_json) into one
+    reusable buffer, headers come from cached templates.
+    If the body does not fit, it is streamed without Content-Length.
+    """
+    
+    def __init__(self, size=RESPONSE_BUFFER_SIZE):
+        self.buf = bytearray(_HEADROOM + size)
+        self.view = memoryview(self.buf)
+        self.templates = {}
+        for status in ("200 OK", "400 Bad Request", "404 Not Found", "500 Internal Server Error"):
+            for content_type in ("text/html", "text/plain", "application/json"):
+                self._template(status, content_type)
+        self.client = None
+        self.length = 0
+        self.streaming = False
+        self.failed = False
+    
+    def _template(self, status, content_type):
+        key = (status, content_type)
+        template = self.templates.get(key)
+        if template is None:
+            template = ("HTTP/1.1 " + status + "\r\nContent-Type: " + content_type
+                        + "\r\nConnection: close\r\n").encode()
+            self.templates[key] = template
+        return template
+    
+    def begin(self, client, status, content_type):
+        self.client = client
+        self.status = status
+        self.content_type = content_type
+        self.length = 0
+        self.streaming = False
+        self.failed = False
+    
+    def _send(self, data):
+        if self.failed:
+            return
+        try:
+            self.client.sendall(data)
+        except Exception as e:
+            print(f"[HTTP] Send error: {e}")
+            self.failed = True
     
-    body = None
-    if "\r\n\r\n" in request_str:
-        body_str = request_str.split("\r\n\r\n", 1)[1]
-        if body_str.strip():
-            body = body_str
+    def _flush(self):
+        if not self.streaming:
+            # размер заранее неизвестен - конец тела определит закрытие соединения
+            self.streaming = True
+            self._send(self._template(self.status, self.content_type) + b"\r\n")
+        if self.length:
+            self._send(self.view[_HEADROOM:_HEADROOM + self.length])
+            self.length = 0
     
-    return method, path, headers, body
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        count = len(data)
+        pos = _HEADROOM + self.length
+        
+        if pos + count > len(self.buf):
+            self._flush()
+            pos = _HEADROOM
+            if pos + count > len(self.buf):
+                self._send(data)
+                return count
+        
+        self.view[pos:pos + count] = data
+        self.length += count
+        return count
+    
+    def finish(self):
+        if self.streaming:
+            self._flush()
+            return
+        
+        template = self._template(self.status, self.content_type)
+        length_line = b"Content-Length: " + str(self.length).encode() + b"\r\n\r\n"
+        start = _HEADROOM - len(template) - len(length_line)
+        if start < 0:
+            self._send(template + length_line)
+            self._send(self.view[_HEADROOM:_HEADROOM + self.length])
+            return
+        
+        self.view[start:start + len(template)] = template
+        self.view[start + len(template):_HEADROOM] = length_line
+        self._send(self.view[start:_HEADROOM + self.length])
+
+
+response_writer = HttpResponseWriter()
 
 
 def send_http_response(client, status_code, content_type, content):
-    response = f"HTTP/1.1 {status_code}\r\n"
-    response += "Content-Type: " + content_type + "\r\n"
-    response += "Content-Length: " + str(len(content)) + "\r\n"
-    response += "Connection: close\r\n"
-    response += "\r\n"
-    response += content
-    
+    response_writer.begin(client, status_code, content_type)
+    response_writer.write(content)
+    response_writer.finish()
+
+
+def write_json(w, data):
+    """
+    Write dict field by field: the biggest temporary string is one value,
+    not the whole document. Output is the same as json.dumps(data)
+    """
+    sep = b"{"
+    for key, value in data.items():
+        w.write(sep)
+        w.write(json.dumps(key))
+        w.write(b": ")
+        w.write(json.dumps(value))
+        sep = b", "
+    w.write(b"}" if data else b"{}")
+
+
+def send_json_response(client, status_code, data):
+    response_writer.begin(client, status_code, "application/json")
+    write_json(response_writer, data)
+    response_writer.finish()
+
+
+# Свободная куча: на MicroPython gc.mem_free(), на CPython недоступна
+heap_stats = {
+    "free": None,
+    "min_free": None,
+    "last_request": None,
+    "max_request": 0,
+    "requests": 0
+}
+
+
+def _mem_free():
     try:
-        client.send(response.encode("utf-8"))
-    except Exception as e:
-        print(f"[HTTP] Send error: {e}")
+        return gc.mem_free()
+    except AttributeError:
+        return None
+
 
+def record_heap_usage(free_before):
+    free_after = _mem_free()
+    if free_before is None or free_after is None:
+        return
+    
+    # если во время запроса сработал сборщик мусора, разница может быть отрицательной
+    used = max(0, free_before - free_after)
+    heap_stats["free"] = free_after
+    if heap_stats["min_free"] is None or free_after < heap_stats["min_free"]:
+        heap_stats["min_free"] = free_after
+    heap_stats["last_request"] = used
+    heap_stats["max_request"] = max(heap_stats["max_request"], used)
+    heap_stats["requests"] += 1
+    print(f"[MEM] Request used {used} B, free {free_after} B")
 
-def handle_request(client, request, lora_module):
+
+def write_index_page(w, lora_module):
+    w.write(b"<html>\n<head><title>ESP32 Price Tag - ")
+    w.write(DEVICE_ID)
+    w.write(b"</title></head>\n<body>\n<h1>ESP32 Price Tag</h1>\n<p><strong>Gateway ID:</strong> ")
+    w.write(DEVICE_ID)
+    w.write(b"</p>\n<p><strong>Battery:</strong> ")
+    w.write(str(gateway_state['battery']))
+    w.write(b"%</p>\n<p><strong>Status:</strong> ")
+    w.write(b"Active" if gateway_state['is_active'] else b"Inactive")
+    w.write(b"</p>\n<p><strong>LoRa:</strong> ")
+    w.write(b"Ready" if lora_module else b"Off")
+    w.write(b"</p>\n<p><strong>Tags:</strong> ")
+    w.write(str(len(tag_table)))
+    w.write(b"""</p>
+<table border="1" cellpadding="4">
+<tr><th>Device ID</th><th>Product</th><th>Price, RUB</th><th>Weight, kg</th><th>Last update</th></tr>
+""")
+    for device_id, record in tag_table.items():
+        w.write(b"<tr><td>")
+        w.write(device_id)
+        w.write(b"</td><td>")
+        w.write(record[T_NAME])
+        w.write(b"</td><td>")
+        w.write(str(record[T_PRICE]))
+        w.write(b"</td><td>")
+        w.write(str(record[T_WEIGHT]))
+        w.write(b"</td><td>")
+        w.write(time.ctime(record[T_UPDATED]) if record[T_UPDATED] else b"Never")
+        w.write(b"</td></tr>\n")
+    w.write(b"""</table>
+<hr>
+<h3>API:</h3>
+<ul>
+<li><a href="/api/status">/api/status</a> - Status</li>
+<li><a href="/api/price">/api/price</a> - Price (GET/POST/PUT), ?id=device_id, POST ?force=1 - resend same content</li>
+<li><a href="/api/tags">/api/tags</a> - All tags</li>
+<li>/api/layout?id=device_id - Tag layout (POST)</li>
+<li>/api/bitmap?id=device_id - Server-rendered image (POST)</li>
+</ul>
+</body></html>""")
+
+
+def write_status(w, lora_module):
+    wlan = network.WLAN(network.STA_IF)
+    status = {
+        "device_id": DEVICE_ID,
+        "status": "online",
+        "wifi_connected": wlan.isconnected(),
+        "ip_address": wlan.ifconfig()[0] if wlan.isconnected() else None,
+        "lora_ready": lora_module is not None,
+        "lora_channel": LORA_CHANNEL if lora_module else None,
+        "timestamp": time.time(),
+        "data": tag_data(last_device_id),
+        "tags": len(tag_table),
+        "delivery": delivery_status(),
+        "lora_stats": lora_stats,
+        "heap": heap_stats
+    }
+    write_json(w, status)
+
+
+def write_tags(w):
+    # ценников могут быть сотни: пишем по одному, без общего словаря
+    w.write(b"{")
+    sep = b""
+    for device_id in tag_table:
+        w.write(sep)
+        w.write(json.dumps(device_id))
+        w.write(b": ")
+        write_json(w, tag_data(device_id))
+        sep = b", "
+    w.write(b"}")
+
+
+def write_price_update(w, data, is_updated, lora_sent, suppressed, seq, device_id, compact):
+    # compact=1 - для программных клиентов: без эха запроса и текущих данных
+    response_data = {
+        "success": True,
+        "device_id": DEVICE_ID,
+        "updated": is_updated,
+        "lora_forwarded": lora_sent,
+        "lora_suppressed": suppressed,
+        "seq": seq,
+        "delivery": delivery[device_id]["state"] if device_id in delivery else None,
+        "battery": gateway_state["battery"],
+        "timestamp": time.time()
+    }
+    if not compact:
+        if suppressed:
+            response_data["message"] = "Data unchanged, already sent via LoRa"
+        else:
+            response_data["message"] = "Data updated and forwarded via LoRa" if lora_sent else "Data updated"
+        response_data["received_data"] = data
+        response_data["current_data"] = tag_data(device_id)
+    write_json(w, response_data)
+
+
+def _query_param(query, name):
+    for pair in query.split("&"):
+        key, _, value = pair.partition("=")
+        if key == name:
+            return value
+    return None
+
+
+def handle_request(client, reader, lora_module):
+    w = response_writer
     try:
-        method, path, headers, body = parse_http_request(request)
-        
-        if not method or not path:
-            send_http_response(client, "400 Bad Request", "text/plain", "Bad request")
-            return
+        method = reader.method
+        path, _, query = reader.path.partition("?")
+        compact = "compact=1" in query
+        force = "force=1" in query
+        body = reader.body()
         
         print(f"\n[HTTP] {method} {path}")
         if body:
             print(f"[HTTP] Body length: {len(body)} bytes")
         
         if path == "/":
-            html = f"""<html>
-<head><title>ESP32 Price Tag - {DEVICE_ID}</title></head>
-<body>
-<h1>ESP32 Price Tag</h1>
-<p><strong>Device ID:</strong> {price_data['device_id']}</p>
-<p><strong>Product:</strong> {price_data['product_name']}</p>
-<p><strong>Price:</strong> {price_data['current_price']} RUB</p>
-<p><strong>Weight:</strong> {price_data['weight']} kg</p>
-<p><strong>Battery:</strong> {price_data['battery']}%</p>
-<p><strong>Status:</strong> {'Active' if price_data['is_active'] else 'Inactive'}</p>
-<p><strong>LoRa:</strong> {'Ready' if lora_module else 'Off'}</p>
-<hr>
-<h3>API:</h3>
-<ul>
-<li><a href="/api/status">/api/status</a> - Status</li>
-<li><a href="/api/price">/api/price</a> - Price (GET/POST/PUT)</li>
-</ul>
-<p><strong>Last update:</strong> {time.ctime(price_data['last_update']) if price_data['last_update'] else 'Never'}</p>
-</body></html>"""
-            
-            send_http_response(client, "200 OK", "text/html", html)
+            w.begin(client, "200 OK", "text/html")
+            write_index_page(w, lora_module)
+            w.finish()
             return
         
         # API: Status
         elif path == "/api/status":
-            wlan = network.WLAN(network.STA_IF)
-            status = {
-                "device_id": DEVICE_ID,
-                "status": "online",
-                "wifi_connected": wlan.isconnected(),
-                "ip_address": wlan.ifconfig()[0] if wlan.isconnected() else None,
-                "lora_ready": lora_module is not None,
-                "lora_channel": LORA_CHANNEL if lora_module else None,
-                "timestamp": time.time(),
-                "data": price_data
-            }
-            
-            response_json = json.dumps(status)
-            send_http_response(client, "200 OK", "application/json", response_json)
+            w.begin(client, "200 OK", "application/json")
+            write_status(w, lora_module)
+            w.finish()
+            return
+        
+        elif path == "/api/tags":
+            w.begin(client, "200 OK", "application/json")
+            write_tags(w)
+            w.finish()
             return
         
         # API: Price info
         elif path == "/api/price":
             if method == "GET":
-                response_json = json.dumps(price_data)
-                send_http_response(client, "200 OK", "application/json", response_json)
+                device_id = _query_param(query, "id")
+                data = tag_data(device_id or last_device_id)
+                if data is None and device_id is None:
+                    # ценников еще нет - отвечаем данными шлюза (проверка связи из веб-приложения)
+                    data = {"device_id": DEVICE_ID, "tags": 0}
+                    data.update(gateway_state)
+                if data is None:
+                    send_json_response(client, "404 Not Found", {"error": "Unknown device_id"})
+                else:
+                    send_json_response(client, "200 OK", data)
                 return
             
             elif method in ["POST", "PUT"]:
                 if not body:
-                    send_http_response(client, "400 Bad Request", "application/json", 
-                                      json.dumps({"error": "No data provided"}))
+                    send_json_response(client, "400 Bad Request", {"error": "No data provided"})
                     return
                 
                 try:
@@ -327,44 +1046,111 @@ def handle_request(client, request, lora_module):
                     print(f"[HTTP] Received data: {list(data.keys())}")
                     
                     # Обновляем данные
-                    is_updated = update_price_data(data)
+                    device_id = str(data.get("device_id", DEVICE_ID))
+                    is_updated = update_price_data(device_id, data)
                     
-                    # Пробуем отправить по LoRa
+                    # Пробуем отправить по LoRa (повтор того же содержимого не отправляется, кроме force=1)
                     lora_sent = False
-                    if is_updated and lora_module:
+                    suppressed = False
+                    seq = None
+                    if lora_module and device_id in tag_table:
                         print("[LORA] Trying to forward updated data...")
-                        lora_sent = send_lora_message(lora_module, data)
+                        seq, lora_sent, suppressed = forward_tag(lora_module, device_id, force)
                     
                     # Формируем ответ
-                    response_data = {
-                        "success": True,
-                        "device_id": DEVICE_ID,
-                        "message": "Data updated and forwarded via LoRa" if lora_sent else "Data updated",
-                        "updated": is_updated,
-                        "lora_forwarded": lora_sent,
-                        "received_data": data,
-                        "current_data": price_data,
-                        "battery": price_data["battery"],
-                        "timestamp": time.time()
-                    }
-                    
-                    response_json = json.dumps(response_data)
-                    send_http_response(client, "200 OK", "application/json", response_json)
+                    w.begin(client, "200 OK", "application/json")
+                    write_price_update(w, data, is_updated, lora_sent, suppressed, seq,
+                                       device_id, compact)
+                    w.finish()
                     return
                     
-                except json.JSONDecodeError as e:
+                except ValueError as e:
+                    # ошибка разбора JSON (в MicroPython нет json.JSONDecodeError)
                     error_msg = f"Invalid JSON: {str(e)}"
                     print(f"[HTTP] JSON error: {error_msg}")
-                    send_http_response(client, "400 Bad Request", "application/json",
-                                      json.dumps({"error": error_msg}))
+                    send_json_response(client, "400 Bad Request", {"error": error_msg})
                     return
                 except Exception as e:
                     error_msg = f"Server error: {str(e)}"
                     print(f"[HTTP] Error: {error_msg}")
-                    send_http_response(client, "500 Internal Server Error", "application/json",
-                                      json.dumps({"error": error_msg}))
+                    send_json_response(client, "500 Internal Server Error", {"error": error_msg})
                     return
         
+        # API: макет ценника, пересылается по LoRa как есть
+        elif path == "/api/layout":
+            if method not in ["POST", "PUT"]:
+                send_json_response(client, "405 Method Not Allowed", {"error": "Use POST"})
+                return
+            device_id = _query_param(query, "id")
+            if not device_id or not body:
+                send_json_response(client, "400 Bad Request", {"error": "id and layout required"})
+                return
+            try:
+                spec = json.loads(body)
+            except ValueError as e:
+                send_json_response(client, "400 Bad Request", {"error": f"Invalid JSON: {e}"})
+                return
+            if isinstance(spec, dict) and "layout" in spec:
+                spec = spec["layout"]
+            if not isinstance(spec, dict) or "fields" not in spec:
+                send_json_response(client, "400 Bad Request", {"error": "Layout must have fields"})
+                return
+            
+            size = len(tag_codec.encode_layout(device_id, spec, 65535))
+            if size > LAYOUT_MAX_FRAME:
+                send_json_response(client, "413 Payload Too Large",
+                                   {"error": f"Layout frame {size} B > {LAYOUT_MAX_FRAME} B"})
+                return
+            if lora_module is None:
+                send_json_response(client, "503 Service Unavailable", {"error": "LoRa not ready"})
+                return
+            
+            seq, lora_sent = forward_layout(lora_module, device_id, spec)
+            send_json_response(client, "200 OK", {
+                "success": True,
+                "device_id": device_id,
+                "seq": seq,
+                "lora_sent": lora_sent,
+                "bytes": size
+            })
+            return
+        
+        elif path == "/api/bitmap":
+            if method not in ["POST", "PUT"]:
+                send_json_response(client, "405 Method Not Allowed", {"error": "Use POST"})
+                return
+            device_id = _query_param(query, "id")
+            if not device_id or not body:
+                send_json_response(client, "400 Bad Request", {"error": "id and image required"})
+                return
+            try:
+                update = json.loads(body)
+                data, base, img = str(update["data"]), int(update["base"]), int(update["img"])
+            except (ValueError, KeyError, TypeError) as e:
+                send_json_response(client, "400 Bad Request", {"error": f"Invalid image: {e}"})
+                return
+            
+            if not data or len(data) > BITMAP_PART_CHARS * BITMAP_MAX_PARTS:
+                send_json_response(client, "413 Payload Too Large",
+                                   {"error": f"Image {len(data)} chars > "
+                                             f"{BITMAP_PART_CHARS * BITMAP_MAX_PARTS}"})
+                return
+            if lora_module is None:
+                send_json_response(client, "503 Service Unavailable", {"error": "LoRa not ready"})
+                return
+            
+            seq, lora_sent, parts = forward_bitmap(lora_module, device_id, data, base, img)
+            send_json_response(client, "200 OK", {
+                "success": True,
+                "device_id": device_id,
+                "seq": seq,
+                "parts": parts,
+                "lora_sent": lora_sent,
+                "delivery": delivery[device_id]["state"],
+                "bytes": len(data)
+            })
+            return
+        
         else:
             send_http_response(client, "404 Not Found", "text/plain", "Not found")
             
@@ -381,60 +1167,37 @@ def start_web_server(ip, lora_module, port=80):
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind(addr)
     server.listen(5)
+    # короткий таймаут accept, чтобы между запросами принимать ACK и делать повторы
+    server.settimeout(0.2)
+    
+    reader = HttpRequestReader()
     
     print("[SERVER] Ready")
     print(f"[SERVER] API: http://{ip}/api/price")
     print(f"[SERVER] LoRa: {'ON' if lora_module else 'OFF'}")
     
     while True:
+        poll_lora(lora_module)
         try:
-            client, addr = server.accept()
+            try:
+                client, addr = server.accept()
+            except OSError:
+                # нет входящих соединений
+                continue
             print(f"\n[SERVER] Connection from: {addr[0]}")
             
             client.settimeout(10.0) 
             
             try:
-                # Читаем запрос
-                request = b""
-                while True:
-                    try:
-                        chunk = client.recv(1024)
-                        if not chunk:
-                            break
-                        request += chunk
-                        
-                        if b"\r\n\r\n" in request:
-                            try:
-                                request_str = request.decode("utf-8")
-                                headers_part = request_str.split("\r\n\r\n")[0]
-                                content_length = 0
-                                
-                                for line in headers_part.split("\r\n"):
-                                    if line.lower().startswith("content-length:"):
-                                        content_length = int(line.split(":", 1)[1].strip())
-                                        break
-                                
-                                if content_length > 0:
-                                    body_received = len(request) - len(headers_part) - 4
-                                    while body_received < content_length:
-                                        chunk = client.recv(1024)
-                                        if not chunk:
-                                            break
-                                        request += chunk
-                                        body_received += len(chunk)
-                            
-                            except:
-                                pass
-                            break
-                            
-                    except socket.timeout:
-                        break
-                    except Exception as e:
-                        print(f"[SERVER] Read error: {e}")
-                        break
-                
-                if request:
-                    handle_request(client, request, lora_module)
+                # Читаем запрос в заранее выделенный буфер
+                free_before = _mem_free()
+                error = reader.read(client)
+                if error:
+                    print(f"[SERVER] Bad request: {error}")
+                    send_http_response(client, error, "text/plain", error)
+                elif reader.length:
+                    handle_request(client, reader, lora_module)
+                record_heap_usage(free_before)
                 
             except Exception as e:
                 print(f"[SERVER] Client error: {e}")
@@ -462,6 +1225,9 @@ def main():
     print("Device ID:", DEVICE_ID)
     print("="*50)
     
+    # Таблица ценников из журнала на флеше
+    load_tag_table()
+    
     # Инициализация LoRa
     lora_module = init_lora()
     
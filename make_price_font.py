@@ -0,0 +1,145 @@
+"""
+Генератор price_font.py - крупные цифры цены для ценника (запускается на ПК)
+
+    pip install pillow
+    python make_price_font.py SourceCodePro-Bold.ttf --height 32
+
+Растеризует цифры, точку, минус и пробел из TTF, знак рубля
+рисуется отдельно (в моноширинных шрифтах его обычно нет). Глифы пишутся
+упакованными битмапами MONO_HLSB: бит 0 - краска, 1 - фон, чтобы на ценнике
+рисовать их blit'ом с key=1 и в черную, и в красную плоскость.
+"""
+
+import argparse
+
+from PIL import Image, ImageDraw, ImageFont
+
+CHARS = "0123456789.- "
+RUBLE = "₽"
+
+
+def find_font_size(path, cap_height):
+    # подбираем кегль, при котором высота цифр равна cap_height
+    size = cap_height
+    while True:
+        font = ImageFont.truetype(path, size)
+        bbox = font.getmask("0").getbbox()
+        if bbox[3] - bbox[1] >= cap_height:
+            return font
+        size += 1
+
+
+def render_char(font, char, height):
+    """Глиф в ячейке height пикселей, верх цифр на строке 0"""
+    digit_top = font.getbbox("0")[1]
+    image = Image.new("1", (font.size * 2, height), 0)
+    ImageDraw.Draw(image).text((0, -digit_top), char, font=font, fill=1)
+    return image
+
+
+def render_ruble(height, stroke):
+    cap_height = height
+    width = int(cap_height * 0.78)
+    image = Image.new("1", (width, height), 0)
+    draw = ImageDraw.Draw(image)
+    stem = stroke + 2
+    bowl_bottom = int(cap_height * 0.58)
+    # вертикаль
+    draw.rectangle((stem, 0, stem + stroke - 1, cap_height - 1), fill=1)
+    # чаша P: верхняя и нижняя перекладины и скругленная правая часть
+    radius = bowl_bottom // 2
+    right = width - 1
+    draw.rectangle((stem, 0, right - radius, stroke - 1), fill=1)
+    draw.rectangle((0, bowl_bottom - stroke, right - radius, bowl_bottom - 1), fill=1)
+    draw.pieslice((right - 2 * radius, 0, right, bowl_bottom - 1), 270, 90, fill=1)
+    draw.pieslice((right - 2 * radius + stroke, stroke, right - stroke, bowl_bottom - 1 - stroke),
+                  270, 90, fill=0)
+    # нижняя перекладина
+    bar = int(cap_height * 0.74)
+    draw.rectangle((0, bar, int(width * 0.7), bar + stroke - 1), fill=1)
+    return image
+
+
+def crop(image, left, right):
+    return image.crop((left, 0, right, image.height))
+
+
+def pack(image):
+    """MONO_HLSB, строки по (w + 7) // 8 байт, краска = 0"""
+    width, height = image.size
+    stride = (width + 7) // 8
+    data = bytearray(b"\xff" * stride * height)
+    pixels = image.load()
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y]:
+                data[y * stride + (x >> 3)] &= ~(0x80 >> (x & 7)) & 0xFF
+    return bytes(data)
+
+
+def build(path, cap_height):
+    font = find_font_size(path, cap_height)
+    spacing = max(2, cap_height // 12)
+
+    images = {char: render_char(font, char, cap_height * 2) for char in CHARS}
+    # ячейка по нижнему краю краски (у цифр без выносных элементов - базовая линия)
+    height = max(image.getbbox()[3] for image in images.values() if image.getbbox())
+    images = {char: image.crop((0, 0, image.width, height)) for char, image in images.items()}
+
+    # цифры моноширинные (цены в столбик выравниваются), остальное по контуру
+    digit_boxes = [images[d].getbbox() for d in "0123456789"]
+    left = min(box[0] for box in digit_boxes)
+    right = max(box[2] for box in digit_boxes)
+    glyphs = {}
+    for char, image in images.items():
+        if char.isdigit():
+            glyphs[char] = crop(image, left, right + spacing)
+        elif char == " ":
+            glyphs[char] = Image.new("1", ((right - left) // 2, height), 0)
+        else:
+            box = image.getbbox()
+            glyphs[char] = crop(image, box[0], box[2] + spacing)
+
+    one = images["1"].getbbox()
+    stroke = max(2, (one[2] - one[0]) // 4)
+    glyphs[RUBLE] = render_ruble(height, stroke)
+    return height, glyphs
+
+
+def write_module(filename, source, height, glyphs):
+    table = []
+    bitmaps = bytearray()
+    for char, image in glyphs.items():
+        table.append((char, len(bitmaps), image.width))
+        bitmaps += pack(image)
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(f'"""\nКрупный шрифт цены для ценника, сгенерирован make_price_font.py\n'
+                f'из {source}, не редактировать вручную\n\n'
+                f'Глиф - MONO_HLSB, строки по (width + 7) // 8 байт, бит 0 - краска.\n"""\n\n')
+        f.write(f"HEIGHT = {height}\n\n")
+        f.write("# символ -> (смещение в BITMAPS, ширина)\nGLYPHS = {\n")
+        for char, offset, width in table:
+            f.write(f"    {char!r}: ({offset}, {width}),\n")
+        f.write("}\n\nBITMAPS = (\n")
+        for pos in range(0, len(bitmaps), 32):
+            f.write(f"    {bytes(bitmaps[pos:pos + 32])!r}\n")
+        f.write(")\n")
+    return len(bitmaps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор price_font.py из TTF")
+    parser.add_argument("font", help="TTF с цифрами (лучше моноширинный, жирный)")
+    parser.add_argument("--height", type=int, default=32, help="высота цифр в пикселях")
+    parser.add_argument("--output", default="price_font.py")
+    args = parser.parse_args()
+
+    height, glyphs = build(args.font, args.height)
+    source = args.font.replace("\\", "/").rsplit("/", 1)[-1]
+    size = write_module(args.output, f"{source}, цифры {args.height} px", height, glyphs)
+    print(f"{args.output}: {len(glyphs)} glyphs, {height} px high, {size} bytes of bitmaps")
+
+
+if __name__ == "__main__":
+    main()
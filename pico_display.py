@@ -217,6 +217,20 @@ class EPD_2in13_B_V4_Landscape:
         self.buffer_red = bytearray(self.height * self.width // 8)
         self.imageblack = framebuf.FrameBuffer(self.buffer_balck, self.height, self.width, framebuf.MONO_VLSB)
         self.imagered = framebuf.FrameBuffer(self.buffer_red, self.height, self.width, framebuf.MONO_VLSB)
+        
+        # what the panel RAM holds now, for partial updates
+        self.shown_black = bytearray(len(self.buffer_balck))
+        self.shown_red = bytearray(len(self.buffer_red))
+        self.ram_valid = False
+        # B/W/R panel has no partial waveform: only the RAM write is partial,
+        # the refresh itself is always the full sequence
+        self.partial_waveform = False
+        self.last_update_stats = None
+        # one plane in panel RAM order, sent with a single spi.write
+        self.tx = bytearray(len(self.buffer_balck))
+        self.tx_view = memoryview(self.tx)
+        self.asleep = False
+        self.inits = 0
         self.init()
 
     def digital_write(self, pin, value):
@@ -269,9 +283,15 @@ class EPD_2in13_B_V4_Landscape:
         print('busy release')
         self.delay_ms(20)
         
-    def TurnOnDisplay(self):
+    def TurnOnDisplay(self, wait=True):
         self.send_command(0x20)  # Activate Display Update Sequence
-        self.ReadBusy()
+        # wait=False: return at once, BUSY stays high for the whole refresh
+        # (seconds on the B/W/R panel), the caller polls is_busy() or BUSY IRQ
+        if wait:
+            self.ReadBusy()
+
+    def is_busy(self):
+        return self.digital_read(self.busy_pin) == 1
 
     def SetWindows(self, Xstart, Ystart, Xend, Yend):
         self.send_command(0x44) # SET_RAM_X_ADDRESS_START_END_POSITION
@@ -323,38 +343,161 @@ class EPD_2in13_B_V4_Landscape:
         self.send_data(0x80)
 
         self.ReadBusy()
+        # deep sleep mode 1 keeps the RAM and SWRESET does not touch it:
+        # waking from sleep() the RAM still holds shown_black/shown_red.
+        # Only the first init after power-up (or an init without sleep,
+        # e.g. recovery from a stuck panel) starts from unknown RAM
+        if not self.asleep:
+            self.ram_valid = False
+        self.asleep = False
+        self.inits += 1
         
         return 0       
         
-    def display(self):
+    def wake(self):
+        """
+        Re-initialise only if sleep() was called since the last init().
+        The RAM survived the sleep, so display_partial() stays partial
+        """
+        if self.asleep:
+            self.init()
+
+    def display(self, wait=True):
+        self.wake()
+        start = utime.ticks_ms()
         self.send_command(0x24)
-        for j in range(int(self.width / 8) - 1, -1, -1):
-            for i in range(0, self.height):
-                self.send_data(self.buffer_balck[i + j * self.height])
+        self.send_plane(self.buffer_balck, 0, self.width // 8 - 1, 0, self.height - 1)
         
         self.send_command(0x26)
-        for j in range(int(self.width / 8) - 1, -1, -1):
-            for i in range(0, self.height):
-                self.send_data(self.buffer_red[i + j * self.height])
-
-        self.TurnOnDisplay()
+        self.send_plane(self.buffer_red, 0, self.width // 8 - 1, 0, self.height - 1)
+
+        self.TurnOnDisplay(wait)
+        self._shown(start, "full", 1, 2 * len(self.buffer_balck))
+
+    def _shown(self, start, mode, rects, data_bytes):
+        self.shown_black[:] = self.buffer_balck
+        self.shown_red[:] = self.buffer_red
+        self.ram_valid = True
+        self.last_update_stats = {
+            "mode": mode,
+            "rects": rects,
+            "bytes": data_bytes,
+            "pixels": data_bytes * 8,
+            "ms": utime.ticks_diff(utime.ticks_ms(), start),
+        }
+
+    def dirty_rects(self):
+        """
+        Changed areas as (page_start, page_end, x_start, x_end), inclusive.
+        A page is 8 framebuffer rows = one RAM X byte. Consecutive dirty pages
+        are merged into one rectangle spanning their x ranges.
+        """
+        rects = []
+        height = self.height
+        for j in range(self.width // 8):
+            a = j * height
+            b = a + height
+            black, red = self.buffer_balck, self.buffer_red
+            shown_black, shown_red = self.shown_black, self.shown_red
+            if black[a:b] == shown_black[a:b] and red[a:b] == shown_red[a:b]:
+                continue
+            x0 = 0
+            while black[a + x0] == shown_black[a + x0] and red[a + x0] == shown_red[a + x0]:
+                x0 += 1
+            x1 = height - 1
+            while black[a + x1] == shown_black[a + x1] and red[a + x1] == shown_red[a + x1]:
+                x1 -= 1
+            if rects and rects[-1][1] == j - 1:
+                last = rects[-1]
+                rects[-1] = (last[0], j, min(last[2], x0), max(last[3], x1))
+            else:
+                rects.append((j, j, x0, x1))
+        return rects
+
+    def send_plane(self, buf, j0, j1, x0, x1):
+        """
+        Send pages j1..j0, columns x0..x1 of a plane in one SPI transfer.
+        In landscape the RAM order is just the framebuffer pages reversed
+        (RAM X byte = last page first, framebuffer x = RAM Y), so each page
+        row is one slice copy into the preallocated tx buffer.
+        """
+        row = x1 - x0 + 1
+        tx = self.tx
+        pos = 0
+        for j in range(j1, j0 - 1, -1):
+            a = j * self.height + x0
+            tx[pos:pos + row] = buf[a:a + row]
+            pos += row
+        self.digital_write(self.dc_pin, 1)
+        self.digital_write(self.cs_pin, 0)
+        self.spi.write(self.tx_view[:pos])
+        self.digital_write(self.cs_pin, 1)
+        return pos
+
+    def _write_window(self, command, buf, rect):
+        j0, j1, x0, x1 = rect
+        pages = self.width // 8
+        # page j lives at RAM X byte (pages - 1 - j), framebuffer x at RAM Y
+        self.SetWindows((pages - 1 - j1) * 8, x0, (pages - 1 - j0) * 8, x1)
+        self.SetCursor(pages - 1 - j1, x0)
+        self.send_command(command)
+        return self.send_plane(buf, j0, j1, x0, x1)
+
+    def display_partial(self, wait=True):
+        """
+        Write only the changed RAM windows of both planes, then refresh.
+        Falls back to display() when the panel RAM content is not known.
+        Returns False when nothing changed (no refresh).
+        With wait=False returns as soon as the refresh is started: the
+        framebuffers are free to draw the next frame, the panel is not
+        until is_busy() drops.
+        """
+        self.wake()
+        if not self.ram_valid:
+            self.display(wait)
+            return True
+        start = utime.ticks_ms()
+        rects = self.dirty_rects()
+        if not rects:
+            return False
+        sent = 0
+        for rect in rects:
+            sent += self._write_window(0x24, self.buffer_balck, rect)
+            sent += self._write_window(0x26, self.buffer_red, rect)
+        # display() expects the full window with the counter at the origin
+        self.SetWindows(0, 0, self.width - 1, self.height - 1)
+        self.SetCursor(0, 0)
+        self.TurnOnDisplay(wait)
+        self._shown(start, "partial", len(rects), sent)
+        return True
 
     
     def Clear(self, colorblack, colorred):
+        self.wake()
+        # shadows double as the fill source instead of 4000-item lists
+        self.shown_black[:] = bytes((colorblack,)) * len(self.shown_black)
+        self.shown_red[:] = bytes((colorred,)) * len(self.shown_red)
+        
         self.send_command(0x24)
-        self.send_data1([colorblack] * self.height * int(self.width / 8))
+        self.send_data1(self.shown_black)
         
         self.send_command(0x26)
-        self.send_data1([colorred] * self.height * int(self.width / 8))
+        self.send_data1(self.shown_red)
                                 
         self.TurnOnDisplay()
+        self.ram_valid = True
 
-    def sleep(self):
+    def sleep(self, wait=True):
+        # deep sleep is only accepted with BUSY low (refresh finished)
         self.send_command(0x10) 
         self.send_data(0x01)
         
-        self.delay_ms(2000)
+        if wait:
+            self.delay_ms(2000)
         self.module_exit()
+        # the next display()/display_partial()/Clear() runs init() first;
+        # mode 1 retains RAM, ram_valid and the shadows stay as they are
+        self.asleep = True
         
 if __name__=='__main__':
     epd = EPD_2in13_B_V4_Portrait()
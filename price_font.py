@@ -0,0 +1,83 @@
+"""
+Крупный шрифт цены для ценника, сгенерирован make_price_font.py
+из SourceCodePro-Bold.ttf, цифры 32 px, не редактировать вручную
+
+Глиф - MONO_HLSB, строки по (width + 7) // 8 байт, бит 0 - краска.
+"""
+
+HEIGHT = 33
+
+# символ -> (смещение в BITMAPS, ширина)
+GLYPHS = {
+    '0': (0, 28),
+    '1': (132, 28),
+    '2': (264, 28),
+    '3': (396, 28),
+    '4': (528, 28),
+    '5': (660, 28),
+    '6': (792, 28),
+    '7': (924, 28),
+    '8': (1056, 28),
+    '9': (1188, 28),
+    '.': (1320, 14),
+    '-': (1386, 26),
+    ' ': (1518, 13),
+    '₽': (1584, 25),
+}
+
+BITMAPS = (
+    b'\xff\x80\x7f\xff\xfe\x00\x1f\xff\xfc\x00\x0f\xff\xf8\x00\x07\xff\xf0\x00\x03\xff\xe0\x00\x01\xff\xe0\x1e\x01\xff\xc0\x7f\x00\xff'
+    b'\xc0\x7f\x80\xff\xc0\xff\xc0\xff\x80\xff\xc0\x7f\x80\xff\xc0\x7f\x80\xe1\xc0\x7f\x81\xc0\xc0\x7f\x81\x80`\x7f\x81\x80`\x7f'
+    b'\x81\x80`\x7f\x81\x80`\x7f\x81\xc0\xe0\x7f\x81\xe1\xc0\x7f\x80\xff\xc0\x7f\x80\xff\xc0\x7f\x80\xff\xc0\x7f\xc0\xff\xc0\xff'
+    b'\xc0\x7f\x80\xff\xc0?\x00\xff\xe0\x1e\x01\xff\xe0\x00\x01\xff\xf0\x00\x03\xff\xf8\x00\x07\xff\xfc\x00\x0f\xff\xfe\x00\x1f\xff'
+    b'\xff\x80\xff\xff\xff\xe0?\xff\xff\x00?\xff\xf0\x00?\xff\xf0\x00?\xff\xf0\x00?\xff\xf0\x00?\xff\xf0\x00?\xff'
+    b'\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff'
+    b'\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff'
+    b'\xff\xc0?\xff\xff\xc0?\xff\xff\xc0?\xff\xc0\x00\x00\x7f\xc0\x00\x00\x7f\xc0\x00\x00\x7f\xc0\x00\x00\x7f\xc0\x00\x00\x7f'
+    b'\xc0\x00\x00\x7f\xff\xff\xff\xff\xff\x00\xff\xff\xf8\x00?\xff\xf0\x00\x0f\xff\xc0\x00\x07\xff\x80\x00\x07\xff\x80\x00\x03\xff'
+    b'\xc0\xfc\x01\xff\xe1\xfe\x01\xff\xf7\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xfe\x03\xff'
+    b'\xff\xfe\x03\xff\xff\xfc\x07\xff\xff\xf8\x07\xff\xff\xf0\x0f\xff\xff\xf0\x1f\xff\xff\xe0\x1f\xff\xff\x80?\xff\xff\x00\x7f\xff'
+    b'\xfe\x00\xff\xff\xfc\x01\xff\xff\xf8\x03\xff\xff\xf0\x07\xff\xff\xe0\x00\x00\x7f\x80\x00\x00\x7f\x80\x00\x00\x7f\x80\x00\x00\x7f'
+    b'\x80\x00\x00\x7f\x80\x00\x00\x7f\xff\xff\xff\xff\xff\x00\xff\xff\xf8\x00\x1f\xff\xe0\x00\x07\xff\xc0\x00\x03\xff\x80\x00\x03\xff'
+    b'\xc0\x00\x01\xff\xe0|\x01\xff\xf1\xff\x01\xff\xf7\xff\x00\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xfe\x01\xff\xff\xf8\x03\xff'
+    b'\xff\x00\x07\xff\xff\x00\x0f\xff\xff\x00?\xff\xff\x00\x1f\xff\xff\x00\x07\xff\xff\x00\x03\xff\xff\xf8\x01\xff\xff\xff\x00\xff'
+    b'\xff\xff\x80\xff\xff\xff\x80\xff\xff\xff\x80\x7f\xef\xff\x80\xff\xc3\xff\x00\xff\xc0\xfe\x00\xff\x80\x00\x00\xff\x00\x00\x01\xff'
+    b'\x80\x00\x03\xff\xc0\x00\x07\xff\xf0\x00\x1f\xff\xfe\x00\xff\xff\xff\xf8\x03\xff\xff\xf0\x03\xff\xff\xe0\x03\xff\xff\xe0\x03\xff'
+    b'\xff\xc0\x03\xff\xff\x80\x03\xff\xff\x80\x03\xff\xff\x02\x03\xff\xfe\x02\x03\xff\xfe\x06\x03\xff\xfc\x0e\x03\xff\xf8\x0e\x03\xff'
+    b'\xf8\x1e\x03\xff\xf0>\x03\xff\xe0>\x03\xff\xc0~\x03\xff\xc0~\x03\xff\x80\xfe\x03\xff\x01\xfe\x03\xff\x00\x00\x00?'
+    b'\x00\x00\x00?\x00\x00\x00?\x00\x00\x00?\x00\x00\x00?\x00\x00\x00?\xff\xfe\x03\xff\xff\xfe\x03\xff\xff\xfe\x03\xff'
+    b'\xff\xfe\x03\xff\xff\xfe\x03\xff\xff\xfe\x03\xff\xff\xfe\x03\xff\xff\xff\xff\xff\xf0\x00\x01\xff\xf0\x00\x01\xff\xf0\x00\x01\xff'
+    b'\xf0\x00\x01\xff\xe0\x00\x01\xff\xe0\x00\x01\xff\xe0?\xff\xff\xe0?\xff\xff\xe0?\xff\xff\xe0?\xff\xff\xe0?\xff\xff'
+    b'\xe0 \x7f\xff\xe0\x00\x0f\xff\xe0\x00\x07\xff\xe0\x00\x03\xff\xe0\x00\x01\xff\xe0\x00\x00\xff\xf8\xfc\x00\xff\xfb\xff\x00\xff'
+    b'\xff\xff\x80\xff\xff\xff\x80\x7f\xff\xff\x80\x7f\xff\xff\x80\x7f\xff\xff\x80\xff\xef\xff\x80\xff\xc3\xff\x00\xff\xc0\xfc\x01\xff'
+    b'\x80\x00\x01\xff\x00\x00\x03\xff\x80\x00\x07\xff\xe0\x00\x0f\xff\xf8\x00?\xff\xfe\x00\xff\xff\xff\xe0\x1f\xff\xff\x80\x07\xff'
+    b'\xfe\x00\x01\xff\xfc\x00\x00\xff\xf8\x00\x00\x7f\xf0\x00\x01\xff\xf0\x07\xc3\xff\xe0\x1f\xf3\xff\xe0?\xff\xff\xc0\x7f\xff\xff'
+    b'\xc0\x7f\xff\xff\xc0\xff\xff\xff\x80\xf8\x1f\xff\x80\xe0\x07\xff\x80\x80\x03\xff\x80\x00\x01\xff\x80\x00\x00\xff\x80\x00\x00\xff'
+    b'\x80\x1f\x00\x7f\x80?\xc0\x7f\x80\xff\xc0\x7f\x80\xff\xc0\x7f\x80\xff\xe0\x7f\xc0\x7f\xc0\x7f\xc0\x7f\xc0\x7f\xc0?\x80\x7f'
+    b'\xe0\x1f\x00\xff\xf0\x00\x00\xff\xf0\x00\x01\xff\xf8\x00\x03\xff\xfc\x00\x07\xff\xff\x00\x0f\xff\xff\xc0\x7f\xff\x80\x00\x00\x7f'
+    b'\x80\x00\x00\x7f\x80\x00\x00\x7f\x80\x00\x00\x7f\x80\x00\x00\x7f\x80\x00\x00\xff\xff\xff\x81\xff\xff\xff\x03\xff\xff\xfe\x03\xff'
+    b'\xff\xfc\x07\xff\xff\xfc\x0f\xff\xff\xf8\x0f\xff\xff\xf8\x1f\xff\xff\xf0\x1f\xff\xff\xf0?\xff\xff\xe0?\xff\xff\xe0\x7f\xff'
+    b'\xff\xc0\x7f\xff\xff\xc0\x7f\xff\xff\xc0\xff\xff\xff\x80\xff\xff\xff\x80\xff\xff\xff\x80\xff\xff\xff\x80\xff\xff\xff\x00\xff\xff'
+    b'\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\x01\xff\xff\xff\xff\xff\xff'
+    b'\xff\x80\x7f\xff\xfe\x00\x0f\xff\xf8\x00\x07\xff\xf0\x00\x03\xff\xe0\x00\x01\xff\xe0\x00\x01\xff\xe0?\x01\xff\xc0\x7f\x80\xff'
+    b'\xc0\x7f\x80\xff\xc0\x7f\xc0\xff\xe0\x7f\x81\xff\xe0\x1f\x81\xff\xf0\x03\x03\xff\xf0\x00\x07\xff\xf8\x00\x0f\xff\xfe\x00\x0f\xff'
+    b'\xfc\x00\x07\xff\xf8\x00\x03\xff\xe00\x01\xff\xe0~\x00\xff\xc0\xff\x00\xff\x80\xff\xc0\x7f\x81\xff\xc0\x7f\x81\xff\xc0\x7f'
+    b'\x80\xff\xc0\x7f\x80\x7f\x80\x7f\x80?\x00\x7f\xc0\x00\x00\xff\xc0\x00\x00\xff\xe0\x00\x01\xff\xf0\x00\x03\xff\xfc\x00\x0f\xff'
+    b'\xff\x00\x7f\xff\xff\x00\xff\xff\xfc\x00?\xff\xf0\x00\x0f\xff\xe0\x00\x07\xff\xe0\x00\x03\xff\xc0\x00\x03\xff\x80<\x01\xff'
+    b'\x80\xff\x01\xff\x80\xff\x80\xff\x81\xff\x80\xff\x81\xff\xc0\xff\x80\xff\xc0\x7f\x80\xff\x80\x7f\x80~\x00\x7f\x80\x00\x00\x7f'
+    b'\xc0\x00\x00\x7f\xc0\x00\x00\x7f\xe0\x00\x00\x7f\xf8\x00\xc0\x7f\xfe\x07\xc0\x7f\xff\xff\xc0\xff\xff\xff\x80\xff\xff\xff\x80\xff'
+    b'\xff\xff\x80\xff\xff\xff\x01\xff\xf3\xfe\x01\xff\xe0\xf8\x03\xff\xe0\x00\x03\xff\xc0\x00\x07\xff\x80\x00\x0f\xff\xe0\x00\x1f\xff'
+    b'\xf8\x00\x7f\xff\xfe\x01\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
+    b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xf0\xff\xc0?\x80\x1f\x80\x1f\x00\x0f\x00\x0f\x00\x0f'
+    b'\x00\x0f\x80\x1f\x80\x1f\xc0?\xe0\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
+    b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00\x00\x00\xff\x00\x00'
+    b'\x00\xff\x00\x00\x00\xff\x00\x00\x00\xff\x00\x00\x00\xff\x00\x00\x00\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
+    b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
+    b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
+    b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff'
+    b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xfe\x00?\xff\xfe\x00\x0f\xff\xfe\x00\x03\xff\xfe\x00\x01\xff'
+    b'\xfe\x00\x01\xff\xfe\x0f\x80\xff\xfe\x0f\xe0\xff\xfe\x0f\xe0\x7f\xfe\x0f\xf0\x7f\xfe\x0f\xf0\x7f\xfe\x0f\xf0\x7f\xfe\x0f\xe0\x7f'
+    b'\xfe\x0f\xe0\xff\xfe\x0f\x80\xff\x00\x00\x01\xff\x00\x00\x01\xff\x00\x00\x03\xff\x00\x00\x0f\xff\x00\x00?\xff\xfe\x0f\xff\xff'
+    b'\xfe\x0f\xff\xff\xfe\x0f\xff\xff\xfe\x0f\xff\xff\xfe\x0f\xff\xff\x00\x00?\xff\x00\x00?\xff\x00\x00?\xff\x00\x00?\xff'
+    b'\x00\x00?\xff\xfe\x0f\xff\xff\xfe\x0f\xff\xff\xfe\x0f\xff\xff\xfe\x0f\xff\xff'
+)
@@ -0,0 +1,202 @@
+"""
+Загрузка прайс-листа (выгрузка из учетной системы) в ценники
+
+Файл читается построчно, целиком в памяти не держится: CSV с заголовком
+(разделитель , или ;) или NDJSON (один JSON-объект на строку). Колонки:
+    tag_id (id)              - номер ценника
+    name (product_name)      - название
+    current_price (price)    - цена
+    weight                   - вес
+Кроме tag_id все необязательны: чего нет в строке (или ячейка пустая), то у
+ценника не меняется.
+
+Каждая строка сравнивается с ценником, на шлюз отправляются только ценники,
+у которых поменялось то, что видно на экране (название, цена, вес).
+
+Из командной строки - отправка файла на сервер потоком:
+    python price_import.py prices.csv --server http://localhost:5000
+"""
+
+import argparse
+import csv
+import json
+import time
+
+FIELDS = {
+    'tag_id': 'tag_id', 'id': 'tag_id',
+    'name': 'name', 'product_name': 'name',
+    'current_price': 'current_price', 'price': 'current_price',
+    'weight': 'weight',
+}
+
+MAX_ERRORS = 20     # сообщений об ошибках в итоге, дальше только счетчик
+
+
+def _number(value):
+    # в выгрузках с ; дробная часть обычно через запятую
+    return float(str(value).strip().replace(',', '.'))
+
+
+def _text_lines(stream):
+    # stream - файл или request.stream в байтах; BOM из Excel убирается
+    first = True
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+
+def _csv_rows(lines):
+    header = next(lines, None)
+    if header is None:
+        return
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    columns = [FIELDS.get(name.strip().lower()) for name in next(csv.reader([header], delimiter=delimiter))]
+    if 'tag_id' not in columns:
+        raise ValueError('В заголовке нет колонки tag_id')
+    for values in csv.reader(lines, delimiter=delimiter):
+        if not values:
+            continue
+        yield {column: value for column, value in zip(columns, values) if column}
+
+
+def _ndjson_rows(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            # битую строку посчитает import_rows
+            yield None
+            continue
+        if not isinstance(data, dict):
+            yield None
+            continue
+        yield {FIELDS[key]: value for key, value in data.items() if key in FIELDS}
+
+
+def iter_rows(stream, fmt='csv'):
+    """Строки файла как словари {tag_id, name, current_price, weight} (None - битая строка)"""
+    lines = _text_lines(stream)
+    if fmt == 'ndjson':
+        return _ndjson_rows(lines)
+    return _csv_rows(lines)
+
+
+def detect_format(content_type='', filename=''):
+    if 'ndjson' in content_type or 'json' in content_type or filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def _changes(tag, row):
+    """Новые значения отображаемых полей, которые отличаются от текущих"""
+    changes = {}
+    # пустая ячейка - как и у цены с весом: название не меняется
+    name = str(row['name']).strip() if row.get('name') is not None else ''
+    if name and name != tag['name']:
+        changes['name'] = name
+    for field in ('current_price', 'weight'):
+        if row.get(field) is not None and str(row[field]).strip() != '':
+            value = _number(row[field])
+            if value != tag[field]:
+                changes[field] = value
+    return changes
+
+
+def import_rows(rows, tags, push, apply=True):
+    """
+    Сравнение строк с ценниками tags (список словарей, как store.tags() в app.py).
+    Изменившиеся ценники обновляются и передаются в push(tag) - один раз,
+    даже если ценник встретился в файле несколько раз.
+    apply=False - только подсчет, ценники не меняются.
+    Возвращает итог: сколько строк без изменений, с изменениями, с неизвестным
+    ценником, с ошибками, и скорость разбора
+    """
+    index = {tag['id']: tag for tag in tags}
+    changed = {}    # id -> tag, в порядке первого изменения
+    summary = {'rows': 0, 'unchanged': 0, 'updated': 0, 'unknown': 0, 'errors': 0,
+               'messages': []}
+    start = time.perf_counter()
+
+    for number, row in enumerate(rows, start=1):
+        summary['rows'] += 1
+        try:
+            if row is None:
+                raise ValueError('не разобрать строку')
+            tag = index.get(int(row.get('tag_id')))
+            if tag is None:
+                summary['unknown'] += 1
+                continue
+            changes = _changes(tag, row)
+        except (ValueError, TypeError) as e:
+            summary['errors'] += 1
+            if len(summary['messages']) < MAX_ERRORS:
+                summary['messages'].append(f'запись {number}: {e}')
+            continue
+
+        if not changes:
+            summary['unchanged'] += 1
+            continue
+        summary['updated'] += 1
+        if apply:
+            tag.update(changes)
+            changed[tag['id']] = tag
+
+    for tag in changed.values():
+        push(tag)
+
+    elapsed = time.perf_counter() - start
+    summary['pushed'] = len(changed)
+    summary['seconds'] = round(elapsed, 3)
+    summary['rows_per_s'] = round(summary['rows'] / elapsed) if elapsed > 0 else 0
+    return summary
+
+
+def main():
+    import requests
+
+    parser = argparse.ArgumentParser(description='Загрузка прайс-листа в ценники')
+    parser.add_argument('file', help='CSV или NDJSON (.ndjson / .jsonl)')
+    parser.add_argument('--server', default='http://localhost:5000')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--format', choices=['csv', 'ndjson'])
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать изменения')
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(filename=args.file)
+    session = requests.Session()
+    session.post(f'{args.server}/login', data={'username': args.user, 'password': args.password})
+
+    start = time.perf_counter()
+    with open(args.file, 'rb') as f:
+        # файл-объект requests отправляет частями, не читая целиком
+        response = session.post(f'{args.server}/api/import',
+                                params={'format': fmt, 'dry_run': int(args.dry_run)},
+                                data=f,
+                                headers={'Content-Type': 'application/x-ndjson' if fmt == 'ndjson'
+                                         else 'text/csv'})
+    elapsed = time.perf_counter() - start
+
+    if response.status_code != 200:
+        print(f'Ошибка {response.status_code}: {response.text[:200]}')
+        return 1
+    summary = response.json()
+    print(f"Строк: {summary['rows']}, без изменений: {summary['unchanged']}, "
+          f"изменено: {summary['updated']}, неизвестных ценников: {summary['unknown']}, "
+          f"ошибок: {summary['errors']}")
+    print(f"Отправка на шлюзы: {summary['pushed']} ценников")
+    print(f"Разбор на сервере: {summary['rows_per_s']} строк/с, всего {elapsed:.1f} с")
+    for message in summary['messages']:
+        print(f'  {message}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
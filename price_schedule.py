@@ -0,0 +1,218 @@
+"""
+Отложенные изменения цен: пакет изменений с временем вступления в силу (at)
+
+Таймеры - колесо (TimerWheel): слот на каждый тик, добавление и срабатывание
+за O(1), тысячи отложенных пакетов не нагружают поток планировщика.
+
+Пакет проходит этапы:
+    waiting  - ждет at - PRESTAGE_S
+    staged   - данные для шлюзов готовы заранее (цена или отрисованное
+               изображение на каждый ценник) и разложены по шлюзам
+    sending  - в at шлюзы получают свои ценники параллельно, один шлюз -
+               по очереди с шагом GATEWAY_SPACING_S (шлюз однопоточный,
+               между запросами он принимает ACK по LoRa)
+    done     - все отправлено
+lag ценника - сколько прошло от at до конца его отправки на шлюз.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+TICK_S = 0.1            # точность срабатывания
+WHEEL_SLOTS = 600       # оборот колеса - минута, дальше таймер ждет оборотов
+PRESTAGE_S = 60         # подготовка данных заранее
+GATEWAY_SPACING_S = 0.05
+
+
+class TimerWheel:
+    """Хешированное колесо таймеров: слот = номер тика по модулю числа слотов"""
+
+    def __init__(self, now, tick=TICK_S, slots=WHEEL_SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int(now / tick)
+        self.count = 0
+
+    def add(self, when, item):
+        # срабатывает не раньше when; прошедшее время - на следующем тике
+        tick = max(-int(-when // self.tick), self.current + 1)
+        self.slots[tick % len(self.slots)].append((tick, item))
+        self.count += 1
+
+    def advance(self, now):
+        """Таймеры, время которых наступило, в порядке срабатывания"""
+        target = int(now / self.tick)
+        if target - self.current > len(self.slots):
+            # долгая пауза (сон машины): хватит одного прохода по всем слотам
+            due = []
+            for slot in self.slots:
+                due.extend(entry for entry in slot if entry[0] <= target)
+                slot[:] = [entry for entry in slot if entry[0] > target]
+            self.current = target
+            due.sort(key=lambda entry: entry[0])
+        else:
+            due = []
+            while self.current < target:
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                if slot:
+                    due.extend(entry for entry in slot if entry[0] <= self.current)
+                    slot[:] = [entry for entry in slot if entry[0] > self.current]
+        self.count -= len(due)
+        return [item for _, item in due]
+
+
+class Scheduler:
+    """
+    stage(tag_id, changes) -> (шлюз, payload) или None, если ценника нет;
+    send(payload) -> True / False - отправка в момент at;
+    claim(batch_id) -> True, если пакет отправляет этот планировщик (отметка
+    в общей базе), False - пакет отменен или его уже отправил другой процесс.
+    background=False - без своего потока, таймеры проверяет run_due()
+    """
+
+    def __init__(self, stage, send, prestage=PRESTAGE_S, spacing=GATEWAY_SPACING_S,
+                 clock=time.time, background=True, claim=None):
+        self.stage = stage
+        self.send = send
+        self.claim = claim
+        self.prestage = prestage
+        self.spacing = spacing
+        self.clock = clock
+        self.wheel = TimerWheel(clock())
+        self.batches = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.background = background
+        self.thread = None
+
+    def schedule(self, at, changes, batch_id=None):
+        """
+        changes - [(tag_id, {поле: значение})], at - time.time() вступления в силу;
+        batch_id - номер пакета, если его выдали раньше (пакет из базы)
+        """
+        with self.lock:
+            if batch_id is None:
+                batch_id = self.next_id
+            batch = {
+                'id': batch_id, 'at': at, 'changes': changes, 'state': 'waiting',
+                'gateways': None, 'gateway_count': 0, 'missing': 0,
+                'started': None, 'pending': 0, 'sent': 0, 'failed': 0, 'lag': [],
+            }
+            self.next_id = max(self.next_id, batch_id + 1)
+            self.batches[batch['id']] = batch
+            self.wheel.add(at - self.prestage, ('stage', batch['id']))
+            self.wheel.add(at, ('fire', batch['id']))
+            if self.background and self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return batch
+
+    def cancel(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None or batch['state'] not in ('waiting', 'staged'):
+                return False
+            # таймеры останутся в колесе и сработают вхолостую
+            batch['state'] = 'cancelled'
+            batch['gateways'] = None
+            return True
+
+    def run(self):
+        while True:
+            self.run_due(self.clock())
+            time.sleep(self.wheel.tick / 2)
+
+    def run_due(self, now):
+        with self.lock:
+            due = self.wheel.advance(now)
+        for action, batch_id in due:
+            batch = self.batches.get(batch_id)
+            if batch is None or batch['state'] == 'cancelled':
+                continue
+            if action == 'fire' and not self._claim(batch, now):
+                continue
+            if action == 'stage' or batch['gateways'] is None:
+                self._stage(batch)
+            if action == 'fire':
+                self._fire(batch)
+
+    def _claim(self, batch, now):
+        if self.claim is None:
+            return True
+        try:
+            claimed = self.claim(batch['id'])
+        except Exception as e:
+            print(f"Отложенная отправка {batch['id']}: {e}")
+            # отметку не поставить - повтор на следующем тике
+            with self.lock:
+                self.wheel.add(now, ('fire', batch['id']))
+            return False
+        if not claimed:
+            # ведущий процесс сменился, и старый уже отправил пакет (или пакет отменили)
+            with self.lock:
+                self.batches.pop(batch['id'], None)
+        return claimed
+
+    def _stage(self, batch):
+        gateways = OrderedDict()
+        missing = 0
+        for tag_id, changes in batch['changes']:
+            staged = self.stage(tag_id, changes)
+            if staged is None:
+                missing += 1
+                continue
+            gateway, payload = staged
+            gateways.setdefault(gateway, []).append(payload)
+        batch['gateways'] = gateways
+        batch['gateway_count'] = len(gateways)
+        batch['missing'] = missing
+        batch['state'] = 'staged'
+
+    def _fire(self, batch):
+        batch['state'] = 'sending'
+        batch['started'] = self.clock()
+        batch['pending'] = len(batch['gateways'])
+        if not batch['gateways']:
+            batch['state'] = 'done'
+        for payloads in batch['gateways'].values():
+            threading.Thread(target=self._send_gateway, args=(batch, payloads), daemon=True).start()
+
+    def _send_gateway(self, batch, payloads):
+        for i, payload in enumerate(payloads):
+            if i:
+                time.sleep(self.spacing)
+            try:
+                ok = self.send(payload)
+            except Exception as e:
+                print(f"Отложенная отправка: {e}")
+                ok = False
+            lag = self.clock() - batch['at']
+            with self.lock:
+                batch['lag'].append(lag)
+                batch['sent' if ok else 'failed'] += 1
+        with self.lock:
+            batch['pending'] -= 1
+            if batch['pending'] == 0:
+                # payload (изображения) больше не нужны
+                batch['state'] = 'done'
+                batch['gateways'] = {}
+
+    def report(self, batch):
+        """Состояние пакета и задержки от at: start - начало отправки, p50 / max - ее конец"""
+        with self.lock:
+            lag = sorted(batch['lag'])
+            return {
+                'id': batch['id'],
+                'at': batch['at'],
+                'state': batch['state'],
+                'tags': len(batch['changes']),
+                'gateways': batch['gateway_count'],
+                'sent': batch['sent'],
+                'failed': batch['failed'],
+                'missing': batch['missing'],
+                'start_lag_s': round(batch['started'] - batch['at'], 3) if batch['started'] else None,
+                'lag_p50_s': round(lag[len(lag) // 2], 3) if lag else None,
+                'lag_max_s': round(lag[-1], 3) if lag else None,
+            }
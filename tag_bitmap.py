@@ -0,0 +1,107 @@
+"""
+Готовое изображение ценника: обе плоскости буфера кадра EPD_2in13_B_V4_Landscape
+(черная, затем красная, по 4000 байт MONO_VLSB) одним потоком.
+
+Передается разностью с базовым кадром: XOR с ним и RLE результата.
+Неизменившиеся места дают длинные серии нулей, смена цены - десятки байт.
+base = 0 - базы нет (ключевой кадр), XOR с белым кадром (0xff).
+
+Поток RLE:
+    0x00-0x7F n         дальше n + 1 байт как есть
+    0x80-0xFF lo value  серия ((n & 0x7F) << 8 | lo) + 1 байт value
+
+Один и тот же модуль на сервере (encode) и на ценнике (apply).
+"""
+
+import binascii
+
+PLANE_SIZE = 4000
+IMAGE_SIZE = 2 * PLANE_SIZE
+
+MAX_LITERAL = 128
+MAX_RUN = 0x8000
+MIN_RUN = 4     # серия короче - дешевле оставить в литерале
+
+
+def digest(black, red):
+    """crc32 кадра, как framebuffer_digest() на ценнике"""
+    return binascii.crc32(red, binascii.crc32(black))
+
+
+def encode(image, base=None):
+    """Сжатая XOR-дельта image (IMAGE_SIZE байт) к base (None - к белому кадру)"""
+    if base is None:
+        delta = bytes(b ^ 0xff for b in image)
+    else:
+        delta = bytes(a ^ b for a, b in zip(image, base))
+
+    out = bytearray()
+    literal_start = 0
+    pos = 0
+    size = len(delta)
+    while pos < size:
+        value = delta[pos]
+        end = pos + 1
+        while end < size and end - pos < MAX_RUN and delta[end] == value:
+            end += 1
+        if end - pos >= MIN_RUN:
+            _literal(out, delta, literal_start, pos)
+            count = end - pos - 1
+            out += bytes((0x80 | count >> 8, count & 0xFF, value))
+            literal_start = end
+        pos = end
+    _literal(out, delta, literal_start, size)
+    return bytes(out)
+
+
+def _literal(out, data, start, end):
+    while start < end:
+        count = min(MAX_LITERAL, end - start)
+        out.append(count - 1)
+        out += data[start:start + count]
+        start += count
+
+
+def apply(black, red, data):
+    """
+    XOR-дельта из encode() в буферы кадра на месте.
+    False - поток битый или не на весь кадр (буферы тогда испорчены)
+    """
+    size = len(black)
+    total = size + len(red)
+    pos = 0
+    i = 0
+    n = len(data)
+    while i < n:
+        t = data[i]
+        i += 1
+        if t < 0x80:
+            count = t + 1
+            if i + count > n or pos + count > total:
+                return False
+            for k in range(count):
+                value = data[i + k]
+                if value:
+                    p = pos + k
+                    if p < size:
+                        black[p] ^= value
+                    else:
+                        red[p - size] ^= value
+            i += count
+        else:
+            if i + 2 > n:
+                return False
+            count = ((t & 0x7F) << 8 | data[i]) + 1
+            value = data[i + 1]
+            i += 2
+            if pos + count > total:
+                return False
+            # серия нулей (ничего не изменилось) - просто пропуск
+            if value:
+                for p in range(pos, pos + count):
+                    if p < size:
+                        black[p] ^= value
+                    else:
+                        red[p - size] ^= value
+        pos += count
+    return pos == total
@@ -0,0 +1,173 @@
+"""
+Формат данных ценников - один модуль для сервера (CPython), шлюза и ценника
+(MicroPython)
+
+HTTP сервер -> шлюз (/api/price): price_request() -
+    {"device_id", "product_name", "current_price", "weight"}
+
+LoRa шлюз <-> ценник: кадр всегда {...} (по скобкам его выделяют MessageBuffer
+ценника и прием ACK на шлюзе). Формат задает первый байт после "{", decode()
+выбирает разбор по нему, без попыток разобрать всеми способами подряд:
+
+    "   JSON-объект: товар {"name","weight","price","id","seq"},
+        макет {"layout",...}, часть изображения {"bmp",...}, ACK {"ack","id"}
+    P   товар компактно    {P<id>|<seq>|<weight>|<price>|<name>}
+    A   ACK компактно      {A<id>|<seq>}
+
+В компактных полях символы { } " | % записываются как %XX: скобки и кавычки
+в названии не ломают поиск границ кадра.
+"""
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+from collections import OrderedDict
+
+MARK_JSON = 0x22    # "
+MARK_PRICE = 0x50   # P
+MARK_ACK = 0x41     # A
+
+_ESCAPED = '%{}"|'
+
+
+try:
+    json.dumps("", ensure_ascii=False)
+
+    def _dumps(obj):
+        # CPython: UTF-8 как на MicroPython, а не \uXXXX
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+except TypeError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+
+def _escape(text):
+    for ch in _ESCAPED:
+        if ch in text:
+            # % первым, иначе заменились бы уже вставленные %XX
+            text = text.replace(ch, "%{:02X}".format(ord(ch)))
+    return text
+
+
+def _unescape(text):
+    if "%" not in text:
+        return text
+    parts = text.split("%")
+    out = [parts[0]]
+    for part in parts[1:]:
+        out.append(chr(int(part[:2], 16)))
+        out.append(part[2:])
+    return "".join(out)
+
+
+def price_request(device_id, product_name, current_price, weight):
+    """Тело POST /api/price шлюза"""
+    return {
+        "device_id": str(device_id),
+        "product_name": str(product_name),
+        "current_price": float(current_price),
+        "weight": float(weight),
+    }
+
+
+def encode_price(device_id, name, weight, price, seq=None, compact=True):
+    """
+    Кадр товара. seq=None - без подтверждения (и без id, как старые кадры).
+    compact=False - JSON для ценников со старой прошивкой.
+    Название уходит целиком: по нему ценник хранит товары (ProductStore),
+    до ширины экрана его обрезает макет при рисовании
+    """
+    name = str(name)
+    if compact:
+        return "{P%s|%s|%s|%s|%s}" % (_escape(str(device_id)) if seq is not None else "",
+                                      "" if seq is None else seq,
+                                      _escape(str(weight)), _escape(str(price)), _escape(name))
+    frame = OrderedDict([("name", name), ("weight", str(weight)), ("price", str(price))])
+    if seq is not None:
+        frame["id"] = str(device_id)
+        frame["seq"] = seq
+    return _dumps(frame)
+
+
+def encode_ack(device_id, seq, compact=False):
+    # по умолчанию JSON: его понимает и шлюз со старой прошивкой
+    if compact:
+        return "{A%s|%d}" % (_escape(str(device_id)), seq)
+    return _dumps(OrderedDict([("ack", seq), ("id", str(device_id))]))
+
+
+def encode_layout(device_id, spec, seq):
+    return _dumps(OrderedDict([("layout", spec), ("id", str(device_id)), ("seq", seq)]))
+
+
+def encode_bitmap_part(device_id, chunk, part, parts, base, img, seq):
+    return _dumps(OrderedDict([("bmp", chunk), ("part", part), ("parts", parts),
+                               ("base", base), ("img", img), ("id", str(device_id)),
+                               ("seq", seq)]))
+
+
+def decode(frame):
+    """
+    Кадр {...} (str или bytes) -> dict: товар {"name","weight","price"[,"id","seq"]},
+    ACK {"ack","id"}, макет {"layout",...} или часть изображения {"bmp",...}.
+    None - неизвестный маркер или битый кадр
+    """
+    try:
+        if not isinstance(frame, str):
+            frame = bytes(frame).decode("utf-8")
+        if len(frame) < 3 or frame[0] != "{" or frame[-1] != "}":
+            return None
+        mark = ord(frame[1])
+        if mark == MARK_JSON:
+            return _decode_json(frame)
+        if mark == MARK_PRICE:
+            return _decode_price(frame[2:-1])
+        if mark == MARK_ACK:
+            return _decode_ack(frame[2:-1])
+    except (ValueError, TypeError, IndexError, UnicodeError):
+        pass
+    return None
+
+
+def _decode_json(frame):
+    data = json.loads(frame)
+    if not isinstance(data, dict):
+        return None
+    if "name" in data and "weight" in data and "price" in data:
+        return data
+    if "ack" in data and "id" in data:
+        data["ack"] = int(data["ack"])
+        return data
+    if "layout" in data:
+        return data
+    if "bmp" in data:
+        return data if _valid_bitmap_part(data) else None
+    return None
+
+
+def _valid_bitmap_part(data):
+    # ключи и типы, которые использует ценник: кадр без них - битый, а не ошибка приема
+    for key in ("part", "parts", "base", "img"):
+        if not isinstance(data.get(key), int):
+            return False
+    return isinstance(data["bmp"], str) and 0 <= data["part"] < data["parts"]
+
+
+def _decode_price(body):
+    fields = body.split("|")
+    if len(fields) != 5:
+        return None
+    device_id, seq, weight, price, name = fields
+    data = {"name": _unescape(name), "weight": _unescape(weight), "price": _unescape(price)}
+    if seq:
+        data["id"] = _unescape(device_id)
+        data["seq"] = int(seq)
+    return data
+
+
+def _decode_ack(body):
+    fields = body.split("|")
+    if len(fields) != 2:
+        return None
+    return {"ack": int(fields[1]), "id": _unescape(fields[0])}
@@ -0,0 +1,241 @@
+"""
+framebuf.FrameBuffer для сервера (CPython): рисование ценника в те же буферы
+кадра, что на ценнике, без MicroPython (tag_layout.py берет его, если модуля
+framebuf нет, см. tag_render.py)
+
+Повторяет framebuf MicroPython попиксельно для того, что использует макет:
+форматы MONO_VLSB / MONO_HLSB, fill, pixel, fill_rect, hline, vline, rect,
+line, text, blit. Шрифт text() - встроенный шрифт ценника 8x8 (petme128,
+extmod/font_petme128_8x8.h MicroPython), снят с framebuf.text() MicroPython.
+Как на ценнике, строка рисуется по байтам UTF-8: символ вне 32..127 - по
+клетке 8x8 на каждый байт, глиф 127.
+"""
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+
+# столбцы глифов 32..127 по 8 байт, бит 0 - верхняя строка
+FONT = bytes.fromhex(
+    '0000000000000000'  # 32 ' '
+    '0000004f4f000000'  # 33 '!'
+    '0007070000070700'  # 34 '"'
+    '147f7f14147f7f14'  # 35 '#'
+    '00242e6b6b3a1200'  # 36 '$'
+    '006333180c666300'  # 37 '%'
+    '00327f4d4d777250'  # 38 '&'
+    '0000000406030100'  # 39 "'"
+    '00001c3e63410000'  # 40 '('
+    '000041633e1c0000'  # 41 ')'
+    '082a3e1c1c3e2a08'  # 42 '*'
+    '0008083e3e080800'  # 43 '+'
+    '000080e060000000'  # 44 ','
+    '0008080808080800'  # 45 '-'
+    '0000006060000000'  # 46 '.'
+    '00406030180c0602'  # 47 '/'
+    '003e7f49457f3e00'  # 48 '0'
+    '0040447f7f404000'  # 49 '1'
+    '00627351494f4600'  # 50 '2'
+    '00226349497f3600'  # 51 '3'
+    '00181814167f7f10'  # 52 '4'
+    '00276745457d3900'  # 53 '5'
+    '003e7f49497b3200'  # 54 '6'
+    '000303797d070300'  # 55 '7'
+    '00367f49497f3600'  # 56 '8'
+    '00266f49497f3e00'  # 57 '9'
+    '0000002424000000'  # 58 ':'
+    '000080e464000000'  # 59 ';'
+    '00081c3663414100'  # 60 '<'
+    '0014141414141400'  # 61 '='
+    '00414163361c0800'  # 62 '>'
+    '00020351590f0600'  # 63 '?'
+    '003e7f414d4f2e00'  # 64 '@'
+    '007c7e0b0b7e7c00'  # 65 'A'
+    '007f7f49497f3600'  # 66 'B'
+    '003e7f4141632200'  # 67 'C'
+    '007f7f41633e1c00'  # 68 'D'
+    '007f7f4949414100'  # 69 'E'
+    '007f7f0909010100'  # 70 'F'
+    '003e7f41497b3a00'  # 71 'G'
+    '007f7f08087f7f00'  # 72 'H'
+    '0000417f7f410000'  # 73 'I'
+    '002060417f3f0100'  # 74 'J'
+    '007f7f1c36634100'  # 75 'K'
+    '007f7f4040404000'  # 76 'L'
+    '007f7f060c067f7f'  # 77 'M'
+    '007f7f0e1c7f7f00'  # 78 'N'
+    '003e7f41417f3e00'  # 79 'O'
+    '007f7f09090f0600'  # 80 'P'
+    '001e3f21617f5e00'  # 81 'Q'
+    '007f7f19396f4600'  # 82 'R'
+    '00266f49497b3200'  # 83 'S'
+    '0001017f7f010100'  # 84 'T'
+    '003f7f40407f3f00'  # 85 'U'
+    '001f3f60603f1f00'  # 86 'V'
+    '007f7f3018307f7f'  # 87 'W'
+    '0063771c1c776300'  # 88 'X'
+    '00070f78780f0700'  # 89 'Y'
+    '006171594d474300'  # 90 'Z'
+    '00007f7f41410000'  # 91 '['
+    '0002060c18306040'  # 92 '\\'
+    '000041417f7f0000'  # 93 ']'
+    '00080c06060c0800'  # 94 '^'
+    'c0c0c0c0c0c0c0c0'  # 95 '_'
+    '0000010306040000'  # 96 '`'
+    '00207454547c7800'  # 97 'a'
+    '007f7f44447c3800'  # 98 'b'
+    '00387c44446c2800'  # 99 'c'
+    '00387c44447f7f00'  # 100 'd'
+    '00387c54545c5800'  # 101 'e'
+    '00087e7f09030200'  # 102 'f'
+    '0098bca4a4fc7c00'  # 103 'g'
+    '007f7f04047c7800'  # 104 'h'
+    '0000007d7d000000'  # 105 'i'
+    '0040c08080fd7d00'  # 106 'j'
+    '007f7f30386c4400'  # 107 'k'
+    '0000417f7f400000'  # 108 'l'
+    '007c7c1830187c7c'  # 109 'm'
+    '007c7c04047c7800'  # 110 'n'
+    '00387c44447c3800'  # 111 'o'
+    '00fcfc24243c1800'  # 112 'p'
+    '00183c2424fcfc00'  # 113 'q'
+    '007c7c04040c0800'  # 114 'r'
+    '00485c5454742000'  # 115 's'
+    '04043f7f44642000'  # 116 't'
+    '003c7c40407c3c00'  # 117 'u'
+    '001c3c60603c1c00'  # 118 'v'
+    '001c7c3018307c1c'  # 119 'w'
+    '00446c38386c4400'  # 120 'x'
+    '009cbca0a0fc7c00'  # 121 'y'
+    '004464745c4c4400'  # 122 'z'
+    '0008083e77414100'  # 123 '{'
+    '000000ffff000000'  # 124 '|'
+    '004141773e080800'  # 125 '}'
+    '0002030103020301'  # 126 '~'
+    'aa55aa55aa55aa55'  # 127 DEL
+)
+
+
+class FrameBuffer:
+
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format not in (MONO_VLSB, MONO_HLSB):
+            raise ValueError("invalid format")
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.format = format
+        if stride is None:
+            stride = width
+        if format == MONO_HLSB:
+            stride = (stride + 7) & ~7
+        self.stride = stride
+
+    def _set(self, x, y, c):
+        # без проверки границ: вызывающий уже обрезал по буферу
+        if self.format == MONO_VLSB:
+            index, mask = (y >> 3) * self.stride + x, 1 << (y & 7)
+        else:
+            index, mask = (y * self.stride + x) >> 3, 0x80 >> (x & 7)
+        if c:
+            self.buffer[index] |= mask
+        else:
+            self.buffer[index] &= ~mask & 0xFF
+
+    def _get(self, x, y):
+        if self.format == MONO_VLSB:
+            return self.buffer[(y >> 3) * self.stride + x] >> (y & 7) & 1
+        return self.buffer[(y * self.stride + x) >> 3] >> (7 - (x & 7)) & 1
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        if c is None:
+            return self._get(x, y)
+        self._set(x, y, c)
+
+    def fill(self, c):
+        if self.format == MONO_VLSB:
+            padded = self.stride != self.width or self.height & 7
+            size = (self.height >> 3) * self.stride
+        else:
+            padded = self.stride != self.width
+            size = (self.stride >> 3) * self.height
+        if padded:
+            # биты выравнивания MicroPython не трогает
+            self.fill_rect(0, 0, self.width, self.height, c)
+            return
+        self.buffer[:size] = (b"\xff" if c else b"\x00") * size
+
+    def fill_rect(self, x, y, w, h, c):
+        if w < 1 or h < 1 or x + w <= 0 or y + h <= 0 or x >= self.width or y >= self.height:
+            return
+        x_end, y_end = min(self.width, x + w), min(self.height, y + h)
+        x, y = max(x, 0), max(y, 0)
+        for yy in range(y, y_end):
+            for xx in range(x, x_end):
+                self._set(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.fill_rect(x, y, w, 1, c)
+        self.fill_rect(x, y + h - 1, w, 1, c)
+        self.fill_rect(x, y, 1, h, c)
+        self.fill_rect(x + w - 1, y, 1, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        # тот же Брезенхем, что в modframebuf.c: другой дает другие точки наклонных линий
+        dx, sx = (x2 - x1, 1) if x2 > x1 else (x1 - x2, -1)
+        dy, sy = (y2 - y1, 1) if y2 > y1 else (y1 - y2, -1)
+        steep = dy > dx
+        if steep:
+            x1, y1, dx, dy, sx, sy = y1, x1, dy, dx, sy, sx
+        e = 2 * dy - dx
+        for _ in range(dx):
+            px, py = (y1, x1) if steep else (x1, y1)
+            if 0 <= px < self.width and 0 <= py < self.height:
+                self._set(px, py, c)
+            while e >= 0:
+                y1 += sy
+                e -= 2 * dx
+            x1 += sx
+            e += 2 * dy
+        if 0 <= x2 < self.width and 0 <= y2 < self.height:
+            self._set(x2, y2, c)
+
+    def text(self, s, x, y, c=1):
+        for code in s.encode():
+            if code == 0:
+                break
+            if code < 32 or code > 127:
+                code = 127
+            offset = (code - 32) * 8
+            for column in FONT[offset:offset + 8]:
+                if 0 <= x < self.width:
+                    yy = y
+                    while column:
+                        if column & 1 and 0 <= yy < self.height:
+                            self._set(x, yy, c)
+                        column >>= 1
+                        yy += 1
+                x += 1
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        if x >= self.width or y >= self.height or -x >= fbuf.width or -y >= fbuf.height:
+            return
+        x_end, y_end = min(self.width, x + fbuf.width), min(self.height, y + fbuf.height)
+        x0, y0 = max(0, x), max(0, y)
+        for yy in range(y0, y_end):
+            for xx in range(x0, x_end):
+                c = fbuf._get(xx - x, yy - y)
+                if palette is not None:
+                    c = palette._get(c, 0)
+                if c != key:
+                    self._set(xx, yy, c)
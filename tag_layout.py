@@ -0,0 +1,214 @@
+"""
+Макет ценника: описание (JSON) компилируется один раз в списки операций рисования
+
+    {"static": [[op, plane, args...], ...],
+     "fields": [[field, plane, x, y, font, fmt, limit, align], ...]}
+
+static - рамки, подписи, разделители: рисуются один раз в кэш-буферы,
+при обновлении копируются в буферы кадра целиком.
+op: text (x, y, "строка"), rect/fill_rect (x, y, w, h), hline/vline (x, y, len),
+line (x1, y1, x2, y2). plane: "black" или "red".
+
+fields - данные товара: name, weight, price, total (weight * price).
+font "text" - встроенный 8x8, limit - максимум символов значения;
+font "price" - крупный price_font, limit - максимум ширины в пикселях,
+не влезло - рисуется 8x8 с "rub" вместо знака рубля.
+align "right" - x задает правый край.
+"""
+
+try:
+    import framebuf
+except ImportError:
+    # сервер (tag_render.py): тот же framebuf на чистом Python
+    import tag_framebuf as framebuf
+try:
+    import ujson as json
+except ImportError:
+    import json
+import os
+
+import price_font
+
+LAYOUT_FILE = "layout.json"
+
+DEFAULT_LAYOUT = {
+    "static": [
+        ["rect", "black", 5, 10, 240, 112],
+        ["text", "black", 15, 15, "Name:"],
+        ["hline", "black", 10, 28, 230],
+        ["text", "black", 15, 36, "Weight:"],
+        ["text", "black", 15, 50, "Price/kg:"],
+        ["text", "black", 15, 64, "Total:"],
+    ],
+    "fields": [
+        ["name", "black", 60, 15, "text", "{}", 20, "left"],
+        ["weight", "black", 75, 36, "text", "{} kg", 16, "left"],
+        ["price", "black", 90, 50, "text", "{} rub", 16, "left"],
+        ["total", "red", 237, 80, "price", "{:.2f} ₽", 226, "right"],
+    ],
+}
+
+# число аргументов после plane
+_STATIC_OPS = {
+    "text": 3,
+    "rect": 4,
+    "fill_rect": 4,
+    "hline": 3,
+    "vline": 3,
+    "line": 4,
+}
+_FIELDS = ("name", "weight", "price", "total")
+# значения того же типа, что получает render(): поля товара - строки из кадра
+_SAMPLES = {"name": "Name", "weight": "1.0", "price": "1.0", "total": 1.0}
+_PLANES = ("black", "red")
+
+
+# крупный шрифт цены: символ -> (FrameBuffer глифа, ширина), заполняется при первом рисовании
+_glyph_cache = {}
+
+def price_glyph(char):
+    glyph = _glyph_cache.get(char)
+    if glyph is None:
+        entry = price_font.GLYPHS.get(char)
+        if entry is None:
+            return None
+        offset, width = entry
+        size = (width + 7) // 8 * price_font.HEIGHT
+        bitmap = bytearray(price_font.BITMAPS[offset:offset + size])
+        glyph = (framebuf.FrameBuffer(bitmap, width, price_font.HEIGHT, framebuf.MONO_HLSB), width)
+        _glyph_cache[char] = glyph
+    return glyph
+
+def price_text_width(text):
+    # None - в шрифте нет какого-то символа
+    width = 0
+    for char in text:
+        entry = price_font.GLYPHS.get(char)
+        if entry is None:
+            return None
+        width += entry[1]
+    return width
+
+def draw_price_text(fb, text, x, y):
+    """Строка крупным шрифтом: по одному blit на символ, фон глифа (1) прозрачный"""
+    for char in text:
+        glyph = price_glyph(char)
+        if glyph is None:
+            continue
+        fb.blit(glyph[0], x, y, 1)
+        x += glyph[1]
+    return x
+
+
+class Layout:
+    def __init__(self, spec):
+        """Проверка и компиляция описания, ошибка - ValueError"""
+        if not isinstance(spec, dict):
+            raise ValueError("layout must be an object")
+        self.spec = spec
+        self.static = []
+        for op in spec.get("static", []):
+            if not isinstance(op, list) or len(op) < 2 or op[0] not in _STATIC_OPS:
+                raise ValueError(f"bad static op: {op}")
+            if op[1] not in _PLANES or len(op) != 2 + _STATIC_OPS[op[0]]:
+                raise ValueError(f"bad static op: {op}")
+            # int(None) - TypeError, макет с ним тоже не принимается
+            try:
+                if op[0] == "text":
+                    args = (str(op[4]), int(op[2]), int(op[3]), 0x00)
+                else:
+                    args = tuple(int(v) for v in op[2:]) + (0x00,)
+            except (TypeError, ValueError):
+                raise ValueError(f"bad static op: {op}")
+            self.static.append((op[0], _PLANES.index(op[1]), args))
+
+        self.fields = []
+        for field in spec.get("fields", []):
+            if not isinstance(field, list) or len(field) != 8:
+                raise ValueError(f"bad field: {field}")
+            name, plane, x, y, font, fmt, limit, align = field
+            if name not in _FIELDS or plane not in _PLANES or font not in ("text", "price"):
+                raise ValueError(f"bad field: {field}")
+            # "{1}", "{name}", "{:d}" проходят проверку типов, но падают при
+            # каждом рисовании - такой макет не принимается целиком
+            try:
+                str(fmt).format(_SAMPLES[name])
+            except Exception as e:
+                raise ValueError(f"bad format in field {field}: {e}")
+            try:
+                self.fields.append((name, _PLANES.index(plane), int(x), int(y), font == "price",
+                                    str(fmt), int(limit), align == "right"))
+            except (TypeError, ValueError):
+                raise ValueError(f"bad field: {field}")
+
+        # статический слой, рисуется при первом render()
+        self.static_black = None
+        self.static_red = None
+
+    def _render_static(self, epd):
+        planes = (epd.imageblack, epd.imagered)
+        for plane in planes:
+            plane.fill(0xff)
+        for name, plane, args in self.static:
+            getattr(planes[plane], name)(*args)
+        self.static_black = bytes(epd.buffer_balck)
+        self.static_red = bytes(epd.buffer_red)
+
+    def render(self, epd, product_name, weight, price_per_kg):
+        if self.static_black is None or len(self.static_black) != len(epd.buffer_balck):
+            self._render_static(epd)
+        epd.buffer_balck[:] = self.static_black
+        epd.buffer_red[:] = self.static_red
+
+        try:
+            total = float(weight) * float(price_per_kg)
+        except:
+            total = 0
+        values = {"name": product_name, "weight": weight, "price": price_per_kg, "total": total}
+        planes = (epd.imageblack, epd.imagered)
+
+        for name, plane, x, y, big, fmt, limit, right in self.fields:
+            value = values[name]
+            if isinstance(value, str) and not big:
+                value = value[:limit]
+            try:
+                text = fmt.format(value)
+            except Exception:
+                # формат проверен на образце, но значение может быть другого типа
+                text = str(value)
+            fb = planes[plane]
+
+            if big:
+                width = price_text_width(text)
+                if width is not None and width <= limit:
+                    draw_price_text(fb, text, x - width if right else x, y)
+                    continue
+                # не влезло или нет символа в шрифте - мелким шрифтом
+                text = text.replace("₽", "rub")
+                y += (price_font.HEIGHT - 8) // 2
+            width = len(text) * 8
+            fb.text(text, x - width if right else x, y, 0x00)
+
+
+def load_layout(filename=LAYOUT_FILE):
+    try:
+        with open(filename, "r") as f:
+            layout = Layout(json.load(f))
+        print(f"Layout loaded from {filename}")
+        return layout
+    except Exception as e:
+        # испорченный файл не должен ронять ценник при каждой загрузке
+        if not isinstance(e, OSError):
+            print(f"Bad layout in {filename}: {e}")
+        return Layout(DEFAULT_LAYOUT)
+
+def save_layout(layout, filename=LAYOUT_FILE):
+    tmp = filename + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(layout.spec, f)
+        os.rename(tmp, filename)
+        return True
+    except OSError as e:
+        print(f"Error saving layout: {e}")
+        return False
@@ -0,0 +1,70 @@
+"""
+Рендер ценника на сервере: тот же макет (tag_layout.py) и шрифт цены, что
+на ценнике, в такие же буферы кадра. На ценник уходит сжатая разность
+с последним подтвержденным кадром (tag_bitmap.py), ценник ничего не рисует.
+
+framebuf на CPython - tag_framebuf.py со встроенным шрифтом ценника:
+кадр совпадает с тем, что ценник нарисовал бы сам, попиксельно.
+"""
+
+import base64
+
+import tag_bitmap
+import tag_framebuf as framebuf
+import tag_layout
+
+# буферы кадра EPD_2in13_B_V4_Landscape: 250 точек по x, 122 -> 128 строк
+WIDTH = 250
+ROWS = 128
+
+
+class Canvas:
+    """Буферы кадра с теми же именами, что у драйвера панели (для Layout.render)"""
+
+    def __init__(self):
+        self.buffer_balck = bytearray(b"\xff" * (WIDTH * ROWS // 8))
+        self.buffer_red = bytearray(b"\xff" * (WIDTH * ROWS // 8))
+        self.imageblack = framebuf.FrameBuffer(self.buffer_balck, WIDTH, ROWS, framebuf.MONO_VLSB)
+        self.imagered = framebuf.FrameBuffer(self.buffer_red, WIDTH, ROWS, framebuf.MONO_VLSB)
+
+    def image(self):
+        return bytes(self.buffer_balck) + bytes(self.buffer_red)
+
+
+_layouts = {}
+
+
+def _layout(spec):
+    # скомпилированный макет со статическим слоем, ключ - сам JSON
+    key = repr(spec)
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = tag_layout.Layout(spec if spec is not None else tag_layout.DEFAULT_LAYOUT)
+        _layouts[key] = layout
+    return layout
+
+
+def render_image(product_name, weight, price, layout=None):
+    """Кадр ценника (tag_bitmap.IMAGE_SIZE байт), layout - макет, отправленный на ценник"""
+    canvas = Canvas()
+    _layout(layout).render(canvas, str(product_name), str(weight), str(price))
+    return canvas.image()
+
+
+def image_digest(image):
+    size = tag_bitmap.PLANE_SIZE
+    return tag_bitmap.digest(image[:size], image[size:])
+
+
+def bitmap_update(image, base=None):
+    """
+    Тело запроса /api/bitmap шлюза: дельта к base (последнему подтвержденному
+    кадру) или ключевой кадр, если base нет
+    """
+    data = tag_bitmap.encode(image, base)
+    return {
+        "data": base64.b64encode(data).decode(),
+        "base": image_digest(base) if base is not None else 0,
+        "img": image_digest(image),
+        "bytes": len(data),
+    }
@@ -0,0 +1,373 @@
+"""
+Общее состояние веб-интерфейса в SQLite (state.db рядом с app.py)
+
+Ценники хранятся в базе, а не в списке в памяти процесса, поэтому сервер
+можно запускать в несколько процессов (gunicorn -w 4 app:app): все процессы
+видят одни и те же ценники, изменения одного сразу видны остальным.
+
+    tags     - id, JSON ценника, version (номер изменения, на котором
+               строка записана последний раз)
+    meta     - version: общий счетчик изменений; setup: отметка
+               начальной настройки (setup_done / mark_setup)
+    bitmaps  - подтвержденное / отправленное изображение (render="server")
+    events   - журнал событий для /api/events, id общий на все процессы
+    batches  - отложенные изменения цен (/api/schedule), их отчеты и время
+               начала отправки (fired: пакет отправляет один процесс)
+    leader   - какой процесс выполняет фоновые задачи
+    gateway_slots  - занятые места на шлюзах (concurrency на все процессы)
+    gateway_health - отказы шлюзов подряд и до какого времени шлюз недоступен
+
+Процесс держит разобранные ценники у себя и перед чтением сверяет общий
+счетчик: если он не изменился, чтение - один SELECT, иначе перечитываются
+только строки новее своего номера. WAL: читатели не ждут писателя.
+
+Потоки (threaded=True, gunicorn --threads):
+    чтение - снимок (Snapshot): неизменяемые ценники на один номер
+             изменения. Снимок не меняется никогда: новые строки попадают
+             в новый снимок (копия словаря ссылок, copy-on-write), который
+             заменяет старый одним присваиванием. Читатель без блокировок
+             видит все ценники на один момент, даже если пишут параллельно.
+    запись - update / update_many: поля ценников одной транзакцией
+             (BEGIN IMMEDIATE), писатели всех потоков и процессов идут
+             по очереди, поля, которые меняет другой писатель, не теряются.
+             changes может быть функцией от текущего ценника - проверка
+             и запись в одной транзакции.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+STATE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state.db')
+EVENTS_KEEP = 1024      # событий в журнале, переподключению хватает HISTORY_SIZE
+LEADER_TTL_S = 10       # отметка ведущего процесса; не обновил - задачи берет другой
+SLOT_TTL_S = 60         # место на шлюзе; процесс упал посреди запроса - место освободится само
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('ценник из снимка только для чтения: изменения - TagStore.update, копия - dict(tag)')
+
+
+class FrozenDict(dict):
+    """Ценник (и вложенные словари) в снимке; json / jsonify / шаблоны - как с dict"""
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # copy / pickle - обычный изменяемый dict
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """Списки внутри ценника (макет) - тоже list, tag_layout проверяет isinstance"""
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+class Snapshot:
+    """
+    Ценники на номер изменения version: tags - id -> ценник, values - в порядке id,
+    versions - id -> номер изменения, на котором ценник менялся последний раз
+    """
+    __slots__ = ('version', 'tags', 'values', 'versions')
+
+    def __init__(self, version, tags, versions):
+        self.version = version
+        self.tags = tags
+        self.values = tuple(tags.values())
+        self.versions = versions
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS tags_version ON tags (version);
+CREATE TABLE IF NOT EXISTS bitmaps (id INTEGER PRIMARY KEY, acked BLOB, pending BLOB);
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT NOT NULL, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY AUTOINCREMENT, at REAL NOT NULL, changes TEXT NOT NULL,
+                                    state TEXT NOT NULL, report TEXT, fired REAL);
+CREATE TABLE IF NOT EXISTS leader (id INTEGER PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS gateway_slots (gateway TEXT NOT NULL, slot INTEGER NOT NULL, owner TEXT NOT NULL,
+                                          until REAL NOT NULL, PRIMARY KEY (gateway, slot));
+CREATE TABLE IF NOT EXISTS gateway_health (gateway TEXT PRIMARY KEY, failures INTEGER NOT NULL,
+                                           down_until REAL NOT NULL);
+"""
+
+
+class TagStore:
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self.local = threading.local()      # соединение SQLite - на поток
+        self.lock = threading.Lock()        # только замена снимка
+        self.current = Snapshot(-1, {}, {})
+        self.owner = uuid.uuid4().hex
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        if 'fired' not in {column[1] for column in db.execute('PRAGMA table_info(batches)')}:
+            # база, созданная до отметки отправки пакетов
+            try:
+                db.execute('ALTER TABLE batches ADD COLUMN fired REAL')
+            except sqlite3.OperationalError:
+                pass    # добавил другой процесс
+
+    def _db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # isolation_level=None: транзакции только явные
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _bump(db):
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    # ценники
+
+    def seed(self, tags):
+        """Ценники, которых еще нет в базе (первый запуск)"""
+        with self._write() as db:
+            version = self._bump(db)
+            db.executemany('INSERT OR IGNORE INTO tags (id, data, version) VALUES (?, ?, ?)',
+                           [(tag['id'], json.dumps(tag, ensure_ascii=False), version) for tag in tags])
+
+    def snapshot(self):
+        """Снимок всех ценников на последний номер изменения"""
+        current = self.current
+        db = self._db()
+        # одна читающая транзакция: номер и строки из одного состояния базы
+        db.execute('BEGIN')
+        try:
+            version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            if version == current.version:
+                return current
+            rows = db.execute('SELECT id, data, version FROM tags WHERE version > ?',
+                              (current.version,)).fetchall()
+        finally:
+            db.execute('COMMIT')
+        with self.lock:
+            current = self.current
+            if version > current.version:
+                # копия ссылок, старый снимок остается у тех, кто его читает
+                tags = dict(current.tags)
+                versions = dict(current.versions)
+                for tag_id, data, tag_version in rows:
+                    tags[tag_id] = freeze(json.loads(data))
+                    versions[tag_id] = tag_version
+                if len(tags) != len(current.tags):
+                    tags = dict(sorted(tags.items()))
+                current = self.current = Snapshot(version, tags, versions)
+        return current
+
+    def tags(self):
+        """Все ценники снимка (кортеж, ценники только для чтения)"""
+        return self.snapshot().values
+
+    def tag(self, tag_id):
+        return self.snapshot().tags.get(tag_id)
+
+    def update(self, tag_id, changes):
+        """
+        Поля changes в ценник; changes(tag) -> поля - вычислить по текущему
+        ценнику в той же транзакции. Ценник после изменения или None, если его нет
+        """
+        return self.update_many([(tag_id, changes)])[0]
+
+    def update_many(self, updates):
+        """
+        [(tag_id, changes)] одной транзакцией: читатели видят или все изменения,
+        или ни одного. Ценники после изменения (None - нет такого)
+        """
+        result = []
+        with self._write() as db:
+            version = None
+            for tag_id, changes in updates:
+                row = db.execute('SELECT data FROM tags WHERE id = ?', (tag_id,)).fetchone()
+                if row is None:
+                    result.append(None)
+                    continue
+                tag = json.loads(row[0])
+                if callable(changes):
+                    changes = changes(freeze(tag))
+                if changes:
+                    tag.update(changes)
+                    if version is None:
+                        version = self._bump(db)
+                    db.execute('UPDATE tags SET data = ?, version = ? WHERE id = ?',
+                               (json.dumps(tag, ensure_ascii=False), version, tag_id))
+                result.append(freeze(tag))
+        return result
+
+    # изображения ценников, которые рисует сервер
+
+    def bitmap(self, tag_id):
+        row = self._db().execute('SELECT acked, pending FROM bitmaps WHERE id = ?', (tag_id,)).fetchone()
+        return {'acked': row[0], 'pending': row[1]} if row else None
+
+    def set_bitmap(self, tag_id, acked, pending):
+        with self._write() as db:
+            db.execute('INSERT OR REPLACE INTO bitmaps (id, acked, pending) VALUES (?, ?, ?)',
+                       (tag_id, acked, pending))
+
+    def settle_bitmap(self, tag_id, delivered):
+        """Отправленное изображение подтверждено (станет базой) или потеряно (база тоже)"""
+        with self._write() as db:
+            if delivered:
+                db.execute('UPDATE bitmaps SET acked = pending, pending = NULL '
+                           'WHERE id = ? AND pending IS NOT NULL', (tag_id,))
+            else:
+                db.execute('DELETE FROM bitmaps WHERE id = ? AND pending IS NOT NULL', (tag_id,))
+
+    def drop_bitmap(self, tag_id):
+        with self._write() as db:
+            db.execute('DELETE FROM bitmaps WHERE id = ?', (tag_id,))
+
+    # журнал событий
+
+    def append_event(self, event, data):
+        """data - уже JSON; возвращает id события"""
+        with self._write() as db:
+            event_id = db.execute('INSERT INTO events (event, data) VALUES (?, ?)', (event, data)).lastrowid
+            if event_id % EVENTS_KEEP == 0:
+                db.execute('DELETE FROM events WHERE id <= ?', (event_id - EVENTS_KEEP,))
+        return event_id
+
+    def events_after(self, event_id, limit=EVENTS_KEEP):
+        return self._db().execute('SELECT id, event, data FROM events WHERE id > ? ORDER BY id LIMIT ?',
+                                  (event_id, limit)).fetchall()
+
+    def last_event_id(self):
+        return self._db().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    # отложенные изменения цен
+
+    def add_batch(self, at, changes):
+        with self._write() as db:
+            return db.execute("INSERT INTO batches (at, changes, state) VALUES (?, ?, 'new')",
+                              (at, json.dumps(changes, ensure_ascii=False))).lastrowid
+
+    def batches(self):
+        rows = self._db().execute('SELECT id, at, changes, state, report, fired FROM batches ORDER BY id').fetchall()
+        return [{'id': batch_id, 'at': at, 'changes': [tuple(change) for change in json.loads(changes)],
+                 'state': state, 'report': json.loads(report) if report else None, 'fired': fired}
+                for batch_id, at, changes, state, report, fired in rows]
+
+    def set_batch_report(self, batch_id, report):
+        # отмена из другого процесса не затирается, пока пакет не начал отправляться
+        with self._write() as db:
+            db.execute("UPDATE batches SET state = ?, report = ? "
+                       "WHERE id = ? AND (state != 'cancelled' OR ? IN ('sending', 'done'))",
+                       (report['state'], json.dumps(report), batch_id, report['state']))
+
+    def cancel_batch(self, batch_id):
+        with self._write() as db:
+            return db.execute("UPDATE batches SET state = 'cancelled' "
+                              "WHERE id = ? AND state IN ('new', 'waiting', 'staged') AND fired IS NULL",
+                              (batch_id,)).rowcount > 0
+
+    def claim_batch(self, batch_id):
+        """
+        Отметка отправки пакета (время) перед отправкой: True - отправляет вызвавший,
+        False - пакет отменен или уже отправлен (ведущий процесс сменился, а старый
+        успел отправить в том же тике)
+        """
+        with self._write() as db:
+            return db.execute("UPDATE batches SET fired = ? WHERE id = ? AND fired IS NULL AND state != 'cancelled'",
+                              (time.time(), batch_id)).rowcount > 0
+
+    # фоновые задачи
+
+    def lead(self, ttl=LEADER_TTL_S):
+        """
+        True - фоновые задачи (планировщик, опрос доставки) выполняет этот
+        процесс. Вызывать чаще ttl: отметка продлевается, пока процесс жив
+        """
+        now = time.time()
+        with self._write() as db:
+            row = db.execute('SELECT owner, until FROM leader WHERE id = 1').fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            db.execute('INSERT OR REPLACE INTO leader (id, owner, until) VALUES (1, ?, ?)',
+                       (self.owner, now + ttl))
+        return True
+
+    def setup_done(self, fingerprint):
+        """Начальная настройка с этим отпечатком (число) уже выполнена"""
+        row = self._db().execute("SELECT value FROM meta WHERE key = 'setup'").fetchone()
+        return row is not None and row[0] == fingerprint
+
+    def mark_setup(self, fingerprint):
+        with self._write() as db:
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('setup', ?)", (fingerprint,))
+
+    # шлюзы: общие для процессов места и доступность (gateway_registry.py)
+
+    def acquire_slot(self, gateway_id, concurrency, ttl=SLOT_TTL_S):
+        """Номер свободного места на шлюзе (занято до release_slot или ttl) или None"""
+        now = time.time()
+        with self._write() as db:
+            busy = {slot for slot, until in db.execute('SELECT slot, until FROM gateway_slots WHERE gateway = ?',
+                                                       (gateway_id,)) if until > now}
+            for slot in range(concurrency):
+                if slot not in busy:
+                    db.execute('INSERT OR REPLACE INTO gateway_slots (gateway, slot, owner, until) '
+                               'VALUES (?, ?, ?, ?)', (gateway_id, slot, self.owner, now + ttl))
+                    return slot
+        return None
+
+    def release_slot(self, gateway_id, slot):
+        with self._write() as db:
+            db.execute('DELETE FROM gateway_slots WHERE gateway = ? AND slot = ? AND owner = ?',
+                       (gateway_id, slot, self.owner))
+
+    def gateway_health(self):
+        """id шлюза -> (отказов подряд, down_until)"""
+        return {gateway_id: (failures, down_until) for gateway_id, failures, down_until in
+                self._db().execute('SELECT gateway, failures, down_until FROM gateway_health')}
+
+    def update_gateway_health(self, gateway_id, step):
+        """
+        step(failures, down_until) -> (failures, down_until, changed) в одной
+        транзакции: отказы из всех процессов считаются вместе, о смене
+        доступности (changed) узнает ровно один процесс
+        """
+        with self._write() as db:
+            row = db.execute('SELECT failures, down_until FROM gateway_health WHERE gateway = ?',
+                             (gateway_id,)).fetchone() or (0, 0)
+            result = step(*row)
+            if tuple(result[:2]) != tuple(row):
+                db.execute('INSERT OR REPLACE INTO gateway_health (gateway, failures, down_until) '
+                           'VALUES (?, ?, ?)', (gateway_id, result[0], result[1]))
+        return result